@@ -0,0 +1,178 @@
+"""
+在本地模拟的 eMAG 上测试爬虫性能
+
+用法：python -m benchmarks.bench_crawler --output bench.json
+
+在无头 Chromium 中分别运行 category_handler（单页）和 crawl_category（完整类目），
+输出每秒处理的产品卡片数、各阶段耗时、峰值内存，结果为 json，方便不同提交之间对比
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from pathlib import Path
+import re
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from playwright.async_api import async_playwright
+
+from emag_crawler.handlers import category_page
+from emag_crawler.logger import logger
+from emag_crawler.metrics import metrics
+import to_exe
+
+from .fake_emag import FakeEmagConfig, FakeEmagServer
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from playwright.async_api import BrowserContext, Route
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+async def route_to_fake_emag(context: BrowserContext, base_url: str) -> None:
+    """把 context 内所有发往 www.emag.ro 的请求转发到本地模拟的 eMAG"""
+
+    async def handler(route: Route) -> None:
+        url = route.request.url.replace('https://www.emag.ro', base_url, 1)
+        response = await route.fetch(url=url)
+        await route.fulfill(response=response)
+
+    await context.route(re.compile(r'^https://www\.emag\.ro/'), handler)
+
+
+def peak_rss_kb() -> dict[str, int]:
+    """本进程与已退出的子进程（浏览器）的峰值内存（KB）"""
+    if resource is None:
+        return dict()
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+async def run_benchmark(config: FakeEmagConfig, concurrency: int, headless: bool) -> dict[str, Any]:
+    first_page_url = 'https://www.emag.ro/laptopuri/c'
+    scenarios: dict[str, Any] = dict()
+
+    with FakeEmagServer(config) as server, TemporaryDirectory() as tmp_dir:
+        original_setup_context = to_exe.setup_context
+
+        async def setup_context(context: BrowserContext) -> None:
+            await original_setup_context(context)
+            await route_to_fake_emag(context, server.base_url)
+
+        to_exe.setup_context = setup_context
+
+        try:
+            async with async_playwright() as pwr:
+                browser = await pwr.chromium.launch(headless=headless)
+
+                # 单页 category_handler
+                metrics.reset()
+                context = await browser.new_context()
+                await setup_context(context)
+                start_time = perf_counter()
+                page = await to_exe.goto_category_page(context, first_page_url, logger)
+                items = await category_page.category_handler(page, 'bench', logger.bind(category='bench'))
+                elapsed = perf_counter() - start_time
+                await context.close()
+                scenarios['category_handler'] = {
+                    'cards': len(items),
+                    'cart_added': sum(1 for _ in items if _.cart_added),
+                    'elapsed': round(elapsed, 4),
+                    'cards_per_s': round(len(items) / elapsed, 2),
+                    'phases': metrics.summary(by_tags=False),
+                }
+
+                # 完整类目 crawl_category
+                metrics.reset()
+                context = await browser.new_context()
+                await setup_context(context)
+                start_time = perf_counter()
+                report = await to_exe.crawl_category(
+                    browser, context, 'bench', first_page_url, Path(tmp_dir), concurrency
+                )
+                elapsed = perf_counter() - start_time
+                await context.close()
+                scenarios['start_crawler'] = {
+                    'cards': report.crawled_products,
+                    'cart_added': report.cart_added_products,
+                    'pages': len(report.crawled_pages),
+                    'failed_pages': len(report.failed_pages),
+                    'elapsed': round(elapsed, 4),
+                    'cards_per_s': round(report.crawled_products / elapsed, 2),
+                    'phases': metrics.summary(by_tags=False),
+                }
+
+                await browser.close()
+        finally:
+            to_exe.setup_context = original_setup_context
+
+        request_counts = dict(server.request_counts)
+
+    return {
+        'commit': git_commit(),
+        'config': config.model_dump(),
+        'concurrency': concurrency,
+        'scenarios': scenarios,
+        'server_requests': request_counts,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='在本地模拟的 eMAG 上测试爬虫性能')
+    parser.add_argument('--products', type=int, default=300, help='类目的产品总数')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的额外延迟（秒）')
+    parser.add_argument('--addtocart-latency', type=float, default=0.05, help='加购请求的额外延迟（秒）')
+    parser.add_argument('--challenge-rate', type=float, default=0.0, help='请求返回 511 的概率')
+    parser.add_argument(
+        '--no-addtocart-payload', action='store_true', help='加购接口不返回最大可加购数，只能从购物车页解析'
+    )
+    parser.add_argument('--concurrency', type=int, default=3, help='同时爬取的页数')
+    parser.add_argument('--headed', action='store_true', help='显示浏览器窗口')
+    parser.add_argument('--output', type=Path, default=None, help='结果保存路径，不传时输出到 stdout')
+    args = parser.parse_args()
+
+    # 只保留警告以上的日志，避免日志输出影响结果
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    config = FakeEmagConfig(
+        product_count=args.products,
+        latency=args.latency,
+        addtocart_latency=args.addtocart_latency,
+        challenge_rate=args.challenge_rate,
+        addtocart_payload=not args.no_addtocart_payload,
+    )
+    result = asyncio.run(run_benchmark(config, args.concurrency, not args.headed))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""本地模拟的 eMAG，用于性能测试"""
+
+from __future__ import annotations
+
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from random import Random
+import re
+from threading import Lock, Thread
+from time import sleep
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    from typing import Optional, Self
+
+
+class FakeEmagConfig(BaseModel):
+    """模拟 eMAG 的配置"""
+
+    product_count: int = Field(300, ge=0, description='每个类目的产品总数')
+    page_size: int = Field(60, ge=1, description='每页的产品数')
+    promoted_every: int = Field(10, ge=0, description='每隔多少个产品插入一个 Promovat 卡片，0 为不插入')
+    latency: float = Field(0.0, ge=0.0, description='每个请求的额外延迟（秒）')
+    addtocart_latency: float = Field(0.05, ge=0.0, description='加购请求的额外延迟（秒）')
+    challenge_rate: float = Field(0.0, ge=0.0, le=1.0, description='请求返回 511 的概率')
+    addtocart_payload: bool = Field(True, description='加购接口是否返回购物车行和最大可加购数')
+    seed: int = Field(0, description='随机数种子')
+
+
+_category_path_pattern = re.compile(r'^/(?P<slug>[\w-]+)(?:/p(?P<page>\d+))?/c$')
+
+
+def max_qty_of(offer_id: int) -> int:
+    """模拟产品的最大可加购数"""
+    return offer_id % 7 + 1
+
+
+def _card_html(offer_id: int, rank: int, promoted: bool) -> str:
+    pnk = f'D{offer_id:08d}'
+    badge = ''
+    if promoted:
+        badge = '<span class="card-v2-badge-cmp bg-light">Promovat</span>'
+    elif rank % 5 == 0:
+        badge = '<span class="card-v2-badge-cmp">Top Favorite</span>'
+    rating = f'<span class="average-rating">{3 + rank % 2}.{rank % 10}</span>' if rank % 4 != 0 else ''
+    review = f'<span class="visible-xs-inline-block">({rank * 3})</span>' if rank % 4 != 0 else ''
+
+    return (
+        f'<div class="card-item card-standard js-product-data" data-offer-id="{offer_id}" '
+        f'data-url="https://www.emag.ro/produs-{offer_id}/pd/{pnk}/">'
+        f'<div class="img-component"><img src="https://s13emagst.akamaized.net/products/{offer_id}/res.jpg?width=300"></div>'
+        f'{badge}<a class="card-v2-title" href="/produs-{offer_id}/pd/{pnk}/">Produs de test {offer_id}</a>'
+        f'{rating}{review}'
+        f'<p class="product-new-price">{100 + offer_id % 900}<sup><small class="mf-decimal">,</small>99</sup> '
+        f'<span>Lei</span></p>'
+        f'<button type="button" class="btn btn-primary yeahIWantThisProduct">Adauga in Cos</button>'
+        f'</div>'
+    )
+
+
+_page_script = """<script>
+document.addEventListener('click', (event) => {
+    const addButton = event.target.closest('button.yeahIWantThisProduct');
+    if (addButton !== null) {
+        const card = addButton.closest('div.card-item');
+        fetch('/newaddtocart', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/x-www-form-urlencoded', 'X-Requested-With': 'XMLHttpRequest' },
+            body: 'product%5B%5D=' + card.dataset.offerId + '&quantity=1',
+        });
+    }
+
+    const removeButton = event.target.closest('button.btn-remove-product');
+    if (removeButton !== null) {
+        const widget = removeButton.closest('div.cart-widget');
+        fetch('/cart/remove', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/x-www-form-urlencoded', 'X-Requested-With': 'XMLHttpRequest' },
+            body: 'line_id=' + widget.dataset.id.replace(/^line_/, ''),
+        }).then(() => widget.remove());
+    }
+});
+</script>"""
+
+
+class FakeEmagServer:
+    """
+    本地模拟的 eMAG
+
+    提供类目页（/<slug>/c、/<slug>/pN/c）、加购接口（/newaddtocart）、购物车页（/cart/products）
+    和移出购物车接口（/cart/remove），购物车按 cookie 区分
+    """
+
+    def __init__(
+        self, config: Optional[FakeEmagConfig] = None, host: str = '127.0.0.1', port: int = 0
+    ) -> None:
+        self.config = config or FakeEmagConfig()
+        self._random = Random(self.config.seed)
+        self._lock = Lock()
+        self.carts: dict[str, dict[int, int]] = dict()
+        """{ session: { data-offer-id: 数量 } }"""
+        self.request_counts: dict[str, int] = dict()
+        """{ 路径类型: 请求数 }"""
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server._handle(self)
+
+            def do_POST(self) -> None:
+                server._handle(self)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> Self:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def _challenged(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.challenge_rate
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        if self.config.latency > 0:
+            sleep(self.config.latency)
+
+        path = urlsplit(request.path).path
+        cookie = SimpleCookie(request.headers.get('Cookie', ''))
+        session = cookie['fake_sid'].value if 'fake_sid' in cookie else uuid4().hex
+
+        body = b''
+        if request.command == 'POST':
+            body = request.rfile.read(int(request.headers.get('Content-Length', 0)))
+        form = parse_qs(body.decode())
+
+        if self._challenged():
+            self._count('challenge')
+            return self._send(request, session, 511, 'text/html', '<html><body>challenge</body></html>')
+
+        if request.command == 'GET' and (m := _category_path_pattern.match(path)) is not None:
+            self._count('category')
+            return self._send(request, session, 200, 'text/html', self.category_html(int(m['page'] or 1)))
+
+        if request.command == 'POST' and path == '/newaddtocart':
+            self._count('newaddtocart')
+            if self.config.addtocart_latency > 0:
+                sleep(self.config.addtocart_latency)
+            lines: list[dict[str, int]] = list()
+            with self._lock:
+                cart = self.carts.setdefault(session, dict())
+                for offer_id in form.get('product[]', []):
+                    cart[int(offer_id)] = cart.get(int(offer_id), 0) + 1
+                    lines.append(
+                        {
+                            'offer_id': int(offer_id),
+                            'quantity': cart[int(offer_id)],
+                            'max_quantity': max_qty_of(int(offer_id)),
+                        }
+                    )
+            payload: dict[str, object] = {'status': 'success'}
+            # NOTICE 响应结构是按 cart_page._payload_max_qty_keys 的猜测构造的，不代表真实的 eMAG 响应
+            if self.config.addtocart_payload:
+                payload['data'] = {'lines': lines}
+            return self._send(request, session, 200, 'application/json', json.dumps(payload))
+
+        if request.command == 'GET' and path == '/cart/products':
+            self._count('cart')
+            with self._lock:
+                cart = dict(self.carts.get(session, dict()))
+            return self._send(request, session, 200, 'text/html', self.cart_html(cart))
+
+        if request.command == 'POST' and path == '/cart/remove':
+            self._count('remove')
+            with self._lock:
+                cart = self.carts.setdefault(session, dict())
+                for line_id in form.get('line_id', []):
+                    cart.pop(int(line_id), None)
+            return self._send(request, session, 200, 'application/json', json.dumps({'status': 'success'}))
+
+        self._count('other')
+        return self._send(request, session, 404, 'text/plain', 'not found')
+
+    def _send(
+        self,
+        request: BaseHTTPRequestHandler,
+        session: str,
+        status: int,
+        content_type: str,
+        body: str,
+    ) -> None:
+        data = body.encode()
+        request.send_response(status)
+        request.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.send_header('Set-Cookie', f'fake_sid={session}; Path=/')
+        request.end_headers()
+        request.wfile.write(data)
+
+    def category_html(self, page: int) -> str:
+        """第 page 页的类目页"""
+        config = self.config
+        first_rank = (page - 1) * config.page_size + 1
+        last_rank = min(page * config.page_size, config.product_count)
+
+        cards: list[str] = list()
+        for rank in range(first_rank, last_rank + 1):
+            if config.promoted_every > 0 and rank % config.promoted_every == 0:
+                cards.append(_card_html(900000 + rank, rank, promoted=True))
+            cards.append(_card_html(100000 + rank, rank, promoted=False))
+
+        return (
+            '<!DOCTYPE html><html><head><title>Fake eMAG</title></head><body>'
+            '<div class="control-label js-listing-pagination">'
+            f'<strong>{first_rank} - {last_rank}</strong> din <strong>{config.product_count}</strong> rezultate'
+            '</div>'
+            f'<div class="card-collection">{''.join(cards)}</div>'
+            f'{_page_script}</body></html>'
+        )
+
+    def cart_html(self, cart: dict[int, int]) -> str:
+        """购物车页"""
+        widgets = ''.join(
+            f'<div class="cart-widget" data-id="line_{offer_id}">'
+            f'<input type="number" value="{qty}" min="1" max="{max_qty_of(offer_id)}">'
+            f'<button type="button" class="btn-remove-product">Sterge</button>'
+            f'</div>'
+            for offer_id, qty in cart.items()
+        )
+        return f'<!DOCTYPE html><html><body><div class="cart-products">{widgets}</div>{_page_script}</body></html>'
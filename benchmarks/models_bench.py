@@ -0,0 +1,103 @@
+"""
+对比 ProductCardItem 的几种构造方式
+
+用法：python -m benchmarks.models_bench --items 100000 --output models_bench.json
+
+分别用整批校验（ProductCardItem.trusted_many）、逐个校验（model_validate）和跳过校验（model_construct）构造相同的合成数据，
+再对每个产品各 model_dump 两次，输出各阶段的耗时
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from emag_crawler.models import ProductCardItem
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+
+def synthetic_records(count: int) -> list[dict[str, Any]]:
+    """与 build_card_item 构造的字段一致的合成数据"""
+    records: list[dict[str, Any]] = list()
+    for i in range(count):
+        offer_id = 100000 + i
+        page_num = i // 60 + 1
+        records.append(
+            {
+                'title': f'Produs de test {offer_id}',
+                'pnk': f'D{offer_id:08d}',
+                'product_id': str(offer_id),
+                'category': f'categorie-{i % 20}',
+                'source_url': f'https://www.emag.ro/categorie-{i % 20}/p{page_num}/c',
+                'rank_in_page': i % 60 + 1,
+                'top_favorite': i % 5 == 0,
+                'price': 100 + i % 900 + 0.99,
+                'rating': None if i % 4 == 0 else 3 + (i % 20) / 10,
+                'review': i * 3 % 2000,
+                'image_url': f'https://s13emagst.akamaized.net/products/{offer_id}/res.jpg',
+                'cart_added': i % 3 != 0,
+                'max_qty': None if i % 3 == 0 else i % 7 + 1,
+            }
+        )
+    return records
+
+
+def build_each(records: list[dict[str, Any]], validate: bool) -> list[ProductCardItem]:
+    if validate:
+        return [ProductCardItem.model_validate(_) for _ in records]
+    return [ProductCardItem.model_construct(**_) for _ in records]
+
+
+def measure(build: Callable[[], list[ProductCardItem]]) -> dict[str, float]:
+    gc.collect()
+    start_time = perf_counter()
+    items = build()
+    build_elapsed = perf_counter() - start_time
+
+    start_time = perf_counter()
+    for _ in items:
+        _.model_dump()
+    first_dump_elapsed = perf_counter() - start_time
+
+    start_time = perf_counter()
+    for _ in items:
+        _.model_dump()
+    second_dump_elapsed = perf_counter() - start_time
+
+    return {
+        'build': round(build_elapsed, 4),
+        'first_dump': round(first_dump_elapsed, 4),
+        'second_dump': round(second_dump_elapsed, 4),
+        'items_per_s': round(len(items) / (build_elapsed + first_dump_elapsed), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='对比 ProductCardItem 的几种构造方式')
+    parser.add_argument('--items', type=int, default=100000, help='合成数据的产品数')
+    parser.add_argument('--output', type=Path, default=None, help='结果保存路径，不传时输出到 stdout')
+    args = parser.parse_args()
+
+    records = synthetic_records(args.items)
+    result = {
+        'items': args.items,
+        'validated_bulk': measure(lambda: ProductCardItem.trusted_many(records)),
+        'validated': measure(lambda: build_each(records, validate=True)),
+        'constructed': measure(lambda: build_each(records, validate=False)),
+    }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+对比两种导出 xlsx 的性能
+
+用法：python -m benchmarks.xlsx_bench --rows 100000 --output xlsx_bench.json
+
+分别用 create_workbook_template + save_to_xlsx（逐个单元格写入）和 write_products_xlsx（write-only 流式写入）
+导出相同的合成数据，输出耗时、内存峰值和文件大小
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+from pathlib import Path
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+from typing import TYPE_CHECKING
+
+from emag_crawler.logger import logger
+from emag_crawler.xlsx_export import write_products_xlsx
+import to_exe
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterator
+
+
+def synthetic_rows(count: int) -> Iterator[dict[str, Any]]:
+    """与 read_product_json 返回值字段一致的合成数据"""
+    for i in range(count):
+        offer_id = 100000 + i
+        pnk = f'D{offer_id:08d}'
+        yield {
+            'pnk': pnk,
+            'title': f'Produs de test {offer_id} cu un titlu suficient de lung pentru a semana cu cele reale',
+            'category': f'categorie-{i % 20}',
+            'rank': i + 1,
+            'source_url': f'https://www.emag.ro/categorie-{i % 20}/p{i // 60 + 1}/c',
+            'detail_url': f'https://www.emag.ro/produs-{offer_id}/pd/{pnk}/',
+            'image_url': (
+                None if i % 50 == 0 else f'https://s13emagst.akamaized.net/products/{offer_id}/res.jpg'
+            ),
+            'price': 100 + i % 900 + 0.99,
+            'top_favorite': i % 5 == 0,
+            'rating': None if i % 4 == 0 else 3 + (i % 20) / 10,
+            'review': None if i % 4 == 0 else i * 3 % 2000,
+            'max_qty': i % 7 + 1,
+        }
+
+
+def export_legacy(rows: Iterator[dict[str, Any]], save_path: Path) -> None:
+    wb, ws = to_exe.create_workbook_template()
+    to_exe.save_to_xlsx(wb, ws, list(rows), save_path)
+
+
+def export_streaming(rows: Iterator[dict[str, Any]], save_path: Path) -> None:
+    write_products_xlsx(rows, save_path)
+
+
+def measure(
+    export: Callable[[Iterator[dict[str, Any]], Path], None], rows: int, save_path: Path, memory: bool
+) -> dict[str, Any]:
+    gc.collect()
+    start_time = perf_counter()
+    export(synthetic_rows(rows), save_path)
+    elapsed = perf_counter() - start_time
+
+    result: dict[str, Any] = {
+        'elapsed': round(elapsed, 4),
+        'rows_per_s': round(rows / elapsed, 2),
+        'file_size': save_path.stat().st_size,
+    }
+
+    # tracemalloc 会显著拖慢执行，单独再跑一次统计内存峰值
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        export(synthetic_rows(rows), save_path)
+        result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='对比两种导出 xlsx 的性能')
+    parser.add_argument('--rows', type=int, default=100000, help='合成数据的行数')
+    parser.add_argument('--no-memory', action='store_true', help='不统计内存峰值')
+    parser.add_argument('--output', type=Path, default=None, help='结果保存路径，不传时输出到 stdout')
+    args = parser.parse_args()
+
+    # 只保留警告以上的日志，避免日志输出影响结果
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    with TemporaryDirectory() as tmp_dir:
+        result = {
+            'rows': args.rows,
+            'legacy': measure(export_legacy, args.rows, Path(tmp_dir) / 'legacy.xlsx', not args.no_memory),
+            'streaming': measure(
+                export_streaming, args.rows, Path(tmp_dir) / 'streaming.xlsx', not args.no_memory
+            ),
+        }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
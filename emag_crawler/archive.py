@@ -0,0 +1,148 @@
+"""读取 output/ 下归档的爬取结果"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import heapq
+import json
+from operator import itemgetter
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .sink import read_jsonl_items
+
+if TYPE_CHECKING:
+    from typing import Any, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_loads = json.loads if orjson is None else orjson.loads
+"""安装了 orjson 时用 orjson 解析"""
+
+_PRODUCT_FIELDS: tuple[tuple[str, str], ...] = (
+    ('pnk', 'pnk'),
+    ('title', 'title'),
+    ('category', 'category'),
+    ('rank', 'rank_in_category'),
+    ('source_url', 'source_url'),
+    ('detail_url', 'detail_url'),
+    ('image_url', 'image_url'),
+    ('price', 'price'),
+    ('top_favorite', 'top_favorite'),
+    ('rating', 'rating'),
+    ('review', 'review'),
+    ('max_qty', 'max_qty'),
+)
+"""(保留的字段, ProductCardItem 中的字段)"""
+
+_rank_key = itemgetter('rank')
+
+Row = dict[str, 'None | str | int | float | bool']
+"""一个已加购产品的数据"""
+
+
+def page_files(json_dir: Path) -> list[Path]:
+    """
+    一个类目一天的所有页面文件，兼容旧的 json 和 JsonlSink 写入的 jsonl
+
+    同一页同时有 `<页码>.json` 和 `<页码>.jsonl` 时（如升级后重新爬取了当天的页面），只读取 jsonl
+    """
+    files = {f.stem: f for f in json_dir.glob('*.json')}
+    files.update((f.stem, f) for f in json_dir.glob('*.jsonl'))
+    return sorted(files.values())
+
+
+def read_page_records(path: Path) -> list[dict[str, Any]]:
+    """读取一个页面文件中所有产品卡片的完整数据"""
+    if path.suffix == '.jsonl':
+        return read_jsonl_items(path, _loads)
+    return _loads(path.read_bytes())
+
+
+def load_page_file(path: Path) -> list[Row]:
+    """
+    读取一个页面文件，按排名排序，只保留需要的字段和以下产品：
+    已加购、复用了之前爬取的最大可加购数、或取自本次运行中其他位置的最大可加购数
+    """
+    data = read_page_records(path)
+    rows = [
+        {k: d[field] for k, field in _PRODUCT_FIELDS}
+        for d in data
+        if d['cart_added'] is True or d.get('max_qty_cached') is True or d.get('deduped') is True
+    ]
+    # 页面文件本身就是按排名写入的，这里的排序基本是线性的
+    rows.sort(key=_rank_key)
+    return rows
+
+
+def iter_products(
+    json_dirs: Path | list[Path],
+    max_workers: Optional[int] = None,
+    use_processes: bool = False,
+) -> Iterator[Row]:
+    """
+    并行读取一个或多个目录下的页面文件，按排名有序地逐个返回已加购的产品
+
+    每个页面文件已经按排名排序，用 k 路归并合并，不需要对全部数据重新排序；
+    默认用线程池，文件很多、单个文件很大时可以用进程池
+    """
+    if isinstance(json_dirs, Path):
+        json_dirs = [json_dirs]
+    files = [f for d in json_dirs for f in page_files(d)]
+    if len(files) == 0:
+        return iter(())
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=max_workers) as executor:
+        pages = list(executor.map(load_page_file, files))
+
+    return heapq.merge(*pages, key=_rank_key)
+
+
+def _in_date_range(date: str, start: Optional[str], end: Optional[str]) -> bool:
+    """MMDD 是否在 [start, end] 内，start 大于 end 时视为跨年"""
+    if start is not None and end is not None and start > end:
+        return date >= start or date <= end
+    return (start is None or date >= start) and (end is None or date <= end)
+
+
+def archive_dirs(
+    output_dir: Path,
+    category: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> list[tuple[str, Path]]:
+    """
+    output/<category>/<MMDD>/ 中日期在 [start, end] 内的目录，返回 [(MMDD, 目录)]
+
+    start、end 为 MMDD，为 None 时不限制；start 大于 end 时视为跨年（如 1201 到 0131），跨年的日期排在前面
+    """
+    category_dir = output_dir / category
+    if not category_dir.is_dir():
+        return list()
+
+    dirs = [
+        (d.name, d)
+        for d in category_dir.iterdir()
+        if d.is_dir() and len(d.name) == 4 and d.name.isdigit() and _in_date_range(d.name, start, end)
+    ]
+    wraps = start is not None and end is not None and start > end
+    dirs.sort(key=lambda _: (not (wraps and _[0] >= start), _[0]))  # type: ignore
+    return dirs
+
+
+def iter_archived_products(
+    output_dir: Path,
+    category: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    max_workers: Optional[int] = None,
+) -> Iterator[tuple[str, Row]]:
+    """按日期、排名逐个返回 [start, end] 内每天已加购的产品 (MMDD, 产品数据)"""
+    for date, json_dir in archive_dirs(output_dir, category, start, end):
+        for row in iter_products(json_dir, max_workers):
+            yield date, row
@@ -0,0 +1,282 @@
+"""绕过 DOM 点击，直接用 HTTP 请求探测最大可加购数"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import TYPE_CHECKING
+from urllib.parse import quote
+from weakref import WeakKeyDictionary
+
+from scraper_utils.constants.time_constant import MS1000
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .challenge import get_challenge_coordinator
+from .handlers.cart_page import apply_max_qtys, clear_cart, goto_cart_page, is_remove_request
+from .html_parser import parse_cart_html
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+    from loguru import Logger
+    from playwright.async_api import APIRequestContext, BrowserContext, Page, Request
+
+    from .models import ProductCardItem
+
+
+_newaddtocart_endpoint = re.compile(r'/newaddtocart')
+"""加购请求的 endpoint"""
+_newaddtocart_product_id_pattern = re.compile(r'product%5B%5D=(\d+)')
+"""加购请求体中的 data-offer-id"""
+
+_skipped_headers = frozenset(('host', 'cookie', 'content-length', 'connection', 'accept-encoding'))
+"""重放请求时不复制的请求头，由 APIRequestContext 自行处理"""
+
+
+class RequestTemplate:
+    """
+    从浏览器发出的请求中捕获的请求模板
+
+    重放时把模板中的 data-offer-id 替换成其他产品的 data-offer-id
+    """
+
+    def __init__(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str],
+        post_data: Optional[str],
+        product_id: str,
+    ) -> None:
+        self.method = method
+        self.url = url
+        self.headers = {k: v for k, v in headers.items() if k.lower() not in _skipped_headers and k[0] != ':'}
+        self.post_data = post_data
+        self.product_id = product_id
+
+    @classmethod
+    async def capture(cls, request: Request, product_ids: Iterable[str]) -> Optional[RequestTemplate]:
+        """从请求中捕获模板，请求的链接或请求体中需要包含 product_ids 的其中一个"""
+        post_data = request.post_data or ''
+        for product_id in product_ids:
+            if re.search(rf'(?<!\d){product_id}(?!\d)', request.url + ' ' + post_data) is None:
+                continue
+            return cls(
+                request.method, request.url, await request.all_headers(), request.post_data, product_id
+            )
+        return None
+
+    def render(self, product_id: str) -> tuple[str, Optional[str]]:
+        """替换成 product_id 后的 (链接, 请求体)"""
+        pattern = re.compile(rf'(?<!\d){self.product_id}(?!\d)')
+        url = pattern.sub(product_id, self.url)
+        post_data = None if self.post_data is None else pattern.sub(product_id, self.post_data)
+        return url, post_data
+
+
+class CartProbe:
+    """
+    用 HTTP 请求加购、读取购物车、移出购物车
+
+    使用 context.request 发请求，与浏览器共享 cookie（也就共享同一个购物车），并复用连接；
+    加购请求和移出购物车请求的格式从浏览器发出的请求中捕获，未捕获到时加购请求只带 product[]，
+    移出购物车则退回到在浏览器里清空购物车
+
+    捕获到的请求模板在整个 context 内有效，用 get_cart_probe 取用同一个 context 的 CartProbe；
+    同一个 CartProbe 被多个类目共用，logger 由每次调用传入
+    """
+
+    def __init__(
+        self,
+        context: BrowserContext,
+        base_url: str = 'https://www.emag.ro',
+        concurrency: int = 8,
+        remove_endpoint: Optional[re.Pattern[str]] = None,
+    ) -> None:
+        self._context = context
+        self._request: APIRequestContext = context.request
+        self.base_url = base_url.rstrip('/')
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._remove_endpoint = remove_endpoint
+        self._captured_pages: set[Page] = set()
+        self._challenge = get_challenge_coordinator(context)
+
+        self.add_template: Optional[RequestTemplate] = None
+        """加购请求模板"""
+        self._add_captured = asyncio.Event()
+        self.remove_template: Optional[RequestTemplate] = None
+        """移出购物车请求模板"""
+        self._cart_ids: set[str] = set()
+        """最近一次读取到的购物车内的 data-id，用于识别移出购物车请求"""
+
+    def capture(self, page: Page, logger: Logger) -> None:
+        """从页面发出的加购请求中捕获请求模板，记录到打开该页面的类目的 logger"""
+        if page in self._captured_pages:
+            return
+        self._captured_pages.add(page)
+        page.on('request', lambda r: self._on_request(r, logger))
+        page.once('close', lambda p: self._captured_pages.discard(p))
+
+    async def wait_for_add_template(self, timeout: int = 5 * MS1000) -> bool:
+        """等待捕获到加购请求模板，最多等待 timeout 毫秒，返回是否已捕获到"""
+        try:
+            await asyncio.wait_for(self._add_captured.wait(), timeout / 1000)
+        except TimeoutError:
+            pass
+        return self.add_template is not None
+
+    async def _on_request(self, request: Request, logger: Logger) -> None:
+        if request.method != 'POST' or self.add_template is not None:
+            return
+
+        if _newaddtocart_endpoint.search(request.url) is not None:
+            product_id_match = _newaddtocart_product_id_pattern.search(request.post_data or '')
+            if product_id_match is not None:
+                self.add_template = await RequestTemplate.capture(request, (product_id_match.group(1),))
+                self._add_captured.set()
+                logger.debug(f'捕获到加购请求模板 "{request.url}"')
+
+    async def _on_cart_request(self, request: Request, logger: Logger) -> None:
+        """从购物车页点击移出按钮发出的请求中捕获移出购物车请求模板，请求中需要包含购物车内的 data-id"""
+        if self.remove_template is not None or not is_remove_request(request):
+            return
+        if self._remove_endpoint is not None and self._remove_endpoint.search(request.url) is None:
+            return
+
+        self.remove_template = await RequestTemplate.capture(request, self._cart_ids)
+        if self.remove_template is not None:
+            logger.debug(f'捕获到移出购物车请求模板 "{request.url}"')
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        post_data: Optional[str],
+        headers: dict[str, str],
+        logger: Logger,
+    ) -> int:
+        """发送请求，返回状态码，出错时返回 0；触发验证时等待通过验证后重发"""
+        while True:
+            await self._challenge.wait()
+            async with self._semaphore:
+                try:
+                    response = await self._request.fetch(url, method=method, data=post_data, headers=headers)
+                except PlaywrightError as pe:
+                    logger.warning(f'请求 "{url}" 出错\n{pe}')
+                    return 0
+            await response.dispose()
+
+            if response.status != 511:
+                return response.status
+            metrics.inc('challenge_511')
+            self._challenge.report(url, logger)
+
+    async def _add_one(self, product_id: str, logger: Logger) -> bool:
+        if self.add_template is not None:
+            url, post_data = self.add_template.render(product_id)
+            status = await self._send(
+                self.add_template.method, url, post_data, self.add_template.headers, logger
+            )
+        else:
+            status = await self._send(
+                'POST',
+                f'{self.base_url}/newaddtocart',
+                f'{quote('product[]')}={product_id}',
+                {'Content-Type': 'application/x-www-form-urlencoded', 'X-Requested-With': 'XMLHttpRequest'},
+                logger,
+            )
+        return 200 <= status < 300
+
+    async def add_to_cart(self, product_ids: Iterable[str], logger: Logger) -> dict[str, bool]:
+        """并发加购多个产品，返回 { data-offer-id: 是否加购成功 }"""
+        product_ids = list(product_ids)
+        results = await asyncio.gather(*(self._add_one(_, logger) for _ in product_ids))
+        return dict(zip(product_ids, results))
+
+    async def fetch_cart(self, logger: Logger) -> Optional[list[tuple[str, int]]]:
+        """
+        读取购物车内所有产品的 [(data-id, 最大可加购数)]，不渲染页面；触发验证时等待通过验证后重新读取
+
+        请求出错时返回 None，由调用方退回到购物车页
+        """
+        url = f'{self.base_url}/cart/products'
+        while True:
+            await self._challenge.wait()
+            async with self._semaphore:
+                try:
+                    response = await self._request.get(url)
+                    html = await response.body()
+                    await response.dispose()
+                except PlaywrightError as pe:
+                    logger.warning(f'读取购物车 "{url}" 出错\n{pe}')
+                    return None
+
+            if response.status != 511:
+                break
+            metrics.inc('challenge_511')
+            self._challenge.report(url, logger)
+
+        qtys = parse_cart_html(html)
+        self._cart_ids = {data_id for data_id, _ in qtys}
+        return qtys
+
+    async def clear_cart_in_browser(self, logger: Logger) -> None:
+        """打开购物车页清空购物车，同时捕获移出购物车请求模板"""
+        cart_page = await goto_cart_page(self._context, logger)
+        try:
+            cart_page.on('request', lambda r: self._on_cart_request(r, logger))
+            await clear_cart(cart_page, logger, remove_endpoint=self._remove_endpoint)
+        finally:
+            await cart_page.close()
+
+    async def remove_from_cart(self, cart_ids: Iterable[str], logger: Logger) -> bool:
+        """
+        并发将产品移出购物车
+
+        未捕获到移出购物车请求模板时，在浏览器里清空购物车并捕获模板，返回是否使用了 HTTP 请求
+        """
+        template = self.remove_template
+        if template is None:
+            logger.debug('未捕获到移出购物车请求模板，在浏览器里清空购物车')
+            await self.clear_cart_in_browser(logger)
+            return False
+
+        async def remove_one(cart_id: str) -> int:
+            url, post_data = template.render(cart_id)
+            return await self._send(template.method, url, post_data, template.headers, logger)
+
+        await asyncio.gather(*(remove_one(_) for _ in cart_ids))
+        return True
+
+    async def probe(self, products: list[ProductCardItem], logger: Logger) -> None:
+        """加购 products，从购物车解析最大可加购数，然后清空购物车；读取购物车出错时只在浏览器里清空购物车"""
+        added = await self.add_to_cart((_.product_id for _ in products), logger)
+        failed = [k for k, v in added.items() if not v]
+        if len(failed) > 0:
+            logger.warning(f'{len(failed)} 个产品的 HTTP 加购请求失败 data-offer-id={failed}')
+
+        qtys = await self.fetch_cart(logger)
+        if qtys is None:
+            await self.clear_cart_in_browser(logger)
+            return
+        apply_max_qtys(products, qtys, logger)
+
+        if len(qtys) > 0 and await self.remove_from_cart({data_id for data_id, _ in qtys}, logger):
+            remaining = await self.fetch_cart(logger)
+            if remaining is None or len(remaining) > 0:
+                logger.warning('HTTP 移出购物车后购物车不为空或读取出错，在浏览器里清空购物车')
+                self.remove_template = None
+                await self.clear_cart_in_browser(logger)
+
+
+_probes: WeakKeyDictionary[BrowserContext, CartProbe] = WeakKeyDictionary()
+"""{ context: 该 context 的 CartProbe }"""
+
+
+def get_cart_probe(context: BrowserContext) -> CartProbe:
+    """该 context 的 CartProbe，不存在时创建；同一个 context 的各个页面共用捕获到的请求模板"""
+    probe = _probes.get(context)
+    if probe is None:
+        probe = _probes[context] = CartProbe(context)
+    return probe
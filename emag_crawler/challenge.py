@@ -0,0 +1,140 @@
+"""触发验证（511）时暂停与恢复"""
+
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Future
+import sys
+from threading import Thread
+from typing import TYPE_CHECKING
+from weakref import WeakKeyDictionary
+
+from .metrics import current_tags, metrics
+
+if TYPE_CHECKING:
+    from typing import Callable, Optional
+
+    from loguru import Logger
+    from playwright.async_api import BrowserContext, Page, Response
+
+
+_operator_lock = asyncio.Lock()
+"""同一时间只向操作员提示一个验证，避免多个 input() 抢占终端"""
+
+_pending_input: Optional[Future[str]] = None
+"""还在等待操作员输入的一行"""
+
+
+def _read_stdin(future: Future[str]) -> None:
+    """
+    读取一行终端输入
+
+    NOTICE 绕过 sys.stdin 的缓冲区直接读取，否则退出时该线程持有缓冲区的锁，解释器会因为无法关闭 stdin 而崩溃
+    """
+    try:
+        line = sys.stdin.buffer.raw.readline()  # type: ignore
+        if len(line) == 0:
+            raise EOFError('stdin 已关闭')
+        future.set_result(line.decode(sys.stdin.encoding, errors='replace').rstrip('\r\n'))
+    except BaseException as be:
+        future.set_exception(be)
+
+
+async def read_operator_input(prompt: str) -> str:
+    """
+    提示操作员并读取一行终端输入，不阻塞事件循环
+
+    在守护线程中读取，不占用默认线程池，所以等待中的协程可以被取消（如 Ctrl-C），
+    退出时也不需要等待该线程；被取消时线程仍在等待的那一行留给下一次读取
+    """
+    global _pending_input
+
+    print(prompt, end='', flush=True)
+    if _pending_input is None or _pending_input.done():
+        _pending_input = Future()
+        Thread(target=_read_stdin, args=(_pending_input,), name='OperatorInput', daemon=True).start()
+    return await asyncio.shield(asyncio.wrap_future(_pending_input))
+
+
+class ChallengeCoordinator:
+    """
+    一个 context 的验证暂停点
+
+    收到 511 时只暂停使用该 context 的任务（它们在 wait() 处等待），其他 context 照常爬取；
+    提示操作员后在守护线程中读取输入，不会阻塞事件循环，等待中被取消时释放 _operator_lock；
+    操作员在浏览器中通过验证并按回车后，等待中的任务从各自的暂停点继续
+
+    同一个 context 被多个类目共用，logger 由每次调用传入，暂停与恢复记录在触发验证的类目下
+    """
+
+    def __init__(self, notify: Optional[Callable[[str], None]] = None) -> None:
+        self._notify = notify
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._prompt_task: Optional[asyncio.Task[None]] = None
+        self._watched_pages: set[Page] = set()
+
+    @property
+    def paused(self) -> bool:
+        """是否在等待通过验证"""
+        return not self._resumed.is_set()
+
+    def watch(self, page: Page, logger: Logger) -> None:
+        """监听页面的所有响应，收到 511 时暂停，记录到打开该页面的类目的 logger"""
+        if page in self._watched_pages:
+            return
+        self._watched_pages.add(page)
+        # 事件处理器中拿不到当前上下文的统计标签，在注册时取出
+        tags = current_tags()
+        page.on('response', lambda r: self._on_response(r, logger, tags))
+        page.once('close', lambda p: self._watched_pages.discard(p))
+
+    def _on_response(self, response: Response, logger: Logger, tags: tuple[tuple[str, str], ...]) -> None:
+        if response.status == 511:
+            self.report(response.url, logger, tags)
+
+    def report(self, url: str, logger: Logger, tags: Optional[tuple[tuple[str, str], ...]] = None) -> None:
+        """报告触发了验证，不阻塞；已经在暂停中时忽略；在事件处理器中调用时传入注册时的统计标签 tags"""
+        if self.paused:
+            return
+
+        metrics.inc('challenge_paused', tags=tags)
+        logger.error(f'请求 "{url}" 触发验证，暂停该 context 的任务')
+        self._resumed.clear()
+        if self._notify is not None:
+            self._notify(url)
+        self._prompt_task = asyncio.create_task(self._prompt_operator(url, logger))
+
+    def resume(self, logger: Logger) -> None:
+        """通过验证后恢复，也可以由其他方式（如自动检测）调用"""
+        if not self.paused:
+            return
+        logger.info('验证已通过，继续执行')
+        self._resumed.set()
+
+    async def wait(self) -> None:
+        """在暂停中时等待到恢复，未暂停时立即返回"""
+        if not self.paused:
+            return
+        with metrics.span('challenge_pause'):
+            await self._resumed.wait()
+
+    async def _prompt_operator(self, url: str, logger: Logger) -> None:
+        async with _operator_lock:
+            # 排队期间可能已被其他方式恢复
+            if not self.paused:
+                return
+            await read_operator_input(f'请求 "{url}" 触发验证，在浏览器中通过验证后按回车继续...')
+        self.resume(logger)
+
+
+_coordinators: WeakKeyDictionary[BrowserContext, ChallengeCoordinator] = WeakKeyDictionary()
+"""{ context: 该 context 的验证暂停点 }"""
+
+
+def get_challenge_coordinator(context: BrowserContext) -> ChallengeCoordinator:
+    """该 context 的验证暂停点，不存在时创建"""
+    coordinator = _coordinators.get(context)
+    if coordinator is None:
+        coordinator = _coordinators[context] = ChallengeCoordinator()
+    return coordinator
@@ -0,0 +1,215 @@
+"""断点续爬"""
+
+from __future__ import annotations
+
+from enum import IntEnum
+from pathlib import Path
+import sqlite3
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from .models import ProductCardItem
+from .utils import BackgroundWriter
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional
+
+
+class CardState(IntEnum):
+    """产品卡片的处理进度"""
+
+    PARSED = 1
+    """已解析"""
+    SENT = 2
+    """已点击加购"""
+    CONFIRMED = 3
+    """加购请求已成功"""
+    RESOLVED = 4
+    """已解析到最大可加购数"""
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS categories (
+    category TEXT NOT NULL,
+    crawl_date TEXT NOT NULL,
+    product_count INTEGER NOT NULL,
+    PRIMARY KEY (category, crawl_date)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    category TEXT NOT NULL,
+    crawl_date TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (category, crawl_date, page_num)
+);
+CREATE TABLE IF NOT EXISTS cards (
+    category TEXT NOT NULL,
+    crawl_date TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (category, crawl_date, page_num, product_id)
+);
+"""
+
+
+class CheckpointStore:
+    """
+    记录每个类目、页面、产品卡片的处理进度
+
+    用 SQLite 的 WAL 模式保存，进程中断后重新运行可以跳过已完成的页面和产品卡片；
+    写入在后台线程中按顺序进行，不阻塞事件循环（点击加购时每个产品都会写入），读取前先等待之前的写入完成
+    """
+
+    def __init__(self, path: Path, crawl_date: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.crawl_date = crawl_date
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_schema)
+        self._writer = BackgroundWriter('CheckpointStore')
+
+    def close(self) -> None:
+        try:
+            self._writer.close()
+        finally:
+            self._conn.close()
+
+    def _write(self, sql: str, rows: list[tuple[Any, ...]]) -> None:
+        """在后台线程中执行的写入"""
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def _read(self, sql: str, params: tuple[Any, ...]) -> list[tuple[Any, ...]]:
+        """等待之前的写入完成后读取"""
+        self._writer.flush()
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_product_count(self, category: str) -> Optional[int]:
+        """该类目已记录的产品总数"""
+        rows = self._read(
+            'SELECT product_count FROM categories WHERE category = ? AND crawl_date = ?',
+            (category, self.crawl_date),
+        )
+        return None if len(rows) == 0 else rows[0][0]
+
+    def set_product_count(self, category: str, product_count: int) -> None:
+        """记录该类目的产品总数"""
+        self._writer.submit(
+            self._write,
+            'INSERT OR REPLACE INTO categories (category, crawl_date, product_count) VALUES (?, ?, ?)',
+            [(category, self.crawl_date, product_count)],
+        )
+
+    def page(self, category: str, page_num: int) -> PageCheckpoint:
+        """某个类目页的断点"""
+        return PageCheckpoint(self, category, page_num)
+
+    def _is_page_done(self, category: str, page_num: int) -> bool:
+        rows = self._read(
+            'SELECT done FROM pages WHERE category = ? AND crawl_date = ? AND page_num = ?',
+            (category, self.crawl_date, page_num),
+        )
+        return len(rows) > 0 and rows[0][0] == 1
+
+    def _mark_page_done(self, category: str, page_num: int) -> None:
+        self._writer.submit(
+            self._write,
+            'INSERT OR REPLACE INTO pages (category, crawl_date, page_num, done, updated_at) '
+            'VALUES (?, ?, ?, 1, ?)',
+            [(category, self.crawl_date, page_num, time())],
+        )
+
+    def _save_cards(
+        self,
+        category: str,
+        page_num: int,
+        items: Iterable[ProductCardItem],
+        state: CardState,
+    ) -> None:
+        """保存产品卡片，进度只会前进不会后退；产品在提交时序列化，之后的修改不影响这次写入"""
+        now = time()
+        self._writer.submit(
+            self._write,
+            'INSERT INTO cards (category, crawl_date, page_num, product_id, state, item, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (category, crawl_date, page_num, product_id) DO UPDATE SET '
+            'state = MAX(state, excluded.state), '
+            'item = CASE WHEN excluded.state >= state THEN excluded.item ELSE item END, '
+            'updated_at = excluded.updated_at',
+            [
+                (category, self.crawl_date, page_num, _.product_id, int(state), _.model_dump_json(), now)
+                for _ in items
+            ],
+        )
+
+    def _update_card_states(
+        self,
+        category: str,
+        page_num: int,
+        product_ids: Iterable[str],
+        state: CardState,
+    ) -> None:
+        """更新产品卡片的进度，进度只会前进不会后退"""
+        now = time()
+        self._writer.submit(
+            self._write,
+            'UPDATE cards SET state = MAX(state, ?), updated_at = ? '
+            'WHERE category = ? AND crawl_date = ? AND page_num = ? AND product_id = ?',
+            [(int(state), now, category, self.crawl_date, page_num, _) for _ in product_ids],
+        )
+
+    def _load_cards(self, category: str, page_num: int) -> dict[str, tuple[CardState, ProductCardItem]]:
+        rows = self._read(
+            'SELECT product_id, state, item FROM cards WHERE category = ? AND crawl_date = ? AND page_num = ?',
+            (category, self.crawl_date, page_num),
+        )
+        return {
+            product_id: (CardState(state), ProductCardItem.model_validate_json(item))
+            for product_id, state, item in rows
+        }
+
+
+class PageCheckpoint:
+    """某个类目页的断点"""
+
+    def __init__(self, store: CheckpointStore, category: str, page_num: int) -> None:
+        self._store = store
+        self.category = category
+        self.page_num = page_num
+
+    @property
+    def done(self) -> bool:
+        """该页是否已经完成"""
+        return self._store._is_page_done(self.category, self.page_num)
+
+    def mark_done(self) -> None:
+        """标记该页已完成"""
+        self._store._mark_page_done(self.category, self.page_num)
+
+    def load(self) -> dict[str, tuple[CardState, ProductCardItem]]:
+        """读取该页已记录的产品卡片 { product_id: (进度, 产品) }"""
+        return self._store._load_cards(self.category, self.page_num)
+
+    def record_parsed(self, items: Iterable[ProductCardItem]) -> None:
+        """记录已解析的产品卡片"""
+        self._store._save_cards(self.category, self.page_num, items, CardState.PARSED)
+
+    def record_sent(self, product_id: str) -> None:
+        """记录已点击加购的产品"""
+        self._store._update_card_states(self.category, self.page_num, (product_id,), CardState.SENT)
+
+    def record_confirmed(self, product_ids: Iterable[str]) -> None:
+        """记录加购请求已成功的产品"""
+        self._store._update_card_states(self.category, self.page_num, product_ids, CardState.CONFIRMED)
+
+    def record_resolved(self, items: Iterable[ProductCardItem]) -> None:
+        """记录已解析到最大可加购数的产品"""
+        self._store._save_cards(self.category, self.page_num, items, CardState.RESOLVED)
@@ -0,0 +1,172 @@
+"""本次运行中的产品去重"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import sqlite3
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from .utils import BackgroundWriter
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional
+
+    from .models import ProductCardItem
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS resolved (
+    crawl_date TEXT NOT NULL,
+    pnk TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    max_qty INTEGER NOT NULL,
+    PRIMARY KEY (crawl_date, pnk, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS occurrences (
+    crawl_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    rank_in_page INTEGER NOT NULL,
+    pnk TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    rank_in_category INTEGER NOT NULL,
+    PRIMARY KEY (crawl_date, category, page_num, rank_in_page)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS occurrences_by_pnk ON occurrences (crawl_date, pnk);
+"""
+
+
+class DedupeIndex:
+    """
+    本次运行中已解析到最大可加购数的产品 { (pnk, data-offer-id): 最大可加购数 }
+
+    同一个产品可能出现在多个页面、多个类目中，解析到一次之后，其他位置直接取用，不再加购；
+    同时记录产品出现的每个位置（类目、页码、排名）
+
+    默认只保存在内存中；传入 path 时同时写入 SQLite，中断后重新运行会载入 crawl_date 当天的记录；
+    查询只读内存，SQLite 的写入在后台线程中按顺序进行，不阻塞事件循环
+    """
+
+    def __init__(self, path: Optional[Path] = None, crawl_date: str = '') -> None:
+        self.crawl_date = crawl_date
+        self._max_qtys: dict[tuple[str, str], int] = dict()
+        self._occurrences: dict[tuple[str, int, int], tuple[str, str, int]] = dict()
+        self._lock = Lock()
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[BackgroundWriter] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_schema)
+            self._load()
+            self._writer = BackgroundWriter('DedupeIndex')
+
+    def _load(self) -> None:
+        assert self._conn is not None
+        for pnk, product_id, max_qty in self._conn.execute(
+            'SELECT pnk, product_id, max_qty FROM resolved WHERE crawl_date = ?', (self.crawl_date,)
+        ):
+            self._max_qtys[(pnk, product_id)] = max_qty
+        for category, page_num, rank_in_page, pnk, product_id, rank_in_category in self._conn.execute(
+            'SELECT category, page_num, rank_in_page, pnk, product_id, rank_in_category '
+            'FROM occurrences WHERE crawl_date = ?',
+            (self.crawl_date,),
+        ):
+            self._occurrences[(category, page_num, rank_in_page)] = (pnk, product_id, rank_in_category)
+
+    def close(self) -> None:
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+
+    def _write(self, sql: str, rows: list[tuple[Any, ...]]) -> None:
+        """在后台线程中执行的写入，连接只在该线程中使用"""
+        assert self._conn is not None
+        with self._conn:
+            self._conn.executemany(sql, rows)
+
+    def __len__(self) -> int:
+        return len(self._max_qtys)
+
+    def get(self, pnk: str, product_id: str) -> Optional[int]:
+        """已解析到的最大可加购数"""
+        return self._max_qtys.get((pnk, product_id))
+
+    def resolve(self, items: Iterable[ProductCardItem]) -> list[ProductCardItem]:
+        """给已解析过的产品填入最大可加购数，返回命中的产品；这些产品没有加购，cart_added 仍为 False"""
+        hits: list[ProductCardItem] = list()
+        for p in items:
+            max_qty = self._max_qtys.get((p.pnk, p.product_id))
+            if max_qty is None:
+                continue
+            p.max_qty = max_qty
+            p.deduped = True
+            hits.append(p)
+        return hits
+
+    def record_resolved(self, items: Iterable[ProductCardItem]) -> None:
+        """记录解析到最大可加购数的产品，复用之前爬取的、取自本索引的产品会被跳过"""
+        rows: list[tuple[str, str, str, int]] = list()
+        with self._lock:
+            for p in items:
+                if p.max_qty is None or p.max_qty_cached or p.deduped:
+                    continue
+                self._max_qtys[(p.pnk, p.product_id)] = p.max_qty
+                rows.append((self.crawl_date, p.pnk, p.product_id, p.max_qty))
+
+            if self._writer is not None and len(rows) > 0:
+                self._writer.submit(self._write, 'INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?)', rows)
+
+    def record_occurrences(self, items: Iterable[ProductCardItem]) -> None:
+        """记录产品出现的位置"""
+        rows: list[tuple[str, str, int, int, str, str, int]] = list()
+        with self._lock:
+            for p in items:
+                self._occurrences[(p.category, p.page_num, p.rank_in_page)] = (
+                    p.pnk,
+                    p.product_id,
+                    p.rank_in_category,
+                )
+                rows.append(
+                    (
+                        self.crawl_date,
+                        p.category,
+                        p.page_num,
+                        p.rank_in_page,
+                        p.pnk,
+                        p.product_id,
+                        p.rank_in_category,
+                    )
+                )
+
+            if self._writer is not None and len(rows) > 0:
+                self._writer.submit(
+                    self._write, 'INSERT OR REPLACE INTO occurrences VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+                )
+
+    def occurrences(self, pnk: str) -> list[dict[str, Any]]:
+        """产品出现的所有位置，按类目、排名排序"""
+        result = [
+            {
+                'category': category,
+                'page_num': page_num,
+                'rank_in_page': rank_in_page,
+                'rank_in_category': rank_in_category,
+                'product_id': product_id,
+            }
+            for (category, page_num, rank_in_page), (
+                p,
+                product_id,
+                rank_in_category,
+            ) in self._occurrences.items()
+            if p == pnk
+        ]
+        result.sort(key=lambda _: (_['category'], _['rank_in_category']))
+        return result
@@ -3,49 +3,203 @@
 from __future__ import annotations
 
 import asyncio
+from collections import defaultdict
+import json
 import re
+from time import perf_counter
 from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
 
 from scraper_utils.constants.time_constant import MS1000
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 
+from ..challenge import get_challenge_coordinator
+from ..metrics import metrics, timed
 from ..models import ProductCardItem
-from ..utils import wait_for_networkidle
+from ..retry import RetryError, get_circuit_breaker, goto_policy, retry
+from ..utils import RequestTracker
 
 if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional
+
     from loguru import Logger
-    from playwright.async_api import BrowserContext, Page, Locator
+    from playwright.async_api import BrowserContext, ElementHandle, Page, Locator, Request, Response
+
+    from ..challenge import ChallengeCoordinator
 
 
+@timed('goto_cart_page')
 async def goto_cart_page(context: BrowserContext, logger: Logger) -> Page:
-    """打开购物车页"""
+    """打开购物车页，按 goto_policy 重试仍然打不开时抛出 RetryError"""
     logger.info('打开购物车页')
 
+    url = 'https://www.emag.ro/cart/products'
+    challenge = get_challenge_coordinator(context)
+    breaker = get_circuit_breaker(url)
+
     page = await context.new_page()
+    challenge.watch(page, logger)
 
     while True:
+        await challenge.wait()
         try:
-            response = await page.goto('https://www.emag.ro/cart/products', wait_until='networkidle')
-        except PlaywrightError:
-            pass
-        else:
-            if response is None or response.status == 511:
-                input('等待验证...')
-                continue
-            break
+            response = await retry(
+                lambda: page.goto(url, wait_until='networkidle'),
+                'goto_cart_page',
+                goto_policy,
+                breaker,
+                logger=logger,
+            )
+        except RetryError:
+            await page.close()
+            raise
+        if response is None or response.status == 511:
+            metrics.inc('challenge_511')
+            challenge.report(page.url, logger)
+            continue
+        break
 
     return page
 
 
-async def clear_cart(page: Page, logger: Logger) -> None:
-    """清空购物车"""
+cart_capacity = 50
+"""购物车最多能容纳的产品数"""
+
+
+def is_remove_request(request: Request) -> bool:
+    """
+    点击移出按钮时页面发出的请求是否可能是移出购物车请求
+
+    NOTICE 没有移出购物车请求的真实样本，不猜测它的 endpoint，只要求是 XHR/fetch 发出的非 GET 请求，
+    清空购物车时从第一次点击发出的请求中识别 endpoint
+    """
+    return request.method != 'GET' and request.resource_type in ('xhr', 'fetch')
+
+
+_click_js = '(element) => element.click()'
+"""直接触发元素的 click 事件，不等待可操作性检查的 js"""
+
+_wait_cart_empty_js = """(timeout) => new Promise((resolve) => {
+    const isEmpty = () => document.querySelectorAll('div.cart-widget[data-id]').length === 0;
+    if (isEmpty()) {
+        resolve(true);
+        return;
+    }
+
+    const observer = new MutationObserver(() => {
+        if (isEmpty()) {
+            observer.disconnect();
+            resolve(true);
+        }
+    });
+    observer.observe(document.body, { childList: true, subtree: true });
+
+    setTimeout(() => {
+        observer.disconnect();
+        resolve(isEmpty());
+    }, timeout);
+})"""
+"""监听 DOM 变化，等待购物车被清空的 js"""
+
+
+@timed('clear_cart')
+async def clear_cart(
+    page: Page,
+    logger: Logger,
+    concurrency: int = 5,
+    remove_endpoint: Optional[re.Pattern[str]] = None,
+) -> int:
+    """
+    清空购物车，返回移出的产品数
+
+    先批量点击移出按钮，进行中的移出请求（url 匹配 remove_endpoint 的请求）最多 concurrency 个，
+    失败时再逐个点击；移出请求触发验证时，通过验证后从剩余的产品继续移出；
+    remove_endpoint 为 None 时从第一次点击发出的请求中识别
+    """
     logger.info('清空购物车')
 
-    # TODO 如何保证在触发验证后能暂停，并在通过验证后从暂停点继续？
+    challenge = get_challenge_coordinator(page.context)
+    challenge.watch(page, logger)
 
+    start_time = perf_counter()
     cart_widget_divs = page.locator('css=div.cart-widget[data-id]')
 
+    # 统计清购时发出的请求
+    with RequestTracker(page) as tracker:
+        total = await cart_widget_divs.count()
+        if total > 0 and not await _bulk_clear_cart(page, concurrency, remove_endpoint, logger):
+            await challenge.wait()
+            logger.warning(f'批量清空购物车失败，逐个移出剩余的 {await cart_widget_divs.count()} 个产品')
+            await _clear_cart_one_by_one(cart_widget_divs, challenge, logger)
+
+        logger.info('等待所有清购请求完成')
+        # await page.wait_for_load_state('networkidle')
+        await tracker.wait_for_idle(MS1000, 10 * MS1000)
+
+    removed = total - await cart_widget_divs.count()
+    logger.info(f'清空购物车完成，移出 {removed} 个产品，耗时 {perf_counter() - start_time:.1f}s')
+    return removed
+
+
+async def _detect_remove_endpoint(
+    page: Page,
+    button: ElementHandle,
+    logger: Logger,
+) -> re.Pattern[str]:
+    """点击移出按钮，从它发出的请求中识别移出购物车请求的 endpoint，没有发出请求时抛出 PlaywrightError"""
+    async with page.expect_request(is_remove_request, timeout=5 * MS1000) as request_info:
+        await button.evaluate(_click_js)
+    request = await request_info.value
+    logger.debug(f'识别到移出购物车请求 {request.method} "{request.url}"')
+    return re.compile(re.escape(urlsplit(request.url).path))
+
+
+async def _bulk_clear_cart(
+    page: Page,
+    concurrency: int,
+    remove_endpoint: Optional[re.Pattern[str]],
+    logger: Logger,
+) -> bool:
+    """
+    依次点击所有移出按钮，返回购物车是否已被清空
+
+    remove_endpoint 为 None 时先点击第一个移出按钮识别 endpoint，识别到之后才限制进行中的移出请求数；
+    进行中的移出请求达到 concurrency 个时，等待其中一个完成再点击下一个；
+    点击后没有发出匹配 remove_endpoint 的请求、或移出请求长时间没有完成时视为失败
+    """
+    remove_buttons = page.locator('css=div.cart-widget[data-id] button.btn-remove-product')
+    buttons = await remove_buttons.filter(visible=True).element_handles()
+    try:
+        rest = buttons
+        if remove_endpoint is None and len(buttons) > 0:
+            remove_endpoint = await _detect_remove_endpoint(page, buttons[0], logger)
+            rest = buttons[1:]
+
+        with RequestTracker(page, remove_endpoint) as tracker:
+            for button in rest:
+                if not await tracker.wait_for_capacity(concurrency, 10 * MS1000):
+                    logger.debug(f'{tracker.inflight} 个移出请求长时间没有完成')
+                    return False
+                async with page.expect_request(remove_endpoint, timeout=MS1000):
+                    await button.evaluate(_click_js)
+            logger.debug(f'批量点击了 {len(buttons)} 个移出按钮')
+        return await page.evaluate(_wait_cart_empty_js, 10 * MS1000)
+    except PlaywrightError as pe:
+        logger.debug(f'批量清空购物车出错\n{pe}')
+        return False
+    finally:
+        await asyncio.gather(*(_.dispose() for _ in buttons), return_exceptions=True)
+
+
+async def _clear_cart_one_by_one(
+    cart_widget_divs: Locator,
+    challenge: ChallengeCoordinator,
+    logger: Logger,
+) -> None:
+    """逐个点击移出按钮"""
     while await cart_widget_divs.count() > 0:
+        await challenge.wait()
+
         while await cart_widget_divs.locator('css=div.preloader').count() > 0:
             await asyncio.sleep(1)
 
@@ -61,47 +215,167 @@ async def clear_cart(page: Page, logger: Logger) -> None:
         except PlaywrightError:
             pass
 
-    logger.info('等待所有清购请求完成')
-    # await page.wait_for_load_state('networkidle')
-    await wait_for_networkidle(page, 10 * MS1000)
+
+_cart_widgets_js = """(widgets) => widgets.map((widget) => {
+    const input = widget.querySelector('input[max]');
+    return [widget.getAttribute('data-id'), input === null ? null : input.getAttribute('max')];
+})"""
+"""一次性读取所有购物车产品的 data-id 和最大可加购数的 js"""
+
+cart_data_id_pattern = re.compile(r'_?(\d+)$')
+"""从购物车产品的 data-id 中取出 data-offer-id，购物车页和离线解析共用"""
 
 
+@timed('parse_max_qtys')
 async def parse_max_qtys(page: Page, products: list[ProductCardItem], logger: Logger) -> None:
-    """解析购物车内的所有产品数据"""
+    """解析购物车内的所有产品数据，填入产品的最大可加购数"""
     logger.info('解析产品最大可加购数')
 
     cart_widget_divs = page.locator('css=div.cart-widget[data-id]')
 
-    qtys: dict[str, int] = dict()
-    for i in range(await cart_widget_divs.count()):
-        data_id, max_qty = await parse_max_qty(cart_widget_divs.nth(i))
+    widgets: list[tuple[Optional[str], Optional[str]]] = await cart_widget_divs.evaluate_all(_cart_widgets_js)
+
+    qtys: list[tuple[str, int]] = list()
+    for raw_data_id, raw_max_qty in widgets:
+        data_id_match = cart_data_id_pattern.search(raw_data_id or '')
+        if data_id_match is None or raw_max_qty is None:
+            logger.warning(f'无法解析购物车产品 data-id="{raw_data_id}" max="{raw_max_qty}"')
+            continue
+        data_id, max_qty = data_id_match.group(1), int(raw_max_qty)
         logger.debug(f'解析到 data-id={data_id} 的最大可加购数 {max_qty}')
-        qtys[data_id] = max_qty
+        qtys.append((data_id, max_qty))
+
+    apply_max_qtys(products, qtys, logger)
+
 
+def apply_max_qtys(
+    products: list[ProductCardItem],
+    qtys: Iterable[tuple[str, int]],
+    logger: Logger,
+) -> None:
+    """
+    将购物车内解析到的最大可加购数 [(data-id, max_qty)] 填入产品
+
+    没有匹配到任何产品的 data-id 计数到 cart_unmatched 并记录日志
+
+    同一个 data-id 可能对应多个产品（同一产品出现多次），也可能在购物车内出现多次（只取第一次）
+    """
+    products_by_id: dict[str, list[ProductCardItem]] = defaultdict(list)
     for p in products:
-        # 跳过 qty 已经解析了的产品
-        if p.max_qty is not None:
+        products_by_id[p.product_id].append(p)
+
+    found: set[str] = set()
+    unmatched: list[str] = list()
+    for data_id, max_qty in qtys:
+        matched = products_by_id.get(data_id)
+        if matched is None:
+            unmatched.append(data_id)
+            continue
+        if data_id in found:
             continue
+        found.add(data_id)
 
-        p.max_qty = qtys.get(p.product_id, None)
-        if p.max_qty is not None:
-            p.cart_added = p.max_qty is not None
+        for p in matched:
+            # 跳过 qty 已经解析了的产品
+            if p.max_qty is not None:
+                continue
+
+            p.max_qty = max_qty
+            p.cart_added = True
             logger.debug(
                 f'找到已加购产品 #{p.rank_in_page} pnk="{p.pnk}" data-id={p.product_id} 的最大可加购数 {p.max_qty}'
             )
-        else:
+
+    for p in products:
+        if p.max_qty is None:
             logger.warning(
                 f'购物车内未找到已加购产品 #{p.rank_in_page} pnk="{p.pnk}" data-id={p.product_id} 的最大可加购数'
             )
 
+    if len(unmatched) > 0:
+        metrics.inc('cart_unmatched', len(unmatched))
+        logger.warning(f'购物车内有 {len(unmatched)} 个产品没有匹配到任何已加购产品 data-id={unmatched}')
+
+
+# NOTICE 以下字段名是猜测的，还没有用真实的加购响应核对过；
+# 解析不到时计数 newaddtocart_max_qty_missing 并回退到购物车页，该计数持续偏高时按 debug 日志中的响应结构修正
+_payload_max_qty_keys = ('max_quantity', 'maxQuantity', 'max_qty', 'maxQty')
+"""加购响应中表示最大可加购数的字段"""
+_payload_offer_id_keys = ('offer_id', 'offerId', 'product_id', 'productId')
+"""加购响应中表示 data-offer-id 的字段，不包括 id 这类其他对象也会用的字段"""
+
+
+def _html_max_qty_pattern(product_id: str) -> re.Pattern[str]:
+    """购物车行 HTML 片段中 data-id 为 product_id 的 cart-widget 里的 input[max]"""
+    return re.compile(
+        rf'data-id="[^"]*?(?<!\d){product_id}"(?:(?!data-id=).)*?<input[^>]*?\smax="(\d+)"', re.S
+    )
+
+
+def parse_newaddtocart_max_qty(payload: Any, product_id: str) -> Optional[int]:
+    """
+    从加购请求的响应中解析 product_id 的最大可加购数，解析不到时返回 None
+
+    响应的格式没有文档：在 JSON 中查找同时带有 data-offer-id（等于 product_id）和最大可加购数的同一个对象；
+    响应中带有购物车行的 HTML 片段时，按 data-id 找到对应 cart-widget 的 input[max]，与 parse_max_qtys 一致
+    """
+    return _find_max_qty(payload, product_id, _html_max_qty_pattern(product_id))
+
+
+def _find_max_qty(payload: Any, product_id: str, html_pattern: re.Pattern[str]) -> Optional[int]:
+    if isinstance(payload, str):
+        m = html_pattern.search(payload)
+        return None if m is None else int(m.group(1))
+
+    if isinstance(payload, dict):
+        if any(str(payload.get(k)) == product_id for k in _payload_offer_id_keys):
+            for k in _payload_max_qty_keys:
+                value = payload.get(k)
+                if isinstance(value, (int, str)) and str(value).isdigit() and int(value) > 0:
+                    return int(value)
+        payload = payload.values()
+    elif not isinstance(payload, list):
+        return None
+
+    for value in payload:
+        max_qty = _find_max_qty(value, product_id, html_pattern)
+        if max_qty is not None:
+            return max_qty
+    return None
+
+
+def _payload_shape(payload: Any, depth: int = 4) -> Any:
+    """响应的结构（字段名和值的类型），列表只取第一项，用于记录解析不到最大可加购数的响应"""
+    if isinstance(payload, dict):
+        if depth == 0:
+            return 'dict'
+        return {k: _payload_shape(v, depth - 1) for k, v in payload.items()}
+    if isinstance(payload, list):
+        if depth == 0 or len(payload) == 0:
+            return 'list'
+        return [_payload_shape(payload[0], depth - 1)]
+    if isinstance(payload, str):
+        return f'str({len(payload)})'
+    return type(payload).__name__
 
-async def parse_max_qty(cart_widget_div: Locator) -> tuple[str, int]:
-    """解析单个产品的最大可加购数"""
 
-    data_id: str = await cart_widget_div.get_attribute('data-id', timeout=MS1000)  # type: ignore
-    data_id = re.search(r'_?(\d+)$', data_id).group(1)  # type: ignore
+async def read_newaddtocart_max_qty(response: Response, product_id: str, logger: Logger) -> Optional[int]:
+    """读取加购请求的响应体，解析 product_id 的最大可加购数，解析不到时记录响应的结构"""
+    try:
+        body = await response.body()
+    except PlaywrightError:
+        return None
 
-    max_qty_inputs = cart_widget_div.locator('css=input[max]')
-    max_qty = int(await max_qty_inputs.first.get_attribute('max', timeout=MS1000))  # type: ignore
+    text = body.decode(errors='replace')
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        payload = text
 
-    return data_id, max_qty
+    max_qty = parse_newaddtocart_max_qty(payload, product_id)
+    if max_qty is None:
+        logger.debug(
+            f'加购响应中没有 data-offer-id={product_id} 的最大可加购数，'
+            f'响应的结构 {json.dumps(_payload_shape(payload), ensure_ascii=False)}'
+        )
+    return max_qty
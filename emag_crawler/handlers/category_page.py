@@ -4,22 +4,44 @@ from __future__ import annotations
 
 import asyncio
 from collections import defaultdict
+from functools import partial
 import re
 from typing import TYPE_CHECKING
+from weakref import WeakKeyDictionary
 
 from scraper_utils.constants.time_constant import MS1000
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 from scraper_utils.utils.emag_util import clean_product_image_url
 
-from .cart_page import goto_cart_page, parse_max_qtys, clear_cart
+from .cart_page import (
+    apply_max_qtys,
+    cart_capacity,
+    goto_cart_page,
+    parse_max_qtys,
+    clear_cart,
+    read_newaddtocart_max_qty,
+)
+from ..challenge import get_challenge_coordinator
+from ..checkpoint import CardState
+from ..metrics import current_tags, metrics, timed
 from ..models import ProductCardItem
-from ..utils import wait_for_networkidle
+from ..pacing import AddToCartPacer
+from ..retry import RetryError, click_policy, get_circuit_breaker, goto_policy, retry
+from ..utils import RequestTracker
 
 if TYPE_CHECKING:
-    from typing import Optional, Awaitable
+    from typing import Any, Awaitable, Callable, Optional
 
     from loguru import Logger
-    from playwright.async_api import BrowserContext, Page, Locator, Response, Route
+    from playwright.async_api import BrowserContext, ElementHandle, Page, Locator, Response, Route
+
+    from ..cart_probe import CartProbe
+    from ..challenge import ChallengeCoordinator
+    from ..checkpoint import PageCheckpoint
+    from ..dedupe import DedupeIndex
+    from ..history import MaxQtyCache
+    from ..pacing import PacingConfig
+    from ..sink import JsonlSink
 
 
 _hide_cookie_banner_js = """// 自动隐藏 eMAG 的 cookie 提示
@@ -43,25 +65,39 @@ document.addEventListener('DOMContentLoaded', hideCookieBanner);
 itv = setInterval(hideCookieBanner, 500);"""
 
 
+@timed('goto_category_page')
 async def goto_category_page(context: BrowserContext, url: str, logger: Logger) -> Page:
-    """打开类目页"""
+    """打开类目页，按 goto_policy 重试仍然打不开时抛出 RetryError"""
     logger.info(f'打开类目页 "{url}"')
 
     # NOTICE eMAG 确实能分辨是人工浏览器，还是 CDP
 
+    challenge = get_challenge_coordinator(context)
+
+    breaker = get_circuit_breaker(url)
+
     page = await context.new_page()
     await page.add_init_script(_hide_cookie_banner_js)
+    challenge.watch(page, logger)
 
     while True:
+        await challenge.wait()
         try:
-            response = await page.goto(url, wait_until='networkidle')
-        except PlaywrightError:
-            pass
-        else:
-            if response is None or response.status == 511:
-                input('触发验证，等待手动将验证通过...')
-                continue
-            break
+            response = await retry(
+                lambda: page.goto(url, wait_until='networkidle'),
+                'goto_category_page',
+                goto_policy,
+                breaker,
+                logger=logger,
+            )
+        except RetryError:
+            await page.close()
+            raise
+        if response is None or response.status == 511:
+            metrics.inc('challenge_511')
+            challenge.report(url, logger)
+            continue
+        break
 
     return page
 
@@ -72,6 +108,72 @@ async def get_product_count_of_category(page: Page) -> int:
     return int(await count_strong.inner_text())
 
 
+def locate_product_cards(page: Page) -> Locator:
+    """非 Promovat、非 Vezi Detalii 的加购按钮的所属产品卡片"""
+    return page.locator(
+        'div.card-item[data-offer-id]',
+        has_not=page.locator('css=span.card-v2-badge-cmp.bg-light'),
+        has=page.locator('css=button.yeahIWantThisProduct'),
+    )
+
+
+_card_offer_ids_js = "(cards) => cards.map((card) => card.getAttribute('data-offer-id'))"
+"""读取所有产品卡片的 data-offer-id 的 js"""
+
+
+class CardSnapshot:
+    """
+    产品卡片的快照：把 locate_product_cards 匹配的卡片一次性解析为 ElementHandle，按 data-offer-id 保存
+
+    点击加购、重新加购都复用这些 ElementHandle，不再每次用复合 locator 重新查询整个 DOM；
+    卡片已被移出 DOM（isConnected 为 false）时重新解析一次，同一产品有多个卡片时只保留排名最靠前的
+    """
+
+    def __init__(self, cards: Locator, logger: Logger) -> None:
+        self._cards = cards
+        self._logger = logger
+        self._handles: dict[str, ElementHandle] = dict()
+        self.product_ids: list[str] = list()
+        """按排名排序的 data-offer-id"""
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._handles
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    async def refresh(self) -> list[str]:
+        """重新解析所有卡片，返回按排名排序的 data-offer-id"""
+        handles = await self._cards.element_handles()
+        product_ids: list[Optional[str]] = await self._cards.page.evaluate(_card_offer_ids_js, handles)
+
+        stale = list(self._handles.values())
+        self._handles = dict()
+        for product_id, handle in zip(product_ids, handles):
+            if product_id is None or product_id in self._handles:
+                stale.append(handle)
+                continue
+            self._handles[product_id] = handle
+        self.product_ids = list(self._handles)
+
+        await asyncio.gather(*(_.dispose() for _ in stale), return_exceptions=True)
+        return self.product_ids
+
+    async def get(self, product_id: str) -> ElementHandle:
+        """产品卡片的 ElementHandle，卡片已被移出 DOM 时重新解析，仍然找不到时抛出 PlaywrightError"""
+        handle = self._handles.get(product_id)
+        if handle is not None and await handle.evaluate('(card) => card.isConnected'):
+            return handle
+
+        metrics.inc('card_detached')
+        self._logger.warning(f'data-offer-id={product_id} 的产品卡片已不在页面上，重新解析产品卡片')
+        await self.refresh()
+        handle = self._handles.get(product_id)
+        if handle is None:
+            raise PlaywrightError(f'页面上找不到 data-offer-id={product_id} 的产品卡片')
+        return handle
+
+
 async def newaddtocart_dialog_handler(button: Locator) -> None:
     """加购成功后的弹窗的处理器"""
     try:
@@ -80,62 +182,88 @@ async def newaddtocart_dialog_handler(button: Locator) -> None:
         pass
 
 
-async def parse_card_item(card: Locator, category: str, source_url: str, rank: int) -> ProductCardItem:
-    """解析单个产品卡片的上的数据"""
+_card_fields_js = """(card) => {
+    const text = (el) => (el === null ? null : el.textContent);
+    // 与 Locator.count() == 1 的判断保持一致
+    const onlyText = (selector) => {
+        const els = card.querySelectorAll(selector);
+        return els.length === 1 ? els[0].textContent : null;
+    };
+    const img = card.querySelector('div.img-component > img[src]');
+
+    return {
+        title: text(card.querySelector('a.card-v2-title')),
+        data_url: card.getAttribute('data-url'),
+        data_offer_id: card.getAttribute('data-offer-id'),
+        image_src: img === null ? null : img.getAttribute('src'),
+        badges: Array.from(card.querySelectorAll('span.card-v2-badge-cmp'), (el) => el.textContent),
+        price: text(card.querySelector('p.product-new-price')),
+        rating: onlyText('span.average-rating'),
+        review: onlyText('span.visible-xs-inline-block'),
+    };
+}"""
+"""读取单个产品卡片原始字段的 js"""
+
+_cards_fields_js = f'(cards) => cards.map({_card_fields_js})'
+"""读取多个产品卡片原始字段的 js"""
 
-    # 卡片截图的 Base64
-    # card_screenshot_base64 = base64.b64encode(await card.screenshot(type='png', timeout=MS1000)).decode()
+_pnk_pattern = re.compile(r'/pd/([A-Z0-9]{9})(/$)')
+_price_pattern = re.compile(r'(\d+),(\d+) Lei')
+_review_pattern = re.compile(r'\((\d+)\)')
+_top_favorite_pattern = re.compile(r'Top Favorite')
+
+
+def _normalize_text(text: Optional[str]) -> Optional[str]:
+    """合并连续空白，与 inner_text 的结果保持一致"""
+    if text is None:
+        return None
+    return ' '.join(text.split())
+
+
+def build_card_record(fields: dict[str, Any], category: str, source_url: str, rank: int) -> dict[str, Any]:
+    """根据产品卡片的原始字段构造 ProductCardItem 的字段，整页交给 ProductCardItem.trusted_many 校验"""
 
     # 解析产品名
-    title = await card.locator('css=a.card-v2-title').inner_text(timeout=MS1000)
+    title = _normalize_text(fields['title'])
+    if title is None:
+        raise ValueError(f'#{rank} 产品卡片缺少产品名')
 
     # 解析 pnk
-    data_url: str = await card.get_attribute('data-url', timeout=MS1000)  # type: ignore
-    pnk: str = re.search(r'/pd/([A-Z0-9]{9})(/$)', data_url).group(1)  # type: ignore
+    pnk_match = _pnk_pattern.search(fields['data_url'] or '')
+    if pnk_match is None:
+        raise ValueError(f'#{rank} 产品卡片的 data-url="{fields['data_url']}" 解析 pnk 失败')
+    pnk = pnk_match.group(1)
 
     # 解析产品图链接
     image_url = None
-    try:
-        thumb_image_url = await card.locator('css=div.img-component > img[src]').get_attribute(
-            'src', timeout=MS1000
-        )
-    except PlaywrightError:
-        pass
-    else:
-        if thumb_image_url is not None:
-            image_url = clean_product_image_url(thumb_image_url)
+    if fields['image_src'] is not None:
+        image_url = clean_product_image_url(fields['image_src'])
 
     # 解析 product_id data-offer-id
-    data_offer_id: str = await card.get_attribute('data-offer-id', timeout=MS1000)  # type: ignore
+    data_offer_id: str = fields['data_offer_id']
 
     # 解析 Top 标
-    top_favorite = (
-        await card.locator(
-            'css=span.card-v2-badge-cmp',
-            has_text=re.compile(r'Top Favorite'),
-        ).count()
-        > 0
+    top_favorite = any(
+        _top_favorite_pattern.search(_normalize_text(_) or '') is not None for _ in fields['badges']
     )
 
     # 解析价格
-    price_match: re.Match[str] = re.search(
-        r'(\d+),(\d+) Lei', await card.locator('css=p.product-new-price').inner_text(timeout=MS1000)
-    )  # type: ignore
+    price_match = _price_pattern.search(_normalize_text(fields['price']) or '')
+    if price_match is None:
+        raise ValueError(f'#{rank} 产品卡片的价格 "{fields['price']}" 解析失败')
     price = float(f'{price_match.group(1)}.{price_match.group(2)}')
 
     # 解析评分
     rating: Optional[float] = None
-    rating_span = card.locator('css=span.average-rating')
-    if await rating_span.count() == 1:
-        rating = float(await rating_span.inner_text(timeout=MS1000))
+    if fields['rating'] is not None:
+        rating = float(_normalize_text(fields['rating']))  # type: ignore
 
     # 解析评论数
     review = 0
-    review_span = card.locator('css=span.visible-xs-inline-block')
-    if await review_span.count() == 1:
-        review = int(re.search(r'\((\d+)\)', await review_span.inner_text(timeout=MS1000)).group(1))  # type: ignore
+    if fields['review'] is not None:
+        review = int(_review_pattern.search(fields['review']).group(1))  # type: ignore
 
-    return ProductCardItem(
+    return dict(
         title=title,
         pnk=pnk,
         product_id=data_offer_id,
@@ -147,57 +275,91 @@ async def parse_card_item(card: Locator, category: str, source_url: str, rank: i
         rating=rating,
         review=review,
         image_url=image_url,
-        # card_div_screenshot_base64=card_screenshot_base64,
         cart_added=False,
         max_qty=None,
     )
 
 
-_success_added_products: dict[str, set[str]] = defaultdict(set)
-"""加购成功的产品 { category: { product_ids } }"""
+@timed('parse_card_items')
+async def parse_card_items(cards: Locator, category: str, source_url: str) -> list[ProductCardItem]:
+    """一次性解析所有产品卡片上的数据，rank 按卡片顺序从 1 开始"""
+    fields_list: list[dict[str, Any]] = await cards.evaluate_all(_cards_fields_js)
+    return ProductCardItem.trusted_many(
+        build_card_record(f, category, source_url, i) for i, f in enumerate(fields_list, 1)
+    )
+
+
+_success_added_products: WeakKeyDictionary[BrowserContext, defaultdict[str, set[str]]] = WeakKeyDictionary()
+"""
+加购成功的产品 { context: { category: { product_ids } } }
+
+购物车是按 context 共享的，所以按 context 区分，不同 context 可以并发加购
+"""
 _newaddtocart_endpoint = re.compile(r'emag\.ro/newaddtocart')
 """加购请求的 endpoint"""
 
 
-async def newaddtocart(card: Locator) -> None:
-    """加购单个产品"""
+@timed('newaddtocart')
+async def newaddtocart(cards: CardSnapshot, product_id: str) -> None:
+    """加购单个产品，按 click_policy 重试仍然点击失败时抛出 RetryError"""
     # BUG 不能保证所有点击了加购的产品确实已被加购
     # BUG 会重复加购
 
-    while True:
-        try:
-            await card.locator('css=button.yeahIWantThisProduct').click(timeout=MS1000)
-        except PlaywrightError:
-            continue
-        else:
-            break
+    async def click() -> None:
+        card = await cards.get(product_id)
+        button = await card.query_selector('css=button.yeahIWantThisProduct')
+        if button is None:
+            raise PlaywrightError(f'data-offer-id={product_id} 的产品卡片上没有加购按钮')
+        await button.click(timeout=MS1000)
 
+    await retry(click, 'newaddtocart', click_policy)
 
-def _newaddtocart_request_handler(category: str, route: Route, logger: Logger) -> Awaitable[None]:
-    """检查要加购的产品是否已经被加购过，已被加购就拦截该请求"""
+
+def _get_success_added_products(context: BrowserContext, category: str) -> set[str]:
+    """该 context 内该类目加购成功的产品"""
+    return _success_added_products.setdefault(context, defaultdict(set))[category]
+
+
+def _newaddtocart_request_handler(
+    added: set[str],
+    route: Route,
+    logger: Logger,
+    tags: tuple[tuple[str, str], ...],
+) -> Awaitable[None]:
+    """检查要加购的产品是否已经被加购过，已被加购就拦截该请求，tags 为注册时的统计标签"""
     post_data = route.request.post_data
 
     if post_data is None:
-        return route.continue_()
+        return route.fallback()
     product_id_match = re.search(r'product%5B%5D=(\d+)', post_data)
     if product_id_match is None:
-        return route.continue_()
+        return route.fallback()
 
     # 如果产品已被加购就拒绝该加购请求
     product_id: str = product_id_match.group(1)
-    if product_id in _success_added_products[category]:
+    if product_id in added:
         logger.warning(f'检测到已加购产品，data-offer-id={product_id} 的加购请求已拒绝')
-        return route.abort()
+        metrics.inc('newaddtocart_aborted', tags=tags)
+        return route.abort('aborted')
 
-    return route.continue_()
+    return route.fallback()
 
 
-def _newaddtocart_response_handler(category: str, response: Response, logger: Logger) -> None:
-    """将加购成功的产品的请求记录到 _success_added_products"""
-    if response.status == 511:
-        logger.error(f'请求 "{response.url}" 触发验证')
-        input('等待处理验证后继续...')
+async def _newaddtocart_response_handler(
+    added: set[str],
+    challenged: set[str],
+    products_by_id: dict[str, list[ProductCardItem]],
+    response: Response,
+    logger: Logger,
+    tags: tuple[tuple[str, str], ...],
+) -> None:
+    """
+    将加购成功的产品的请求记录到 _success_added_products
 
+    触发验证的加购请求不算成功，记录到 challenged，通过验证后重新加购；
+    响应中带有最大可加购数时，直接填入 products_by_id 中对应的产品，不再需要从购物车页解析；
+    tags 为注册时的统计标签
+    """
     # 不是加购请求 newaddtocart
     if _newaddtocart_endpoint.search(response.url) is None:
         return
@@ -211,92 +373,432 @@ def _newaddtocart_response_handler(category: str, response: Response, logger: Lo
     if product_id_match is None:
         return
 
-    # 记录该产品已被加购
     product_id: str = product_id_match.group(1)
-    _success_added_products[category].add(product_id)
+    if response.status == 511:
+        metrics.inc('challenge_511', tags=tags)
+        challenged.add(product_id)
+        logger.warning(f'data-offer-id={product_id} 的加购请求触发验证，通过验证后重新加购')
+        return
+
+    # 记录该产品已被加购
+    challenged.discard(product_id)
+    added.add(product_id)
     logger.debug(f'记录加购请求，添加 data-offer-id={product_id} 到已加购集合')
 
+    # 从响应中解析最大可加购数
+    max_qty = await read_newaddtocart_max_qty(response, product_id, logger)
+    if max_qty is None:
+        metrics.inc('newaddtocart_max_qty_missing', tags=tags)
+        return
+    metrics.inc('newaddtocart_max_qty', tags=tags)
+    for p in products_by_id.get(product_id, ()):
+        if p.max_qty is not None:
+            continue
+        p.max_qty = max_qty
+        p.cart_added = True
+        logger.debug(
+            f'从加购响应解析到 #{p.rank_in_page} pnk="{p.pnk}" data-offer-id={product_id} 的最大可加购数 {max_qty}'
+        )
+
 
-async def category_handler(page: Page, category: str, logger: Logger) -> list[ProductCardItem]:
+async def _reclick_challenged(
+    cards: CardSnapshot,
+    challenged: set[str],
+    challenge: ChallengeCoordinator,
+    tracker: RequestTracker,
+    logger: Logger,
+) -> None:
+    """通过验证后重新加购加购请求触发了验证的产品"""
+    while len(challenged) > 0:
+        await challenge.wait()
+
+        product_ids = list(challenged)
+        challenged.clear()
+        logger.info(f'重新加购 {len(product_ids)} 个触发验证的产品')
+        for product_id in product_ids:
+            await challenge.wait()
+            try:
+                await newaddtocart(cards, product_id)
+            except RetryError as retry_error:
+                logger.warning(f'data-offer-id={product_id} 重新加购失败，跳过\n{retry_error}')
+
+        await tracker.wait_for_idle(MS1000, 10 * MS1000)
+
+
+async def _settle_cart(
+    context: BrowserContext,
+    products: list[ProductCardItem],
+    cart_probe: Optional[CartProbe],
+    logger: Logger,
+) -> None:
     """
-    处理一个类目页
+    从购物车解析加购响应中没有解析到的最大可加购数，然后清空购物车
 
-    1. 加购前 40 个产品，并解析其产品卡片
-    2. 打开购物车解析已加购产品的最大可加购数
-    3. 清空购物车
-    4. 加购剩余产品，并解析其产品卡片
-    5. 打开购物车解析已加购产品的最大可加购数
-    6. 清空购物车
+    传入 cart_probe 时用 HTTP 请求读取、清空购物车，不打开购物车页，读取出错时退回到购物车页；
+    否则打开购物车页，所有产品都已从加购响应中解析到时只清空购物车；
+    购物车内是这一批的所有产品，所以与整批产品对账，已解析到的产品会被跳过
     """
+    unresolved = sum(1 for p in products if p.max_qty is None)
+    if unresolved == 0:
+        logger.info('所有产品的最大可加购数都已从加购响应中解析到')
+
+    if cart_probe is not None:
+        qtys = await cart_probe.fetch_cart(logger)
+        if qtys is not None:
+            if unresolved > 0:
+                apply_max_qtys(products, qtys, logger)
+            if len(qtys) > 0:
+                await cart_probe.remove_from_cart({data_id for data_id, _ in qtys}, logger)
+            return
+        logger.warning('HTTP 读取购物车失败，打开购物车页')
+
+    cart_page = await goto_cart_page(context, logger)
+    if unresolved > 0:
+        await parse_max_qtys(cart_page, products, logger)
+    await clear_cart(cart_page, logger)
+    await cart_page.close()
+
+
+def _save_progress(
+    checkpoint: Optional[PageCheckpoint],
+    sink: Optional[JsonlSink],
+    dedupe: Optional[DedupeIndex],
+    products: list[ProductCardItem],
+    added: set[str],
+) -> None:
+    """记录加购请求已成功、已解析到最大可加购数的产品，并把加购结果写入 sink、dedupe"""
+    if sink is not None:
+        sink.write_patches(p for p in products if p.max_qty is not None)
+    if dedupe is not None:
+        dedupe.record_resolved(products)
+    if checkpoint is None:
+        return
+    checkpoint.record_confirmed(p.product_id for p in products if p.product_id in added)
+    checkpoint.record_resolved(p for p in products if p.max_qty is not None)
 
-    logger.info(f'处理类目 "{category}" 链接 "{page.url}"')
 
-    # TODO 如何保证在触发验证后能暂停，并在通过验证后从暂停点继续？
+class _CartLane:
+    """
+    一个 context 内的加购通道：在该 context 打开的类目页上点击加购，加购到该 context 的购物车
 
-    # 拦截已加购产品的加购请求
-    await page.route(
-        _newaddtocart_endpoint,
-        lambda r: _newaddtocart_request_handler(category, r, logger),
-    )
-    # 记录加购成功的产品
-    page.on(
-        'response',
-        lambda r: _newaddtocart_response_handler(category, r, logger),
-    )
+    每个通道各自统计进行中的加购请求、控制加购节奏、处理验证；凑够一批后解析最大可加购数并清空购物车
+    """
 
-    # 非 Promovat、非 Vezi Detalii 的加购按钮的所属产品卡片
-    product_card_divs = page.locator(
-        'div.card-item[data-offer-id]',
-        has_not=page.locator('css=span.card-v2-badge-cmp.bg-light'),
-        has=page.locator('css=button.yeahIWantThisProduct'),
-    )
+    def __init__(
+        self,
+        page: Page,
+        category: str,
+        products_by_id: dict[str, list[ProductCardItem]],
+        cart_probe: Optional[CartProbe],
+        logger: Logger,
+        pacing: Optional[PacingConfig] = None,
+    ) -> None:
+        self.page = page
+        self.cart_probe = cart_probe
+        self._products_by_id = products_by_id
+        self._logger = logger
+
+        self.added = _get_success_added_products(page.context, category)
+        # 加购请求触发验证的产品
+        self.challenged: set[str] = set()
+        # 触发验证时暂停，通过验证后从暂停点继续
+        self.challenge = get_challenge_coordinator(page.context)
+        # 统计进行中的加购请求
+        self.tracker = RequestTracker(page, _newaddtocart_endpoint)
+        # 控制点击加购的节奏
+        self.pacer = AddToCartPacer(page, _newaddtocart_endpoint, logger, pacing)
+
+        self.cards = CardSnapshot(locate_product_cards(page), logger)
+        self.batch: list[ProductCardItem] = list()
+        """已点击加购、还没有从购物车解析的产品"""
+        self.settling: Optional[asyncio.Task[None]] = None
+        """正在解析、清空购物车的任务，完成前不能继续在该通道加购"""
+        self._tags = current_tags()
+        """创建时（所在类目页）的统计标签，事件处理器中拿不到"""
+        self._handling: set[asyncio.Task[None]] = set()
+        """还在读取响应体、解析最大可加购数的加购响应处理任务"""
+
+    async def install(self) -> None:
+        """拦截已加购产品的加购请求，记录加购成功的产品，处理加购弹窗"""
+        await self.page.route(
+            _newaddtocart_endpoint,
+            lambda r: _newaddtocart_request_handler(self.added, r, self._logger, self._tags),
+        )
+        self.page.on('response', self._on_response)
+        # NOTICE 点击加购按钮的速度太快会导致页面崩溃
+        await self.page.add_locator_handler(
+            self.page.locator('css=div.modal-header > button.close'),
+            newaddtocart_dialog_handler,
+        )
 
-    result: list[ProductCardItem] = list()
+    @property
+    def busy(self) -> bool:
+        """是否正在后台解析、清空购物车"""
+        return self.settling is not None and not self.settling.done()
+
+    def _on_response(self, response: Response) -> None:
+        """在后台处理加购响应，settle 时等待所有处理完成"""
+        if _newaddtocart_endpoint.search(response.url) is None:
+            return
+        task = asyncio.create_task(
+            _newaddtocart_response_handler(
+                self.added, self.challenged, self._products_by_id, response, self._logger, self._tags
+            )
+        )
+        self._handling.add(task)
+        task.add_done_callback(self._handling.discard)
 
-    product_card_count = await product_card_divs.count()
-    logger.debug(f'找到 {product_card_count} 个非 Promovat、非 Vezi Detalii 的产品卡片')
+    async def click(self, p: ProductCardItem) -> bool:
+        """等待上一批的购物车清空后，点击加购一个产品，返回是否点击成功"""
+        if self.settling is not None:
+            await self.settling
+            self.settling = None
 
-    # NOTICE 点击加购按钮的速度太快会导致页面崩溃
-    # 处理加购弹窗
-    await page.add_locator_handler(
-        page.locator('css=div.modal-header > button.close'),
-        newaddtocart_dialog_handler,
-    )
+        # 根据加购请求的响应情况等待
+        await self.pacer.acquire()
+        await self.challenge.wait()
 
-    for i in range(product_card_count):
-        # 每处理一个产品卡片就等待 0.5 秒
-        await asyncio.sleep(0.5)
-
-        # 加购到 40 个产品，处理一批
-        if i == 40:
-            logger.info('等待所有加购请求完成')
-            await wait_for_networkidle(page, 10 * MS1000)
-
-            _cart_page = await goto_cart_page(page.context, logger)
-            await parse_max_qtys(_cart_page, result, logger)
-            await clear_cart(_cart_page, logger)
-            await _cart_page.close()
-
-        logger.debug(f'尝试加购产品 #{i+1}')
-        await newaddtocart(product_card_divs.nth(i))
-        logger.debug(f'尝试解析产品 #{i+1}')
-        p = await parse_card_item(
-            product_card_divs.nth(i),
-            category,
-            page.url,
-            i + 1,
-        )
-        logger.debug(f'解析产品成功 #{p.rank_in_page} pnk="{p.pnk}" data-offer-id={p.product_id}')
-        result.append(p)
+        try:
+            await newaddtocart(self.cards, p.product_id)
+        except RetryError as retry_error:
+            self._logger.warning(
+                f'产品 #{p.rank_in_page} pnk="{p.pnk}" data-offer-id={p.product_id} 的加购按钮一直点击失败，跳过\n{retry_error}'
+            )
+            return False
+        self.batch.append(p)
+        return True
+
+    async def settle(self, save: Callable[[list[ProductCardItem], set[str]], None]) -> None:
+        """等待这一批的加购请求完成，解析最大可加购数并清空购物车"""
+        batch, self.batch = self.batch, list()
+
+        self._logger.info('等待所有加购请求完成')
+        await self.tracker.wait_for_idle(MS1000, 10 * MS1000)
+        await _reclick_challenged(self.cards, self.challenged, self.challenge, self.tracker, self._logger)
+        # 请求完成后响应处理器还在读取响应体，等它们填完最大可加购数再统计没有解析到的产品
+        await asyncio.gather(*self._handling, return_exceptions=True)
+
+        await _settle_cart(self.page.context, batch, self.cart_probe, self._logger)
+        save(batch, self.added)
+
+    async def close(self) -> None:
+        """取消还在后台解析、清空购物车的任务，移除该通道在页面上的监听"""
+        if self.settling is not None:
+            self.settling.cancel()
+            try:
+                await self.settling
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                self._logger.error(f'后台解析、清空购物车时出错\n{e}')
+            self.settling = None
+
+        self.page.remove_listener('response', self._on_response)
+        self.tracker.close()
+        self.pacer.close()
+
+
+async def category_handler(
+    page: Page,
+    category: str,
+    logger: Logger,
+    pacing: Optional[PacingConfig] = None,
+    checkpoint: Optional[PageCheckpoint] = None,
+    cart_probe: Optional[CartProbe] = None,
+    sink: Optional[JsonlSink] = None,
+    max_qty_cache: Optional[MaxQtyCache] = None,
+    dedupe: Optional[DedupeIndex] = None,
+    batch_size: int = 40,
+    pipeline_page: Optional[Page] = None,
+) -> list[ProductCardItem]:
+    """
+    处理一个类目页
+
+    1. 解析所有产品卡片
+    2. 加购 batch_size 个产品
+    3. 解析已加购产品的最大可加购数
+    4. 清空购物车
+    5. 重复 2-4 直到所有产品都已加购
+
+    batch_size 应在 1 到购物车能容纳的产品数（cart_capacity）之间，否则抛出 ValueError；
+    传入 pipeline_page（另一个 context 打开的同一个类目页）时，两个 context 的购物车轮流使用：
+    一个购物车在解析、清空时，另一个继续加购下一批；
+
+    传入 checkpoint 时会记录每个产品的处理进度，并跳过断点中已解析到最大可加购数的产品；
+    点击加购后优先从加购响应中解析最大可加购数，解析不到的再从购物车页解析；
+    传入 cart_probe 时先用 HTTP 请求探测最大可加购数，只有探测失败的产品才点击加购，
+    之后每批加购完成后也用 HTTP 请求读取、清空购物车；
+    传入 sink 时解析到产品卡片、最大可加购数后立即写入；
+    传入 max_qty_cache 时，与上一次爬取相比没有变化的产品直接复用缓存的最大可加购数，不再加购；
+    传入 dedupe 时，本次运行中其他位置已解析到最大可加购数的产品直接取用，不再加购，
+    并把该页解析到的最大可加购数、每个产品出现的位置记录到 dedupe
+    """
+
+    logger.info(f'处理类目 "{category}" 链接 "{page.url}"')
 
-    logger.info('等待所有加购请求完成')
-    await wait_for_networkidle(page, 10 * MS1000)
+    # 按 data-offer-id 索引产品，解析到产品卡片后填入
+    products_by_id: dict[str, list[ProductCardItem]] = defaultdict(list)
 
-    _cart_page = await goto_cart_page(page.context, logger)
-    await parse_max_qtys(_cart_page, result, logger)
-    await clear_cart(_cart_page, logger)
-    await _cart_page.close()
+    # 每个 context 一个加购通道；出错时也要取消后台任务、移除监听、关闭页面，否则后台任务会在下一页继续操作配对 context 的购物车
+    lanes: list[_CartLane] = list()
+    try:
+        if not 1 <= batch_size <= cart_capacity:
+            raise ValueError(f'batch_size 应在 1-{cart_capacity} 之间，而不是 {batch_size}')
+
+        lanes.append(_CartLane(page, category, products_by_id, cart_probe, logger, pacing))
+        if pipeline_page is not None:
+            lanes.append(_CartLane(pipeline_page, category, products_by_id, None, logger, pacing))
+        for lane in lanes:
+            await lane.install()
+
+        result: list[ProductCardItem] = list()
+
+        # 一次性解析所有产品卡片
+        items = await parse_card_items(locate_product_cards(page), category, page.url)
+        for p in items:
+            products_by_id[p.product_id].append(p)
+        logger.debug(f'找到 {len(items)} 个非 Promovat、非 Vezi Detalii 的产品卡片')
+
+        # 把产品卡片解析为按 data-offer-id 保存的 ElementHandle，另一个 context 的页面上卡片的顺序不一定相同
+        for lane in lanes:
+            await lane.cards.refresh()
+
+        # 已解析到最大可加购数的产品
+        resolved: set[str] = set()
+
+        # 从断点恢复已解析到最大可加购数的产品
+        if checkpoint is not None:
+            restored = checkpoint.load()
+            for p in items:
+                if p.product_id not in restored:
+                    continue
+                state, restored_item = restored[p.product_id]
+                if state is CardState.RESOLVED:
+                    p.cart_added = restored_item.cart_added
+                    p.max_qty = restored_item.max_qty
+                    p.max_qty_cached = restored_item.max_qty_cached
+                    p.deduped = restored_item.deduped
+                    resolved.add(p.product_id)
+            checkpoint.record_parsed(items)
+            if len(resolved) > 0:
+                logger.info(f'从断点恢复了 {len(resolved)} 个已解析到最大可加购数的产品')
+                if dedupe is not None:
+                    dedupe.record_resolved(p for p in items if p.product_id in resolved)
+
+        # 复用上一次爬取的最大可加购数
+        if max_qty_cache is not None:
+            hits = max_qty_cache.apply(p for p in items if p.product_id not in resolved)
+            resolved |= {p.product_id for p in hits}
+            _save_progress(checkpoint, None, None, hits, set())
+            logger.info(f'{len(hits)} 个产品没有变化，复用上一次爬取的最大可加购数')
+
+        # 取用本次运行中其他位置已解析到的最大可加购数
+        if dedupe is not None:
+            dedupe.record_occurrences(items)
+            hits = dedupe.resolve(p for p in items if p.product_id not in resolved)
+            resolved |= {p.product_id for p in hits}
+            _save_progress(checkpoint, None, None, hits, set())
+            logger.info(f'{len(hits)} 个产品已在其他位置解析到最大可加购数，不再加购')
+
+        # 写入产品卡片，包含从断点恢复、从缓存复用、从 dedupe 取用的最大可加购数
+        if sink is not None:
+            sink.write_items(items)
+
+        save = partial(_save_progress, checkpoint, sink, dedupe)
+
+        # 用 HTTP 请求探测最大可加购数
+        if cart_probe is not None:
+            cart_probe.capture(page, logger)
+            pending = [p for p in items if p.product_id not in resolved]
+
+            # 该 context 还没有捕获到加购请求模板时，先点击加购一个产品，从真实的加购请求中捕获
+            if cart_probe.add_template is None and len(pending) > 0:
+                seed = pending.pop(0)
+                logger.info(
+                    f'点击加购 #{seed.rank_in_page} data-offer-id={seed.product_id}，捕获加购请求模板'
+                )
+                if await lanes[0].click(seed):
+                    if checkpoint is not None:
+                        checkpoint.record_sent(seed.product_id)
+                    if not await cart_probe.wait_for_add_template():
+                        logger.warning('没有捕获到加购请求模板，HTTP 加购请求只带 product[]')
+                    await lanes[0].settle(save)
+                    resolved.add(seed.product_id)
+
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i : i + batch_size]
+                logger.info(f'用 HTTP 请求探测第 {i + 1}-{i + len(batch)} 个产品的最大可加购数')
+                await cart_probe.probe(batch, logger)
+                _save_progress(checkpoint, sink, dedupe, batch, {p.product_id for p in batch if p.cart_added})
+            probed = {p.product_id for p in pending if p.max_qty is not None}
+            logger.info(f'HTTP 探测到 {len(probed)}/{len(pending)} 个产品的最大可加购数，其余产品点击加购')
+            resolved |= probed
+
+        lane_num = 0
+
+        async def add_to_cart(lane: _CartLane, p: ProductCardItem) -> None:
+            """在 lane 加购一个产品，凑够 batch_size 个时处理一批"""
+            nonlocal lane_num
+
+            logger.debug(f'尝试加购产品 #{p.rank_in_page}')
+            if not await lane.click(p):
+                return
+            if checkpoint is not None:
+                checkpoint.record_sent(p.product_id)
+            logger.debug(f'解析产品成功 #{p.rank_in_page} pnk="{p.pnk}" data-offer-id={p.product_id}')
+
+            # 加购到 batch_size 个产品，处理一批；有两个通道时在后台处理，同时换到另一个通道继续加购
+            if len(lane.batch) >= batch_size:
+                if len(lanes) == 1:
+                    await lane.settle(save)
+                else:
+                    lane.settling = asyncio.create_task(lane.settle(save))
+                    lane_num = (lanes.index(lane) + 1) % len(lanes)
+
+        # 另一个 context 的页面上没有、只能在第一个通道加购，而第一个通道正在处理购物车的产品，
+        # 先跳过，等第一个通道处理完再加购，不让它们阻塞另一个通道
+        deferred: list[ProductCardItem] = list()
+
+        for p in items:
+            result.append(p)
+
+            # 跳过已解析到最大可加购数的产品，包括刚在其他页面解析到的
+            if p.product_id in resolved or (dedupe is not None and len(dedupe.resolve((p,))) > 0):
+                logger.debug(
+                    f'跳过已解析到最大可加购数的产品 #{p.rank_in_page} pnk="{p.pnk}" data-offer-id={p.product_id}'
+                )
+                continue
 
-    await page.close()
+            lane = lanes[lane_num]
+            if p.product_id not in lane.cards:
+                if lanes[0].busy:
+                    deferred.append(p)
+                    continue
+                lane = lanes[0]
+            await add_to_cart(lane, p)
+
+            while len(deferred) > 0 and not lanes[0].busy:
+                await add_to_cart(lanes[0], deferred.pop(0))
+
+        for p in deferred:
+            await add_to_cart(lanes[0], p)
+
+        for lane in lanes:
+            if lane.settling is not None:
+                await lane.settling
+                lane.settling = None
+            if len(lane.batch) > 0:
+                await lane.settle(save)
+    finally:
+        for lane in lanes:
+            await lane.close()
+        if pipeline_page is not None:
+            await pipeline_page.close()
+        await page.close()
+
+    # 购物车没有解析到的产品，可能已在其他页面解析到
+    if dedupe is not None:
+        dedupe.resolve(p for p in result if p.max_qty is None)
+    _save_progress(checkpoint, sink, dedupe, result, set().union(*(lane.added for lane in lanes)))
 
     return result
@@ -0,0 +1,298 @@
+"""产品的历史数据"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+import sqlite3
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from .archive import archive_dirs, page_files, read_page_records
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Literal, Mapping, Optional
+
+    from .models import ProductCardItem
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS products (
+    pnk TEXT NOT NULL,
+    category TEXT NOT NULL,
+    crawl_date TEXT NOT NULL,
+    title TEXT NOT NULL,
+    rank_in_category INTEGER NOT NULL,
+    price REAL,
+    rating REAL,
+    review INTEGER,
+    max_qty INTEGER,
+    top_favorite INTEGER NOT NULL,
+    cart_added INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    product_id TEXT,
+    max_qty_date TEXT,
+    PRIMARY KEY (pnk, category, crawl_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS products_by_date ON products (category, crawl_date, rank_in_category);
+"""
+
+_added_columns = (('product_id', 'TEXT'), ('max_qty_date', 'TEXT'))
+"""后来添加的列，打开旧的数据库时补上"""
+
+_columns = (
+    'pnk',
+    'category',
+    'crawl_date',
+    'title',
+    'rank_in_category',
+    'price',
+    'rating',
+    'review',
+    'max_qty',
+    'top_favorite',
+    'cart_added',
+    'updated_at',
+    'product_id',
+    'max_qty_date',
+)
+
+_upsert_sql = (
+    f'INSERT INTO products ({', '.join(_columns)}) VALUES ({', '.join('?' for _ in _columns)}) '
+    'ON CONFLICT (pnk, category, crawl_date) DO UPDATE SET '
+    + ', '.join(f'{c} = excluded.{c}' for c in _columns[3:])
+    + ' WHERE excluded.rank_in_category <= products.rank_in_category'
+)
+"""同一天同一类目内同一个产品出现多次时，只保留排名最靠前的那次"""
+
+
+def iso_crawl_date(mmdd: str, today: Optional[date] = None) -> str:
+    """把归档目录的 MMDD 转换为 YYYY-MM-DD，晚于 today 的日期视为去年的"""
+    today = today or date.today()
+    year = today.year if mmdd <= today.strftime('%m%d') else today.year - 1
+    return f'{year}-{mmdd[:2]}-{mmdd[2:]}'
+
+
+class HistoryStore:
+    """
+    按 (pnk, 类目, 爬取日期) 保存每个产品的价格、排名、评分、评论数、最大可加购数、Top 标志
+
+    用 SQLite 的 WAL 模式保存，爬取日期为 YYYY-MM-DD；爬取时逐页写入，也可以导入 output/ 下的归档；
+    爬取时用 asyncio.to_thread 调用 record_items、max_qty_cache，不阻塞事件循环，两者用锁串行访问连接
+    """
+
+    def __init__(self, path: Path, crawl_date: Optional[str] = None) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.crawl_date = crawl_date or date.today().isoformat()
+        """record_items 默认使用的爬取日期"""
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_schema)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        existing = {r['name'] for r in self._conn.execute('PRAGMA table_info(products)')}
+        with self._conn:
+            for name, type_ in _added_columns:
+                if name not in existing:
+                    self._conn.execute(f'ALTER TABLE products ADD COLUMN {name} {type_}')
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _record_rows(self, records: Iterable[Mapping[str, Any]], crawl_date: str) -> int:
+        records = list(records)
+        with self._lock:
+            return self._upsert_rows(records, crawl_date)
+
+    def _upsert_rows(self, records: list[Mapping[str, Any]], crawl_date: str) -> int:
+        now = time()
+
+        # 解析到最大可加购数的日期，复用缓存的产品沿用原来的日期
+        cached_dates = self._max_qty_dates(
+            ((r['pnk'], r['category']) for r in records if r.get('max_qty_cached')), crawl_date
+        )
+
+        def max_qty_date(r: Mapping[str, Any]) -> Optional[str]:
+            if r['max_qty'] is None:
+                return None
+            if r.get('max_qty_cached'):
+                return cached_dates.get((r['pnk'], r['category']), crawl_date)
+            return crawl_date
+
+        rows = [
+            (
+                r['pnk'],
+                r['category'],
+                crawl_date,
+                r['title'],
+                r['rank_in_category'],
+                r['price'],
+                r['rating'],
+                r['review'],
+                r['max_qty'],
+                int(r['top_favorite']),
+                int(r['cart_added']),
+                now,
+                r['product_id'],
+                max_qty_date(r),
+            )
+            for r in records
+        ]
+        with self._conn:
+            self._conn.executemany(_upsert_sql, rows)
+        return len(rows)
+
+    def _max_qty_dates(self, keys: Iterable[tuple[str, str]], before: str) -> dict[tuple[str, str], str]:
+        """产品在 before 之前最近一次解析到最大可加购数的日期"""
+        result: dict[tuple[str, str], str] = dict()
+        for pnk, category in keys:
+            row = self._conn.execute(
+                'SELECT max_qty_date FROM products WHERE pnk = ? AND category = ? AND crawl_date < ? '
+                'AND max_qty_date IS NOT NULL ORDER BY crawl_date DESC LIMIT 1',
+                (pnk, category, before),
+            ).fetchone()
+            if row is not None:
+                result[(pnk, category)] = row[0]
+        return result
+
+    def record_items(self, items: Iterable[ProductCardItem], crawl_date: Optional[str] = None) -> int:
+        """记录爬取到的产品，返回记录数"""
+        return self._record_rows((_.model_dump() for _ in items), crawl_date or self.crawl_date)
+
+    def ingest_archive(
+        self,
+        output_dir: Path,
+        categories: Optional[Iterable[str]] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        max_workers: Optional[int] = None,
+    ) -> int:
+        """
+        导入 output/<category>/<MMDD>/ 下归档的页面文件，返回记录数
+
+        categories 为 None 时导入 output_dir 下的所有类目；start、end 为 MMDD，与 archive_dirs 一致；
+        已导入过的数据会被覆盖，可以重复导入
+        """
+        if categories is None:
+            categories = sorted(d.name for d in output_dir.iterdir() if d.is_dir())
+
+        count = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for category in categories:
+                for mmdd, json_dir in archive_dirs(output_dir, category, start, end):
+                    crawl_date = iso_crawl_date(mmdd)
+                    for records in executor.map(read_page_records, page_files(json_dir)):
+                        count += self._record_rows(records, crawl_date)
+        return count
+
+    def dates(self, category: str) -> list[str]:
+        """该类目有记录的爬取日期"""
+        rows = self._conn.execute(
+            'SELECT DISTINCT crawl_date FROM products WHERE category = ? ORDER BY crawl_date', (category,)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def product_history(self, pnk: str, category: Optional[str] = None) -> list[dict[str, Any]]:
+        """产品每天的价格、排名等数据，按爬取日期排序"""
+        sql = 'SELECT * FROM products WHERE pnk = ?'
+        params: tuple[str, ...] = (pnk,)
+        if category is not None:
+            sql += ' AND category = ?'
+            params += (category,)
+        rows = self._conn.execute(sql + ' ORDER BY crawl_date, category', params).fetchall()
+        return [dict(r) for r in rows]
+
+    def movers(
+        self,
+        category: str,
+        from_date: str,
+        to_date: str,
+        by: Literal['price', 'rank_in_category'] = 'rank_in_category',
+        limit: int = 20,
+    ) -> list[dict[str, Any]]:
+        """
+        两天都出现的产品中，价格或排名变化最大的 limit 个产品
+
+        返回的 delta 为 to_date 减去 from_date 的值，排名的 delta 为负表示排名上升
+        """
+        if by not in ('price', 'rank_in_category'):
+            raise ValueError(f'不支持按 "{by}" 比较')
+        rows = self._conn.execute(
+            f'SELECT b.pnk, b.title, a.{by} AS before, b.{by} AS after, b.{by} - a.{by} AS delta '
+            'FROM products a JOIN products b ON a.pnk = b.pnk AND a.category = b.category '
+            'WHERE a.category = ? AND a.crawl_date = ? AND b.crawl_date = ? '
+            f'AND a.{by} IS NOT NULL AND b.{by} IS NOT NULL AND b.{by} != a.{by} '
+            'ORDER BY ABS(delta) DESC LIMIT ?',
+            (category, from_date, to_date, limit),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def new_products(self, category: str, from_date: str, to_date: str) -> list[dict[str, Any]]:
+        """to_date 出现但 from_date 没有出现的产品，按 to_date 的排名排序"""
+        return self._diff(category, to_date, from_date)
+
+    def dropped_products(self, category: str, from_date: str, to_date: str) -> list[dict[str, Any]]:
+        """from_date 出现但 to_date 没有出现的产品，按 from_date 的排名排序"""
+        return self._diff(category, from_date, to_date)
+
+    def _diff(self, category: str, present_date: str, absent_date: str) -> list[dict[str, Any]]:
+        rows = self._conn.execute(
+            'SELECT a.* FROM products a WHERE a.category = ? AND a.crawl_date = ? AND NOT EXISTS ('
+            'SELECT 1 FROM products b WHERE b.pnk = a.pnk AND b.category = a.category AND b.crawl_date = ?'
+            ') ORDER BY a.rank_in_category',
+            (category, present_date, absent_date),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def max_qty_cache(self, category: str, ttl_days: int, crawl_date: Optional[str] = None) -> MaxQtyCache:
+        """
+        该类目上一次爬取中可以复用的最大可加购数
+
+        只包含解析到最大可加购数的日期距 crawl_date 不超过 ttl_days 天的产品
+        """
+        crawl_date = crawl_date or self.crawl_date
+        oldest = (date.fromisoformat(crawl_date) - timedelta(days=ttl_days)).isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT pnk, product_id, price, max_qty FROM products '
+                'WHERE category = ? AND crawl_date = ('
+                'SELECT MAX(crawl_date) FROM products WHERE category = ? AND crawl_date < ?'
+                ') AND max_qty IS NOT NULL AND max_qty_date >= ?',
+                (category, category, crawl_date, oldest),
+            ).fetchall()
+        return MaxQtyCache({r['pnk']: (r['product_id'], r['price'], r['max_qty']) for r in rows})
+
+
+class MaxQtyCache:
+    """
+    上一次爬取到的最大可加购数 { pnk: (data-offer-id, 价格, 最大可加购数) }
+
+    pnk、data-offer-id、价格都没有变化的产品直接复用，不再加购，所以这些产品的 cart_added 仍为 False
+    """
+
+    def __init__(self, entries: dict[str, tuple[Optional[str], Optional[float], int]]) -> None:
+        self._entries = entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def apply(self, items: Iterable[ProductCardItem]) -> list[ProductCardItem]:
+        """给命中缓存的产品填入最大可加购数，返回命中的产品"""
+        hits: list[ProductCardItem] = list()
+        for p in items:
+            entry = self._entries.get(p.pnk)
+            if entry is None:
+                continue
+            product_id, price, max_qty = entry
+            if product_id != p.product_id or price != p.price:
+                continue
+            p.max_qty = max_qty
+            p.max_qty_cached = True
+            hits.append(p)
+        return hits
@@ -0,0 +1,142 @@
+"""离线解析类目页 HTML"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from lxml import etree, html as lxml_html
+
+from .handlers.cart_page import cart_data_id_pattern
+from .handlers.category_page import build_card_record
+from .models import ProductCardItem
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional
+
+    from lxml.html import HtmlElement
+    from playwright.async_api import Page
+
+
+def _has_class(name: str) -> str:
+    """与 css 的 .class 选择器等价的 xpath 条件"""
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+_product_cards_xpath = etree.XPath(
+    f'//div[{_has_class('card-item')} and @data-offer-id]'
+    f'[not(.//span[{_has_class('card-v2-badge-cmp')} and {_has_class('bg-light')}])]'
+    f'[.//button[{_has_class('yeahIWantThisProduct')}]]'
+)
+"""与 locate_product_cards 等价：非 Promovat、非 Vezi Detalii 的加购按钮的所属产品卡片"""
+
+_title_xpath = etree.XPath(f'.//a[{_has_class('card-v2-title')}]')
+_image_xpath = etree.XPath(f'.//div[{_has_class('img-component')}]/img[@src]')
+_badge_xpath = etree.XPath(f'.//span[{_has_class('card-v2-badge-cmp')}]')
+_price_xpath = etree.XPath(f'.//p[{_has_class('product-new-price')}]')
+_rating_xpath = etree.XPath(f'.//span[{_has_class('average-rating')}]')
+_review_xpath = etree.XPath(f'.//span[{_has_class('visible-xs-inline-block')}]')
+_canonical_xpath = etree.XPath('//link[@rel="canonical"]/@href')
+
+_cart_widgets_xpath = etree.XPath(f'//div[{_has_class('cart-widget')} and @data-id]')
+_max_qty_input_xpath = etree.XPath('.//input[@max]')
+
+
+def _first_text(elements: list[HtmlElement]) -> Optional[str]:
+    """第一个元素的 textContent"""
+    if len(elements) == 0:
+        return None
+    return elements[0].text_content()
+
+
+def _only_text(elements: list[HtmlElement]) -> Optional[str]:
+    """只有一个元素时返回其 textContent，与 Locator.count() == 1 的判断保持一致"""
+    if len(elements) != 1:
+        return None
+    return elements[0].text_content()
+
+
+def _card_fields(card: HtmlElement) -> dict[str, Any]:
+    """读取单个产品卡片的原始字段，与 category_page._card_fields_js 保持一致"""
+    images = _image_xpath(card)
+
+    return {
+        'title': _first_text(_title_xpath(card)),
+        'data_url': card.get('data-url'),
+        'data_offer_id': card.get('data-offer-id'),
+        'image_src': images[0].get('src') if len(images) > 0 else None,
+        'badges': [_.text_content() for _ in _badge_xpath(card)],
+        'price': _first_text(_price_xpath(card)),
+        'rating': _only_text(_rating_xpath(card)),
+        'review': _only_text(_review_xpath(card)),
+    }
+
+
+def parse_category_html(
+    html: str | bytes, category: str, source_url: Optional[str] = None
+) -> list[ProductCardItem]:
+    """
+    解析类目页 HTML 中的产品卡片
+
+    不传 source_url 时使用页面的 canonical 链接
+    """
+    root: HtmlElement = lxml_html.fromstring(html)
+
+    if source_url is None:
+        canonical: list[str] = _canonical_xpath(root)
+        if len(canonical) == 0:
+            raise ValueError('HTML 中没有 canonical 链接，请传入 source_url')
+        source_url = canonical[0]
+
+    return ProductCardItem.trusted_many(
+        build_card_record(_card_fields(card), category, source_url, rank)
+        for rank, card in enumerate(_product_cards_xpath(root), 1)
+    )
+
+
+def parse_category_html_file(
+    path: Path,
+    category: str,
+    source_url: Optional[str] = None,
+) -> list[ProductCardItem]:
+    """解析保存下来的类目页 HTML 文件"""
+    return parse_category_html(path.read_bytes(), category, source_url)
+
+
+def _parse_category_html_file_job(job: tuple[Path, str, Optional[str]]) -> list[ProductCardItem]:
+    """给进程池用的 parse_category_html_file"""
+    return parse_category_html_file(*job)
+
+
+def parse_category_html_files(
+    jobs: Iterable[tuple[Path, str, Optional[str]]],
+    max_workers: Optional[int] = None,
+) -> list[list[ProductCardItem]]:
+    """
+    用多进程批量解析保存下来的类目页 HTML 文件
+
+    jobs 的每一项为 (文件路径, 类目, 来源链接)，来源链接为 None 时使用页面的 canonical 链接
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_parse_category_html_file_job, jobs, chunksize=8))
+
+
+def parse_cart_html(html: str | bytes) -> list[tuple[str, int]]:
+    """解析购物车页 HTML 中每个产品的 (data-id, 最大可加购数)，与 cart_page.parse_max_qtys 保持一致"""
+    root: HtmlElement = lxml_html.fromstring(html)
+
+    result: list[tuple[str, int]] = list()
+    for widget in _cart_widgets_xpath(root):
+        data_id_match = cart_data_id_pattern.search(widget.get('data-id'))
+        max_qty_inputs = _max_qty_input_xpath(widget)
+        if data_id_match is None or len(max_qty_inputs) == 0:
+            continue
+        result.append((data_id_match.group(1), int(max_qty_inputs[0].get('max'))))
+
+    return result
+
+
+async def parse_category_page_snapshot(page: Page, category: str) -> list[ProductCardItem]:
+    """对类目页的 HTML 做快照，然后离线解析，不再访问 DOM"""
+    return parse_category_html(await page.content(), category, page.url)
@@ -0,0 +1,169 @@
+"""爬取流程的耗时统计与计数"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable, Generator, Optional, ParamSpec, TypeVar
+
+    from loguru import Logger
+
+    P = ParamSpec('P')
+    R = TypeVar('R')
+
+
+_tags: ContextVar[tuple[tuple[str, str], ...]] = ContextVar('metric_tags', default=())
+"""当前上下文的标签，asyncio 的 task 会继承创建时的标签"""
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    """已排序数据的 q 分位数（最近秩）"""
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _prometheus_labels(tags: tuple[tuple[str, str], ...], **extra: str) -> str:
+    items = [*tags, *extra.items()]
+    if len(items) == 0:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+class Metrics:
+    """记录各阶段的耗时（span）与计数（counter），按标签（类目、页码等）区分"""
+
+    def __init__(self) -> None:
+        self._spans: dict[tuple[str, tuple[tuple[str, str], ...]], list[float]] = defaultdict(list)
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], int] = defaultdict(int)
+
+    def reset(self) -> None:
+        self._spans.clear()
+        self._counters.clear()
+
+    @contextmanager
+    def span(self, name: str, logger: Optional[Logger] = None) -> Generator[None]:
+        """记录一段代码的耗时，传入 logger 时同时输出耗时"""
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start_time
+            self._spans[(name, _tags.get())].append(duration)
+            if logger is not None:
+                logger.debug(f'{name} 耗时 {duration:.3f}s')
+
+    def inc(self, name: str, value: int = 1, tags: Optional[tuple[tuple[str, str], ...]] = None) -> None:
+        """
+        计数加 value
+
+        Playwright 的事件处理器、路由处理器不在注册它们的 task 中执行，拿不到当前上下文的标签，
+        需要在注册时用 current_tags() 取出标签，计数时通过 tags 传入
+        """
+        self._counters[(name, _tags.get() if tags is None else tags)] += value
+
+    def summary(self, by_tags: bool = True) -> dict[str, Any]:
+        """汇总为可以保存成 json 的数据，by_tags=False 时不区分标签"""
+        spans: dict[tuple[str, tuple[tuple[str, str], ...]], list[float]] = defaultdict(list)
+        for (name, tags), durations in self._spans.items():
+            spans[(name, tags if by_tags else ())].extend(durations)
+        counters: dict[tuple[str, tuple[tuple[str, str], ...]], int] = defaultdict(int)
+        for (name, tags), value in self._counters.items():
+            counters[(name, tags if by_tags else ())] += value
+
+        span_summaries: list[dict[str, Any]] = list()
+        for (name, tags), durations in sorted(spans.items()):
+            durations = sorted(durations)
+            span_summaries.append(
+                {
+                    'name': name,
+                    'tags': dict(tags),
+                    'count': len(durations),
+                    'total': round(sum(durations), 4),
+                    'mean': round(sum(durations) / len(durations), 4),
+                    'min': round(durations[0], 4),
+                    'p50': round(_percentile(durations, 0.5), 4),
+                    'p95': round(_percentile(durations, 0.95), 4),
+                    'max': round(durations[-1], 4),
+                }
+            )
+
+        return {
+            'spans': span_summaries,
+            'counters': [
+                {'name': name, 'tags': dict(tags), 'value': value}
+                for (name, tags), value in sorted(counters.items())
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """导出为 Prometheus 的文本格式"""
+        lines: list[str] = [
+            '# HELP emag_crawler_span_seconds 爬取流程各阶段的耗时',
+            '# TYPE emag_crawler_span_seconds summary',
+        ]
+        for (name, tags), durations in sorted(self._spans.items()):
+            durations = sorted(durations)
+            for q in (0.5, 0.95):
+                lines.append(
+                    f'emag_crawler_span_seconds{_prometheus_labels(tags, span=name, quantile=str(q))} '
+                    f'{_percentile(durations, q):.6f}'
+                )
+            lines.append(
+                f'emag_crawler_span_seconds_sum{_prometheus_labels(tags, span=name)} {sum(durations):.6f}'
+            )
+            lines.append(
+                f'emag_crawler_span_seconds_count{_prometheus_labels(tags, span=name)} {len(durations)}'
+            )
+
+        lines.extend(
+            (
+                '# HELP emag_crawler_events_total 爬取流程中的事件计数',
+                '# TYPE emag_crawler_events_total counter',
+            )
+        )
+        for (name, tags), value in sorted(self._counters.items()):
+            lines.append(f'emag_crawler_events_total{_prometheus_labels(tags, event=name)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+"""本次运行的统计"""
+
+
+def current_tags() -> tuple[tuple[str, str], ...]:
+    """当前上下文的标签"""
+    return _tags.get()
+
+
+@contextmanager
+def metric_tags(**tags: str | int) -> Generator[None]:
+    """在上下文内给统计加上标签"""
+    merged = dict(_tags.get())
+    merged.update({k: str(v) for k, v in tags.items()})
+    token = _tags.set(tuple(sorted(merged.items())))
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def timed(name: str) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """记录异步函数每次调用的耗时"""
+
+    def decorator(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with metrics.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
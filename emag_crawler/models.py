@@ -5,11 +5,14 @@ from __future__ import annotations
 import re
 from typing import TYPE_CHECKING, Optional
 
-from pydantic import BaseModel, Field, computed_field
+from pydantic import BaseModel, Field, TypeAdapter, computed_field
 from scraper_utils.utils.emag_util import build_product_url
 
 if TYPE_CHECKING:
-    pass
+    from typing import Any, Iterable, Mapping
+
+
+_page_num_pattern = re.compile(r'/p(\d+)/c')
 
 
 class ProductCardItem(BaseModel):
@@ -29,12 +32,23 @@ class ProductCardItem(BaseModel):
 
     cart_added: bool = Field(False, description='是否已加购')
     max_qty: Optional[int] = Field(None, gt=0, description='最大可加购数')
+    max_qty_cached: bool = Field(False, description='最大可加购数是否复用了之前爬取的结果')
+    deduped: bool = Field(False, description='最大可加购数是否取自本次运行中其他位置的同一个产品')
+
+    @classmethod
+    def trusted_many(cls, records: Iterable[Mapping[str, Any]]) -> list[ProductCardItem]:
+        """
+        批量构造，整批交给 pydantic-core 校验，比逐个 model_validate 快
+
+        NOTICE pydantic v2 的 model_construct 在 Python 中逐个字段赋值，比整批校验更慢，不要用来“跳过校验”
+        """
+        return _product_card_items_adapter.validate_python(list(records))
 
     @computed_field
     @property
     def page_num(self) -> int:
         """页码"""
-        m = re.search(r'/p(\d+)/c', self.source_url)
+        m = _page_num_pattern.search(self.source_url)
         if m is None:
             return 1
         return int(m.group(1))
@@ -50,3 +64,34 @@ class ProductCardItem(BaseModel):
     def detail_url(self) -> str:
         """详情页链接"""
         return build_product_url(self.pnk)
+
+
+_product_card_items_adapter = TypeAdapter(list[ProductCardItem])
+
+
+class CrawlReport(BaseModel):
+    """一个类目的爬取报告"""
+
+    category: str = Field(..., description='产品类目')
+    first_page_url: str = Field(..., description='类目页第一页的链接')
+    product_count: int = Field(0, ge=0, description='类目内的产品总数')
+    crawled_pages: list[int] = Field(default_factory=list, description='爬取成功的页码')
+    failed_pages: list[int] = Field(default_factory=list, description='爬取失败的页码')
+    crawled_products: int = Field(0, ge=0, description='爬取到的产品数')
+    cart_added_products: int = Field(0, ge=0, description='加购成功的产品数')
+    cached_products: int = Field(0, ge=0, description='复用之前爬取的最大可加购数的产品数')
+    deduped_products: int = Field(0, ge=0, description='与本次运行中其他位置重复、不再加购的产品数')
+    probed_products: int = Field(0, ge=0, description='实际加购并解析到最大可加购数的产品数')
+    elapsed: float = Field(0.0, ge=0.0, description='耗时（秒）')
+    error: Optional[str] = Field(None, description='类目级别的错误')
+
+    def add_page(self, page_num: int, items: list[ProductCardItem]) -> None:
+        """记录一页的爬取结果"""
+        self.crawled_pages.append(page_num)
+        self.crawled_products += len(items)
+        self.cart_added_products += sum(1 for _ in items if _.cart_added)
+        self.cached_products += sum(1 for _ in items if _.max_qty_cached)
+        self.deduped_products += sum(1 for _ in items if _.deduped)
+        self.probed_products += sum(
+            1 for _ in items if _.max_qty is not None and not _.max_qty_cached and not _.deduped
+        )
@@ -0,0 +1,174 @@
+"""加购节奏控制"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    import re
+    from typing import Optional
+
+    from loguru import Logger
+    from playwright.async_api import Page, Request, Response
+
+
+class PacingConfig(BaseModel):
+    """加购节奏的配置"""
+
+    initial_interval: float = Field(0.5, gt=0.0, description='初始的点击间隔（秒）')
+    min_interval: float = Field(0.1, gt=0.0, description='最小的点击间隔（秒）')
+    max_interval: float = Field(5.0, gt=0.0, description='最大的点击间隔（秒）')
+    initial_inflight: int = Field(2, ge=1, description='初始的进行中加购请求数上限')
+    max_inflight: int = Field(6, ge=1, description='进行中加购请求数上限的最大值')
+    slow_latency: float = Field(2.0, gt=0.0, description='加购请求的响应时间超过该值（秒）视为变慢')
+    speedup_factor: float = Field(0.8, gt=0.0, lt=1.0, description='响应正常时点击间隔的缩小倍数')
+    backoff_factor: float = Field(2.0, gt=1.0, description='响应变慢或失败时点击间隔的放大倍数')
+    error_window: int = Field(20, ge=1, description='统计错误率的最近请求数')
+    max_error_rate: float = Field(0.1, ge=0.0, le=1.0, description='错误率超过该值时不再加速')
+    request_timeout: float = Field(30.0, gt=0.0, description='加购请求超过该值（秒）仍未完成就不再计入进行中')
+
+
+class AddToCartPacer:
+    """
+    根据加购请求（url 匹配的请求）的响应情况调整点击加购的节奏
+
+    限制进行中的加购请求数，响应正常时加速，响应变慢、失败或触发验证时退避
+    """
+
+    def __init__(
+        self,
+        page: Page,
+        url: re.Pattern[str],
+        logger: Logger,
+        config: Optional[PacingConfig] = None,
+    ) -> None:
+        self._page = page
+        self._url = url
+        self._logger = logger
+        self.config = config or PacingConfig()
+
+        self.interval = self.config.initial_interval
+        """当前的点击间隔（秒）"""
+        self.inflight_limit = min(self.config.initial_inflight, self.config.max_inflight)
+        """当前的进行中加购请求数上限"""
+
+        self._pending: dict[Request, float] = dict()
+        self._outcomes: deque[bool] = deque(maxlen=self.config.error_window)
+        self._last_click = 0.0
+        self._changed = asyncio.Event()
+
+        page.on('request', self._on_request)
+        page.on('response', self._on_response)
+        page.on('requestfailed', self._on_request_failed)
+
+    def close(self) -> None:
+        """停止监听页面的请求事件"""
+        self._page.remove_listener('request', self._on_request)
+        self._page.remove_listener('response', self._on_response)
+        self._page.remove_listener('requestfailed', self._on_request_failed)
+
+    @property
+    def inflight(self) -> int:
+        """进行中的加购请求数"""
+        return len(self._pending)
+
+    @property
+    def error_rate(self) -> float:
+        """最近的加购请求的错误率"""
+        if len(self._outcomes) == 0:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    async def acquire(self) -> None:
+        """等待到可以点击下一个加购按钮"""
+        while self.inflight >= self.inflight_limit:
+            self._drop_stale()
+            if self.inflight < self.inflight_limit:
+                break
+
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.config.slow_latency)
+            except TimeoutError:
+                pass
+
+        delay = self._last_click + self.interval - perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        self._last_click = perf_counter()
+
+    def _drop_stale(self) -> None:
+        """不再等待超时未完成的加购请求"""
+        now = perf_counter()
+        stale = [r for r, t in self._pending.items() if now - t > self.config.request_timeout]
+        for r in stale:
+            del self._pending[r]
+            self._backoff(f'加购请求超时 "{r.url}"', halve=True)
+
+    def _on_request(self, request: Request) -> None:
+        if self._url.search(request.url) is None:
+            return
+        self._pending[request] = perf_counter()
+
+    def _on_response(self, response: Response) -> None:
+        start_time = self._pending.pop(response.request, None)
+        if start_time is None:
+            return
+
+        latency = perf_counter() - start_time
+        if response.status == 511:
+            self._backoff(f'加购请求触发验证 status={response.status}', halve=True)
+        elif response.status >= 400:
+            self._backoff(f'加购请求失败 status={response.status}', halve=True)
+        elif latency > self.config.slow_latency:
+            self._backoff(f'加购请求变慢 latency={latency:.2f}s', halve=False)
+        else:
+            self._speedup(latency)
+        self._changed.set()
+
+    def _on_request_failed(self, request: Request) -> None:
+        if self._pending.pop(request, None) is None:
+            return
+
+        # 被 _newaddtocart_request_handler 拦截的重复加购请求，不算失败
+        if request.failure == 'net::ERR_ABORTED':
+            self._changed.set()
+            return
+
+        self._backoff(f'加购请求出错 {request.failure}', halve=True)
+        self._changed.set()
+
+    def _speedup(self, latency: float) -> None:
+        """响应正常，缩短点击间隔、放宽进行中的请求数上限"""
+        self._outcomes.append(True)
+        if self.error_rate > self.config.max_error_rate:
+            return
+
+        interval = max(self.config.min_interval, self.interval * self.config.speedup_factor)
+        inflight_limit = min(self.config.max_inflight, self.inflight_limit + 1)
+        if interval != self.interval or inflight_limit != self.inflight_limit:
+            self._logger.debug(
+                f'加购节奏加速 latency={latency:.2f}s '
+                f'间隔 {self.interval:.2f}s -> {interval:.2f}s 并发上限 {self.inflight_limit} -> {inflight_limit}'
+            )
+        self.interval = interval
+        self.inflight_limit = inflight_limit
+
+    def _backoff(self, reason: str, halve: bool) -> None:
+        """响应变慢或失败，延长点击间隔，收紧进行中的请求数上限"""
+        self._outcomes.append(not halve)
+
+        interval = min(self.config.max_interval, self.interval * self.config.backoff_factor)
+        inflight_limit = max(1, self.inflight_limit // 2 if halve else self.inflight_limit - 1)
+        self._logger.info(
+            f'加购节奏退避（{reason}，错误率 {self.error_rate:.0%}） '
+            f'间隔 {self.interval:.2f}s -> {interval:.2f}s 并发上限 {self.inflight_limit} -> {inflight_limit}'
+        )
+        self.interval = interval
+        self.inflight_limit = inflight_limit
@@ -0,0 +1,173 @@
+"""带退避的重试与按 host 熔断"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from random import random
+from time import perf_counter
+from typing import TYPE_CHECKING, Optional, TypeVar
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable
+
+    from loguru import Logger
+
+
+T = TypeVar('T')
+
+
+class RetryPolicy(BaseModel):
+    """重试策略：指数退避加随机抖动，限制尝试次数和总耗时"""
+
+    max_attempts: Optional[int] = Field(None, ge=1, description='最多尝试次数，None 为不限')
+    max_elapsed: Optional[float] = Field(None, gt=0.0, description='最多重试多长时间（秒），None 为不限')
+    base_delay: float = Field(0.2, ge=0.0, description='第 1 次重试前的等待时间（秒）')
+    max_delay: float = Field(10.0, ge=0.0, description='每次重试前最多等待多长时间（秒）')
+    multiplier: float = Field(2.0, ge=1.0, description='每次重试等待时间的放大倍数')
+    jitter: float = Field(0.5, ge=0.0, le=1.0, description='等待时间随机减少的最大比例，避免多个任务同时重试')
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次失败后、下一次尝试前的等待时间"""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random())
+
+
+class RetryError(Exception):
+    """重试次数或时间用完了仍然失败"""
+
+    def __init__(self, name: str, attempts: int, elapsed: float, last_error: BaseException) -> None:
+        super().__init__(f'{name} 尝试 {attempts} 次、{elapsed:.1f}s 后仍然失败\n{last_error}')
+        self.name = name
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.last_error = last_error
+
+
+class CircuitBreaker:
+    """
+    一个 host 的熔断器
+
+    统计最近 window 次请求的结果，错误率超过 max_error_rate 时打开，
+    打开期间所有使用该 host 的任务在 wait() 处暂停 cooldown 秒，之后关闭并重新统计；
+    熔断器按 host 在所有任务间共享，所以日志记录到调用方传入的 logger
+    """
+
+    def __init__(
+        self,
+        host: str,
+        window: int = 20,
+        min_calls: int = 5,
+        max_error_rate: float = 0.5,
+        cooldown: float = 30.0,
+    ) -> None:
+        self.host = host
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._open_until = 0.0
+
+    @property
+    def open(self) -> bool:
+        """是否在熔断中"""
+        return perf_counter() < self._open_until
+
+    def record(self, ok: bool, logger: Optional[Logger] = None) -> None:
+        """记录一次请求的结果，错误率过高时打开"""
+        self._outcomes.append(ok)
+        if ok or self.open or len(self._outcomes) < self.min_calls:
+            return
+
+        error_rate = self._outcomes.count(False) / len(self._outcomes)
+        if error_rate <= self.max_error_rate:
+            return
+
+        metrics.inc('circuit_open')
+        if logger is not None:
+            logger.warning(
+                f'"{self.host}" 最近 {len(self._outcomes)} 次请求的错误率为 {error_rate:.0%}，'
+                f'暂停所有请求 {self.cooldown:.0f}s'
+            )
+        self._open_until = perf_counter() + self.cooldown
+        self._outcomes.clear()
+
+    async def wait(self, logger: Optional[Logger] = None) -> None:
+        """在熔断中时等待到关闭，未熔断时立即返回"""
+        if not self.open:
+            return
+        if logger is not None:
+            logger.info(f'"{self.host}" 熔断中，等待 {self._open_until - perf_counter():.0f}s')
+        with metrics.span('circuit_pause'):
+            while (remaining := self._open_until - perf_counter()) > 0:
+                await asyncio.sleep(remaining)
+
+
+_breakers: dict[str, CircuitBreaker] = dict()
+"""{ host: 该 host 的熔断器 }"""
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """url 所属 host 的熔断器，不存在时创建"""
+    host = urlsplit(url).netloc
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = CircuitBreaker(host)
+    return breaker
+
+
+async def retry(
+    operation: Callable[[], Awaitable[T]],
+    name: str,
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    retry_on: tuple[type[BaseException], ...] = (PlaywrightError,),
+    logger: Optional[Logger] = None,
+) -> T:
+    """
+    执行 operation，抛出 retry_on 中的异常时按 policy 等待后重试
+
+    每次重试计数 `<name>_retry`，放弃时计数 `<name>_gave_up` 并抛出 RetryError；
+    传入 breaker 时每次尝试前等待熔断结束，并把结果记录到 breaker，熔断的日志记录到 logger
+    """
+    start_time = perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            await breaker.wait(logger)
+
+        try:
+            result = await operation()
+        except retry_on as e:
+            if breaker is not None:
+                breaker.record(False, logger)
+            elapsed = perf_counter() - start_time
+            delay = policy.delay(attempt)
+            if (policy.max_attempts is not None and attempt >= policy.max_attempts) or (
+                policy.max_elapsed is not None and elapsed + delay > policy.max_elapsed
+            ):
+                metrics.inc(f'{name}_gave_up')
+                raise RetryError(name, attempt, elapsed, e) from e
+
+            metrics.inc(f'{name}_retry')
+            with metrics.span(f'{name}_backoff'):
+                await asyncio.sleep(delay)
+            continue
+
+        if breaker is not None:
+            breaker.record(True, logger)
+        return result
+
+
+goto_policy = RetryPolicy(base_delay=1.0, max_delay=30.0, max_elapsed=10 * 60.0)
+"""打开页面的重试策略，10 分钟内仍然打不开就放弃"""
+
+click_policy = RetryPolicy(max_attempts=8, base_delay=0.2, max_delay=2.0, max_elapsed=15.0)
+"""点击按钮的重试策略，一直点不到时放弃，不让一个卡片卡住整页"""
@@ -0,0 +1,477 @@
+"""context 级别的请求拦截：静态资源缓存、第三方 host 过滤、按页面统计流量"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+import json
+from pathlib import Path
+import sqlite3
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel, Field
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from loguru import Logger
+    from playwright.async_api import BrowserContext, Page, Request, Route
+
+
+class RouteConfig(BaseModel):
+    """请求拦截的配置"""
+
+    cached_resource_types: frozenset[str] = Field(
+        frozenset(('script',)), description='缓存到磁盘的资源类型（Request.resource_type）'
+    )
+    max_cache_bytes: int = Field(
+        512 * 1024 * 1024, ge=0, description='磁盘缓存的最大字节数，超过时淘汰最久未用的'
+    )
+    max_cache_age: float = Field(
+        7 * 24 * 3600.0, gt=0.0, description='缓存的最长有效期（秒），响应头给出的有效期更短时以响应头为准'
+    )
+    allowed_hosts: tuple[str, ...] = Field(
+        (), description='只放行这些 host 及其子域名的请求，为空时不限制；优先级低于 denied_hosts'
+    )
+    denied_hosts: tuple[str, ...] = Field(
+        (
+            'google-analytics.com',
+            'googletagmanager.com',
+            'doubleclick.net',
+            'facebook.net',
+            'facebook.com',
+            'hotjar.com',
+            'criteo.com',
+            'criteo.net',
+            'tiktok.com',
+            'clarity.ms',
+        ),
+        description='拦截这些 host 及其子域名的请求（统计、广告等第三方）',
+    )
+
+
+def _host_matches(host: str, domains: tuple[str, ...]) -> bool:
+    """host 是否为 domains 中的域名或其子域名"""
+    return any(host == d or host.endswith('.' + d) for d in domains)
+
+
+_stored_headers = frozenset(
+    ('content-type', 'cache-control', 'access-control-allow-origin', 'timing-allow-origin')
+)
+"""缓存时保留的响应头，content-encoding、content-length 等由 fulfill 重新生成"""
+
+_schema = """
+CREATE TABLE IF NOT EXISTS assets (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    expires_at REAL NOT NULL DEFAULT 0,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS assets_by_digest ON assets (digest);
+CREATE INDEX IF NOT EXISTS assets_by_last_used ON assets (last_used);
+"""
+
+_added_columns = (('expires_at', 'REAL NOT NULL DEFAULT 0'), ('etag', 'TEXT'), ('last_modified', 'TEXT'))
+"""后来添加的列，打开旧的缓存时补上；旧的缓存 expires_at 为 0，没有 ETag、Last-Modified，视为未命中"""
+
+
+def _cache_control(headers: dict[str, str]) -> dict[str, Optional[str]]:
+    """解析 Cache-Control 响应头 { 指令: 值 }"""
+    directives: dict[str, Optional[str]] = dict()
+    for part in headers.get('cache-control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name != '':
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    """解析 HTTP 日期为时间戳，无效时返回 None"""
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _freshness_lifetime(headers: dict[str, str], max_age: float) -> Optional[float]:
+    """
+    按响应头计算缓存的有效期（秒），不超过 max_age；不能缓存时返回 None
+
+    - Cache-Control: no-store 不缓存，no-cache 每次使用前都要重新验证（有效期为 0）
+    - Cache-Control: max-age 优先于 Expires，都减去 Age
+    - 都没有时按 Last-Modified 启发式地取其距 Date 的 10%
+    - 有效期为 0 又没有 ETag、Last-Modified 时无法重新验证，不缓存
+    """
+    directives = _cache_control(headers)
+    if 'no-store' in directives:
+        return None
+
+    date = _http_date(headers.get('date')) or time()
+    max_age_directive = directives.get('max-age')
+    if 'no-cache' in directives:
+        lifetime = 0.0
+    elif max_age_directive is not None and max_age_directive.isdigit():
+        lifetime = float(max_age_directive)
+    elif 'expires' in headers:
+        # 无效的 Expires（如 0）视为已过期
+        expires = _http_date(headers['expires'])
+        lifetime = 0.0 if expires is None else expires - date
+    elif (last_modified := _http_date(headers.get('last-modified'))) is not None:
+        lifetime = (date - last_modified) / 10
+    else:
+        lifetime = 0.0
+
+    age = headers.get('age', '')
+    if age.isdigit():
+        lifetime -= float(age)
+    lifetime = min(max(lifetime, 0.0), max_age)
+
+    if lifetime == 0.0 and 'etag' not in headers and 'last-modified' not in headers:
+        return None
+    return lifetime
+
+
+@dataclass(slots=True)
+class CachedAsset:
+    """缓存的静态资源"""
+
+    body: bytes
+    headers: dict[str, str]
+    fresh: bool = True
+    """是否还在有效期内，过期的缓存需要用 validators 重新验证后才能使用"""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def validators(self) -> dict[str, str]:
+        """重新验证时带上的请求头"""
+        validators: dict[str, str] = dict()
+        if self.etag is not None:
+            validators['if-none-match'] = self.etag
+        if self.last_modified is not None:
+            validators['if-modified-since'] = self.last_modified
+        return validators
+
+
+class AssetCache:
+    """
+    按内容寻址的静态资源磁盘缓存
+
+    响应体按 sha256 保存在 `<cache_dir>/objects/` 下，内容相同的资源只保存一份；
+    url 到内容的索引保存在 SQLite 中，总大小超过 max_bytes 时按最近使用时间淘汰；
+    有效期按响应头（Cache-Control、Expires、Last-Modified）计算，最长 max_age 秒，过期后用 ETag、Last-Modified 重新验证；
+    读写 SQLite 和文件都在线程池中进行，不阻塞事件循环，多个 context 共用时用锁串行访问 SQLite
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age: float) -> None:
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._objects_dir = cache_dir / 'objects'
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(cache_dir / 'index.sqlite3', check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_schema)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        existing = {r[1] for r in self._conn.execute('PRAGMA table_info(assets)')}
+        with self._conn:
+            for name, type_ in _added_columns:
+                if name not in existing:
+                    self._conn.execute(f'ALTER TABLE assets ADD COLUMN {name} {type_}')
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _object_path(self, digest: str) -> Path:
+        return self._objects_dir / digest[:2] / digest
+
+    async def get(self, url: str) -> Optional[CachedAsset]:
+        """
+        读取 url 对应的缓存，没有缓存、缓存文件已丢失、或已过期又无法重新验证时返回 None
+
+        已过期但可以重新验证的缓存 fresh 为 False
+        """
+        return await asyncio.to_thread(self._get, url)
+
+    def _get(self, url: str) -> Optional[CachedAsset]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest, headers, expires_at, etag, last_modified FROM assets WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        digest, headers, expires_at, etag, last_modified = row
+        fresh = expires_at > time()
+        if not fresh and etag is None and last_modified is None:
+            return None
+
+        try:
+            body = self._object_path(digest).read_bytes()
+        except OSError:
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM assets WHERE url = ?', (url,))
+            return None
+
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE assets SET last_used = ? WHERE url = ?', (time(), url))
+        return CachedAsset(body, json.loads(headers), fresh, etag, last_modified)
+
+    async def put(self, url: str, body: bytes, headers: dict[str, str]) -> bool:
+        """缓存 url 的响应体，只保留 _stored_headers 中的响应头；响应头不允许缓存时返回 False"""
+        lifetime = _freshness_lifetime(headers, self.max_age)
+        if lifetime is None:
+            return False
+        await asyncio.to_thread(self._put, url, body, headers, lifetime)
+        return True
+
+    def _put(self, url: str, body: bytes, headers: dict[str, str], lifetime: float) -> None:
+        digest = sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not path.exists():
+            self._write_object(path, body)
+
+        stored = {k: v for k, v in headers.items() if k.lower() in _stored_headers}
+        now = time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO assets '
+                    '(url, digest, size, headers, stored_at, last_used, expires_at, etag, last_modified) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        url,
+                        digest,
+                        len(body),
+                        json.dumps(stored),
+                        now,
+                        now,
+                        now + lifetime,
+                        headers.get('etag'),
+                        headers.get('last-modified'),
+                    ),
+                )
+            self._evict()
+
+    async def refresh(self, url: str, cached: CachedAsset, headers: dict[str, str]) -> None:
+        """重新验证得到 304 后，按新的响应头更新缓存的有效期；新的响应头不允许缓存时删除缓存"""
+        merged = {**cached.headers, **headers}
+        if cached.etag is not None:
+            merged.setdefault('etag', cached.etag)
+        if cached.last_modified is not None:
+            merged.setdefault('last-modified', cached.last_modified)
+        lifetime = _freshness_lifetime(merged, self.max_age)
+        await asyncio.to_thread(self._refresh, url, lifetime)
+
+    def _refresh(self, url: str, lifetime: Optional[float]) -> None:
+        with self._lock, self._conn:
+            if lifetime is None:
+                self._conn.execute('DELETE FROM assets WHERE url = ?', (url,))
+            else:
+                self._conn.execute('UPDATE assets SET expires_at = ? WHERE url = ?', (time() + lifetime, url))
+
+    @staticmethod
+    def _write_object(path: Path, body: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + '.part')
+        part_path.write_bytes(body)
+        part_path.replace(path)
+
+    def total_bytes(self) -> int:
+        """缓存文件的总大小，内容相同的资源只算一次"""
+        row = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM assets GROUP BY digest)'
+        ).fetchone()
+        return row[0]
+
+    def _evict(self) -> None:
+        """按最近使用时间淘汰，直到总大小不超过 max_bytes，需要持有 _lock"""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute('SELECT url, digest, size FROM assets ORDER BY last_used').fetchall()
+        with self._conn:
+            for url, digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute('DELETE FROM assets WHERE url = ?', (url,))
+                # 没有其他 url 使用该内容时才删除文件
+                if self._conn.execute('SELECT 1 FROM assets WHERE digest = ?', (digest,)).fetchone() is None:
+                    self._object_path(digest).unlink(missing_ok=True)
+                    total -= size
+                metrics.inc('asset_cache_evicted')
+
+
+_asset_caches: dict[Path, AssetCache] = dict()
+"""{ 缓存目录: 该目录的缓存 }"""
+
+
+def get_asset_cache(cache_dir: Path, config: RouteConfig) -> AssetCache:
+    """cache_dir 的缓存，不存在时打开，多个 context 共用同一个"""
+    cache = _asset_caches.get(cache_dir)
+    if cache is None:
+        cache = _asset_caches[cache_dir] = AssetCache(cache_dir, config.max_cache_bytes, config.max_cache_age)
+    return cache
+
+
+@dataclass(slots=True)
+class PageTraffic:
+    """一个页面的请求数和流量"""
+
+    requests: int = 0
+    """从网络下载的请求数"""
+    transferred_bytes: int = 0
+    """从网络下载的字节数（响应头和响应体）"""
+    cached_requests: int = 0
+    """从磁盘缓存返回的请求数"""
+    cached_bytes: int = 0
+    """从磁盘缓存返回的字节数"""
+    blocked_requests: int = 0
+    """被 host 过滤拦截的请求数"""
+
+
+class RouteLayer:
+    """
+    一个 context 的请求拦截
+
+    - 拦截 denied_hosts、不在 allowed_hosts 中的 host 的请求
+    - cached_resource_types 类型的 GET 请求先查磁盘缓存，命中且未过期时直接返回，
+      已过期时带上 ETag、Last-Modified 重新验证，得到 304 时返回缓存，否则下载后写入缓存
+    - 其他请求交给之前注册的路由（如 abort_resources）处理
+    - 按页面统计请求数、流量，页面关闭时输出并计入 metrics
+    """
+
+    def __init__(self, cache: Optional[AssetCache], config: RouteConfig, logger: Logger) -> None:
+        self._cache = cache
+        self.config = config
+        self._logger = logger
+        self.traffic: WeakKeyDictionary[Page, PageTraffic] = WeakKeyDictionary()
+        """{ 页面: 该页面的请求数和流量 }"""
+        self._from_cache: WeakKeyDictionary[Request, int] = WeakKeyDictionary()
+        """{ 从缓存返回的请求: 字节数 }"""
+
+    async def install(self, context: BrowserContext) -> None:
+        """注册到 context，需要在 abort_resources 等其他路由之后调用，才能先于它们处理请求"""
+        for page in context.pages:
+            self._watch(page)
+        context.on('page', self._watch)
+        await context.route('**/*', self._handle)
+
+    def _watch(self, page: Page) -> None:
+        self.traffic[page] = PageTraffic()
+        page.on('requestfinished', lambda r: self._on_request_finished(page, r))
+        page.once('close', self._on_close)
+
+    def _traffic_of(self, request: Request) -> Optional[PageTraffic]:
+        try:
+            return self.traffic.get(request.frame.page)
+        except PlaywrightError:
+            # service worker 发出的请求没有 frame
+            return None
+
+    def _allowed(self, host: str) -> bool:
+        if _host_matches(host, self.config.denied_hosts):
+            return False
+        return len(self.config.allowed_hosts) == 0 or _host_matches(host, self.config.allowed_hosts)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+
+        host = urlsplit(request.url).hostname or ''
+        if not self._allowed(host):
+            metrics.inc('route_blocked')
+            if (traffic := self._traffic_of(request)) is not None:
+                traffic.blocked_requests += 1
+            await route.abort('blockedbyclient')
+            return
+
+        if (
+            self._cache is None
+            or request.method != 'GET'
+            or request.resource_type not in self.config.cached_resource_types
+        ):
+            await route.fallback()
+            return
+
+        cached = await self._cache.get(request.url)
+        if cached is not None and cached.fresh:
+            metrics.inc('asset_cache_hit')
+            await self._fulfill_cached(route, cached)
+            return
+
+        try:
+            if cached is not None:
+                response = await route.fetch(headers={**request.headers, **cached.validators})
+                if response.status == 304:
+                    metrics.inc('asset_cache_revalidated')
+                    await self._cache.refresh(request.url, cached, response.headers)
+                    await self._fulfill_cached(route, cached)
+                    return
+            else:
+                response = await route.fetch()
+            body = await response.body()
+        except PlaywrightError:
+            await route.fallback()
+            return
+
+        metrics.inc('asset_cache_miss')
+        if response.ok:
+            await self._cache.put(request.url, body, response.headers)
+        await route.fulfill(response=response, body=body)
+
+    async def _fulfill_cached(self, route: Route, cached: CachedAsset) -> None:
+        self._from_cache[route.request] = len(cached.body)
+        await route.fulfill(status=200, headers=cached.headers, body=cached.body)
+
+    async def _on_request_finished(self, page: Page, request: Request) -> None:
+        traffic = self.traffic.get(page)
+        if traffic is None:
+            return
+
+        cached_bytes = self._from_cache.pop(request, None)
+        if cached_bytes is not None:
+            traffic.cached_requests += 1
+            traffic.cached_bytes += cached_bytes
+            return
+
+        try:
+            sizes = await request.sizes()
+        except PlaywrightError:
+            return
+        traffic.requests += 1
+        traffic.transferred_bytes += sizes['responseHeadersSize'] + sizes['responseBodySize']
+
+    def _on_close(self, page: Page) -> None:
+        traffic = self.traffic.pop(page, None)
+        if traffic is None:
+            return
+        metrics.inc('page_requests', traffic.requests)
+        metrics.inc('page_bytes', traffic.transferred_bytes)
+        metrics.inc('page_cached_requests', traffic.cached_requests)
+        metrics.inc('page_cached_bytes', traffic.cached_bytes)
+        metrics.inc('page_blocked_requests', traffic.blocked_requests)
+        self._logger.debug(
+            f'页面 "{page.url}" 下载了 {traffic.requests} 个请求 {traffic.transferred_bytes / 1024:.0f}KB，'
+            f'缓存返回 {traffic.cached_requests} 个请求 {traffic.cached_bytes / 1024:.0f}KB，'
+            f'拦截 {traffic.blocked_requests} 个请求'
+        )
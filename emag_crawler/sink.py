@@ -0,0 +1,117 @@
+"""逐行写入爬取结果的 jsonl"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from queue import SimpleQueue
+from threading import Thread
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Any, Callable, Iterable, Optional
+
+    from .models import ProductCardItem
+
+
+class JsonlSink:
+    """
+    把一页的爬取结果逐行追加到 jsonl
+
+    每行是一条记录：
+    - 产品卡片：ProductCardItem 的完整数据，解析到卡片后立即写入
+    - 补丁：{"patch": {"rank_in_page": ..., "cart_added": ..., "max_qty": ..., "deduped": ...}}，解析到最大可加购数后写入，
+      读取时按 rank_in_page 覆盖到对应的产品卡片
+
+    写入在后台线程进行，不阻塞事件循环；先写入 `<path>.part`，close(commit=True) 时才重命名为 path，
+    所以爬取失败的页面不会留下不完整的 jsonl
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._part_path = path.with_name(path.name + '.part')
+        self._queue: SimpleQueue[Optional[bytes]] = SimpleQueue()
+        self._patched: dict[int, tuple[bool, Optional[int], bool]] = dict()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = Thread(target=self._run, name=f'JsonlSink-{path.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            with self._part_path.open('wb') as f:
+                while (line := self._queue.get()) is not None:
+                    f.write(line)
+                    if self._queue.empty():
+                        f.flush()
+        except BaseException as be:
+            self._error = be
+            # 继续取出剩余的记录，避免 close() 时等待
+            while self._queue.get() is not None:
+                pass
+
+    def _put(self, record: str) -> None:
+        if self._closed:
+            raise RuntimeError(f'JsonlSink "{self.path}" 已关闭')
+        self._queue.put(record.encode() + b'\n')
+
+    def write_items(self, items: Iterable[ProductCardItem]) -> None:
+        """写入产品卡片"""
+        for item in items:
+            self._put(item.model_dump_json())
+            self._patched[item.rank_in_page] = (item.cart_added, item.max_qty, item.deduped)
+
+    def write_patches(self, items: Iterable[ProductCardItem]) -> None:
+        """写入产品的加购结果，与已写入的相同时跳过"""
+        for item in items:
+            state = (item.cart_added, item.max_qty, item.deduped)
+            if self._patched.get(item.rank_in_page) == state:
+                continue
+            self._patched[item.rank_in_page] = state
+            patch = {
+                'rank_in_page': item.rank_in_page,
+                'cart_added': item.cart_added,
+                'max_qty': item.max_qty,
+                'deduped': item.deduped,
+            }
+            self._put(json.dumps({'patch': patch}, separators=(',', ':')))
+
+    async def close(self, commit: bool = True) -> Path:
+        """
+        等待所有记录写入完成
+
+        commit 为 True 时重命名为 path 并返回 path，否则保留 `<path>.part` 并返回它
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+        if self._error is not None:
+            raise self._error
+        if not commit:
+            return self._part_path
+        await asyncio.to_thread(self._part_path.replace, self.path)
+        return self.path
+
+
+def read_jsonl_items(
+    path: Path,
+    loads: Callable[[bytes], Any] = json.loads,
+) -> list[dict[str, Any]]:
+    """读取 JsonlSink 写入的 jsonl，合并补丁后按写入顺序返回产品数据，loads 可以换成更快的实现"""
+    items: dict[int, dict[str, Any]] = dict()
+    with path.open('rb') as f:
+        for line in f:
+            if line.isspace():
+                continue
+            record: dict[str, Any] = loads(line)
+            patch = record.get('patch')
+            if patch is None:
+                items[record['rank_in_page']] = record
+            elif patch['rank_in_page'] in items:
+                items[patch['rank_in_page']].update(patch)
+    return list(items.values())
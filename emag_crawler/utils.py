@@ -1,38 +1,148 @@
 from __future__ import annotations
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import re
 from time import perf_counter
 from typing import TYPE_CHECKING
 
-from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.constants.time_constant import MS1000
+
+from .metrics import timed
 
 
 if TYPE_CHECKING:
-    from playwright.async_api import Page
+    from concurrent.futures import Future
+    from typing import Any, Callable, Optional, Self
 
+    from playwright.async_api import Page, Request
 
-async def wait_for_networkidle(page: Page, timeout: int) -> None:
-    """等待页面一段时间内都没有网络请求"""
-    start_time = perf_counter()
-    while True:
-        if perf_counter() - start_time > timeout / 1000:
-            break
 
-        try:
-            async with page.expect_request('**', timeout=timeout):
-                pass
-        except PlaywrightError:
-            break
-        else:
-            start_time = perf_counter()
+class RequestTracker:
+    """
+    通过页面的 request、requestfinished、requestfailed 事件统计进行中的请求数
+
+    只统计创建之后发出的请求，url 不为 None 时只统计 url 匹配的请求
+    """
+
+    def __init__(self, page: Page, url: Optional[str | re.Pattern[str]] = None) -> None:
+        self._page = page
+        self._url = re.compile(url) if isinstance(url, str) else url
+        self._inflight: set[Request] = set()
+        self._last_change = perf_counter()
+        self._changed = asyncio.Event()
+
+        page.on('request', self._on_request)
+        page.on('requestfinished', self._on_request_done)
+        page.on('requestfailed', self._on_request_done)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
 
+    def close(self) -> None:
+        """停止监听页面的请求事件"""
+        self._page.remove_listener('request', self._on_request)
+        self._page.remove_listener('requestfinished', self._on_request_done)
+        self._page.remove_listener('requestfailed', self._on_request_done)
+
+    @property
+    def inflight(self) -> int:
+        """进行中的请求数"""
+        return len(self._inflight)
+
+    def _on_request(self, request: Request) -> None:
+        if self._url is not None and self._url.search(request.url) is None:
+            return
+        self._inflight.add(request)
+        self._mark_changed()
+
+    def _on_request_done(self, request: Request) -> None:
+        if request not in self._inflight:
+            return
+        self._inflight.discard(request)
+        self._mark_changed()
+
+    def _mark_changed(self) -> None:
+        self._last_change = perf_counter()
+        self._changed.set()
+
+    async def _wait_changed(self, timeout: float) -> None:
+        """等待请求数变化，最多等待 timeout 秒"""
+        self._changed.clear()
         try:
-            async with page.expect_request_finished(lambda r: True, timeout=timeout):
-                pass
-        except PlaywrightError:
-            break
-        else:
-            start_time = perf_counter()
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except TimeoutError:
+            pass
+
+    async def wait_for_capacity(self, limit: int, timeout: int = 10 * MS1000) -> bool:
+        """等待进行中的请求数低于 limit，超过 timeout 毫秒仍未低于就返回 False"""
+        deadline = perf_counter() + timeout / 1000
+        while self.inflight >= limit:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                return False
+            await self._wait_changed(remaining)
+        return True
+
+    @timed('wait_for_networkidle')
+    async def wait_for_idle(self, idle_time: int = 500, timeout: int = 10 * MS1000) -> bool:
+        """
+        等待进行中的请求数归零并保持 idle_time 毫秒
+
+        超过 timeout 毫秒仍未空闲就返回 False
+        """
+        deadline = perf_counter() + timeout / 1000
+        while True:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                return False
+
+            if self.inflight > 0:
+                await self._wait_changed(remaining)
+                continue
+
+            quiet_time = perf_counter() - self._last_change
+            if quiet_time >= idle_time / 1000:
+                return True
+            await self._wait_changed(min(remaining, idle_time / 1000 - quiet_time))
+
+
+class BackgroundWriter:
+    """
+    在一个后台线程中按提交顺序执行写入，不阻塞事件循环
+
+    submit 立即返回；写入出错时保存第一个错误，在之后的 submit、flush、close 中抛出
+    """
+
+    def __init__(self, name: str) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._error: Optional[BaseException] = None
+
+    def _on_done(self, future: Future[None]) -> None:
+        if self._error is None and (error := future.exception()) is not None:
+            self._error = error
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn: Callable[..., None], *args: Any) -> None:
+        """提交一次写入"""
+        self._raise_error()
+        self._executor.submit(fn, *args).add_done_callback(self._on_done)
+
+    def flush(self) -> None:
+        """等待之前提交的写入全部完成"""
+        self._executor.submit(lambda: None).result()
+        self._raise_error()
+
+    def close(self) -> None:
+        """等待之前提交的写入全部完成，然后停止后台线程"""
+        self._executor.shutdown(wait=True)
+        self._raise_error()
 
 
 def build_category_page_url(first_page_url: str, page: int) -> str:
@@ -0,0 +1,117 @@
+"""流式导出产品数据到 xlsx"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from scraper_utils.constants.workbook_style import (
+    HYPERLINK_FONT,
+    TEXT_CENTER_ALIGNMENT,
+    RED_BOLD_FONT,
+    YELLOW_FILL,
+)
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable, Mapping
+
+    from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+
+
+_COLUMNS: tuple[tuple[str, str], ...] = (
+    ('pnk', 'pnk'),
+    ('详情页链接', 'detail_url'),
+    ('标题', 'title'),
+    ('类目', 'category'),
+    ('来源链接', 'source_url'),
+    ('排名', 'rank'),
+    ('产品图', 'image_url'),
+    ('价格', 'price'),
+    ('Top 标志', 'top_favorite'),
+    ('评分', 'rating'),
+    ('评论数', 'review'),
+    ('最大可加购数', 'max_qty'),
+)
+"""(标题, 字段)，与 save_to_xlsx 的列一致"""
+
+
+class _LinkCell:
+    """
+    一列超链接共用的单元格
+
+    只在创建时设置一次样式，之后每行只替换值和超链接：追加行时单元格会被立即写出，所以可以复用；
+    值为链接本身、超链接与 save_to_xlsx 一致，读取导出结果时不依赖公式计算；
+    NOTICE 每个超链接的 Hyperlink 对象在保存前会一直留在工作表中，内存占用随行数增长，但比单元格小得多
+    """
+
+    def __init__(self, ws: WriteOnlyWorksheet) -> None:
+        self._cell = WriteOnlyCell(ws)
+        self._cell.font = HYPERLINK_FONT
+
+    def __call__(self, url: Any) -> Any:
+        if url is None:
+            return '/'
+        self._cell.value = url
+        self._cell.hyperlink = url
+        return self._cell
+
+
+def _or_slash(value: Any) -> Any:
+    return '/' if value is None else value
+
+
+def _yes_no(value: Any) -> str:
+    return '是' if value else '否'
+
+
+def _write_header(ws: WriteOnlyWorksheet) -> None:
+    """设置列宽并写入标题行，需要在追加数据行之前调用"""
+    for c in range(1, len(_COLUMNS) + 1):
+        ws.column_dimensions[get_column_letter(c)].width = int(120 / 7)
+
+    header: list[WriteOnlyCell] = list()
+    for title, _ in _COLUMNS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.fill = YELLOW_FILL
+        cell.font = RED_BOLD_FONT
+        cell.alignment = TEXT_CENTER_ALIGNMENT
+        header.append(cell)
+    ws.append(header)
+
+
+def write_products_xlsx(rows: Iterable[Mapping[str, Any]], save_path: str | Path) -> int:
+    """
+    把产品数据逐行写入 xlsx，返回写入的行数
+
+    rows 的字段与 read_product_json 的返回值一致，可以是生成器；
+    使用 openpyxl 的 write-only 模式，行写出后不再保留，内存占用与行数无关
+    """
+    save_path = Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+
+    wb = Workbook(write_only=True)
+    ws: WriteOnlyWorksheet = wb.create_sheet()
+    _write_header(ws)
+
+    # 每列的转换函数，超链接列各自复用一个带样式的单元格
+    converters: list[tuple[str, Callable[[Any], Any]]] = list()
+    for _, key in _COLUMNS:
+        if key in ('detail_url', 'source_url', 'image_url'):
+            converters.append((key, _LinkCell(ws)))
+        elif key in ('rating', 'review'):
+            converters.append((key, _or_slash))
+        elif key == 'top_favorite':
+            converters.append((key, _yes_no))
+        else:
+            converters.append((key, lambda v: v))
+
+    count = 0
+    for row in rows:
+        ws.append([convert(row[key]) for key, convert in converters])
+        count += 1
+
+    wb.save(save_path)
+    return count
@@ -0,0 +1,51 @@
+"""读取 output/ 下归档的爬取结果"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from emag_crawler.archive import load_page_file, page_files
+from emag_crawler.models import ProductCardItem
+
+
+def _record(rank: int, **fields: object) -> dict[str, object]:
+    item = ProductCardItem(
+        title=f'Produs de test {rank}',
+        pnk=f'D{rank:08d}',
+        product_id=str(100000 + rank),
+        category='test',
+        source_url='https://www.emag.ro/test/c',
+        rank_in_page=rank,
+        review=0,
+    )
+    return {**item.model_dump(mode='json'), **fields}
+
+
+class PageFilesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = TemporaryDirectory()
+        self.dir = Path(self._dir.name)
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def test_prefers_jsonl(self) -> None:
+        # 同一页同时有 json 和 jsonl 时只读取 jsonl
+        (self.dir / '1.json').write_text(json.dumps([_record(1)]))
+        (self.dir / '1.jsonl').write_text(json.dumps(_record(1, cart_added=True, max_qty=3)) + '\n')
+        (self.dir / '2.json').write_text(json.dumps([_record(2, cart_added=True)]))
+        # 没有提交的 jsonl 不读取
+        (self.dir / '3.jsonl.part').write_text(json.dumps(_record(3, cart_added=True)) + '\n')
+
+        files = page_files(self.dir)
+        self.assertEqual(sorted(_.name for _ in files), ['1.jsonl', '2.json'])
+
+        rows = [row for f in files for row in load_page_file(f)]
+        self.assertEqual(sorted((_['rank'], _['max_qty']) for _ in rows), [(1, 3), (2, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
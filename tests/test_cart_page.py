@@ -0,0 +1,55 @@
+"""从加购响应中解析最大可加购数"""
+
+from __future__ import annotations
+
+import unittest
+
+from emag_crawler.handlers.cart_page import parse_newaddtocart_max_qty
+
+_cart_line_html = """
+<div class="cart-widget" data-id="1_100061">
+    <input type="number" class="qty" value="1" min="1" max="4">
+</div>
+<div class="cart-widget" data-id="1_100062">
+    <input type="number" class="qty" value="1" min="1" max="9">
+</div>
+"""
+
+
+class ParseNewaddtocartMaxQtyTest(unittest.TestCase):
+    def test_json(self) -> None:
+        payload = {
+            'status': 'success',
+            'data': {
+                'lines': [
+                    {'offer_id': 100062, 'quantity': 1, 'max_quantity': 9},
+                    {'offer_id': 100061, 'quantity': 1, 'max_quantity': 4},
+                ]
+            },
+        }
+        self.assertEqual(parse_newaddtocart_max_qty(payload, '100061'), 4)
+        self.assertEqual(parse_newaddtocart_max_qty(payload, '100062'), 9)
+
+    def test_html_fragment(self) -> None:
+        self.assertEqual(parse_newaddtocart_max_qty(_cart_line_html, '100061'), 4)
+        self.assertEqual(parse_newaddtocart_max_qty(_cart_line_html, '100062'), 9)
+        # 嵌在 JSON 中的 HTML 片段
+        self.assertEqual(parse_newaddtocart_max_qty({'data': {'html': _cart_line_html}}, '100062'), 9)
+
+    def test_missing(self) -> None:
+        self.assertIsNone(parse_newaddtocart_max_qty({'status': 'success'}, '100061'))
+        self.assertIsNone(parse_newaddtocart_max_qty(_cart_line_html, '100063'))
+        self.assertIsNone(parse_newaddtocart_max_qty('', '100061'))
+        # data-offer-id 只是另一个 data-id 的后缀
+        self.assertIsNone(parse_newaddtocart_max_qty(_cart_line_html, '00061'))
+
+    def test_generic_keys_ignored(self) -> None:
+        # id、max 可能属于其他对象，不当作 data-offer-id 和最大可加购数
+        self.assertIsNone(parse_newaddtocart_max_qty({'data': {'id': 100061, 'max': 4}}, '100061'))
+        # data-offer-id 和最大可加购数不在同一个对象中
+        payload = {'offer_id': 100061, 'data': {'max_quantity': 4}}
+        self.assertIsNone(parse_newaddtocart_max_qty(payload, '100061'))
+
+
+if __name__ == '__main__':
+    unittest.main()
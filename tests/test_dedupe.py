@@ -0,0 +1,87 @@
+"""本次运行中的产品去重"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from emag_crawler.dedupe import DedupeIndex
+from emag_crawler.models import ProductCardItem
+
+
+def _item(pnk: str, rank: int, category: str = 'test', **fields: object) -> ProductCardItem:
+    return ProductCardItem(
+        title=f'Produs {pnk}',
+        pnk=pnk,
+        product_id=f'1{pnk}',
+        category=category,
+        source_url=f'https://www.emag.ro/{category}/c',
+        rank_in_page=rank,
+        review=0,
+        **fields,  # type: ignore
+    )
+
+
+class DedupeIndexTest(unittest.TestCase):
+    def test_resolve(self) -> None:
+        index = DedupeIndex(crawl_date='2026-10-10')
+        index.record_resolved([_item('A', 1, max_qty=4, cart_added=True), _item('B', 2)])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.get('A', '1A'), 4)
+
+        items = [_item('A', 5, category='other'), _item('B', 6, category='other')]
+        self.assertEqual([p.pnk for p in index.resolve(items)], ['A'])
+        # 取用的产品没有加购
+        self.assertEqual((items[0].max_qty, items[0].deduped, items[0].cart_added), (4, True, False))
+        self.assertIsNone(items[1].max_qty)
+
+    def test_skips_borrowed(self) -> None:
+        index = DedupeIndex()
+        index.record_resolved(
+            [_item('A', 1, max_qty=4, max_qty_cached=True), _item('B', 2, max_qty=2, deduped=True)]
+        )
+        self.assertEqual(len(index), 0)
+
+    def test_product_id_must_match(self) -> None:
+        index = DedupeIndex()
+        index.record_resolved([_item('A', 1, max_qty=4)])
+        item = _item('A', 2)
+        item.product_id = '999'
+        self.assertEqual(index.resolve([item]), [])
+
+    def test_occurrences(self) -> None:
+        index = DedupeIndex()
+        index.record_occurrences([_item('A', 3), _item('B', 1)])
+        index.record_occurrences([_item('A', 2, category='other')])
+        # 同一个位置重复记录时覆盖
+        index.record_occurrences([_item('A', 3)])
+
+        occurrences = index.occurrences('A')
+        self.assertEqual(
+            [(_['category'], _['rank_in_category']) for _ in occurrences], [('other', 2), ('test', 3)]
+        )
+
+    def test_persistence(self) -> None:
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'dedupe.db'
+            index = DedupeIndex(path, '2026-10-10')
+            index.record_resolved([_item('A', 1, max_qty=4)])
+            index.record_occurrences([_item('A', 1)])
+            index.close()
+
+            # 重新运行时载入当天的记录
+            index = DedupeIndex(path, '2026-10-10')
+            self.assertEqual(index.get('A', '1A'), 4)
+            self.assertEqual(len(index.occurrences('A')), 1)
+            index.close()
+
+            # 其他日期不载入
+            index = DedupeIndex(path, '2026-10-11')
+            self.assertEqual(len(index), 0)
+            self.assertEqual(index.occurrences('A'), [])
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""产品的历史数据"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from emag_crawler.history import HistoryStore
+from emag_crawler.models import ProductCardItem
+
+
+def _item(pnk: str, rank: int, page_num: int = 1, **fields: object) -> ProductCardItem:
+    return ProductCardItem(
+        title=f'Produs {pnk}',
+        pnk=pnk,
+        product_id=f'1{pnk}',
+        category='test',
+        source_url=f'https://www.emag.ro/test/p{page_num}/c',
+        rank_in_page=rank,
+        review=0,
+        **fields,  # type: ignore
+    )
+
+
+class HistoryStoreUpsertTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = TemporaryDirectory()
+        self.store = HistoryStore(Path(self._dir.name) / 'history.db', '2026-10-10')
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self._dir.cleanup()
+
+    def test_keeps_best_rank(self) -> None:
+        # 同一天同一类目内出现多次时只保留排名最靠前的那次
+        self.store.record_items([_item('A', 5, page_num=2, price=10.0)])
+        self.store.record_items([_item('A', 3, price=12.0)])
+        self.store.record_items([_item('A', 7, page_num=3, price=15.0)])
+
+        rows = self.store.product_history('A')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['rank_in_category'], rows[0]['price']), (3, 12.0))
+
+    def test_one_row_per_date(self) -> None:
+        self.store.record_items([_item('A', 1, price=10.0)], '2026-10-09')
+        self.store.record_items([_item('A', 2, price=11.0)])
+
+        rows = self.store.product_history('A')
+        self.assertEqual([r['crawl_date'] for r in rows], ['2026-10-09', '2026-10-10'])
+        self.assertEqual(self.store.dates('test'), ['2026-10-09', '2026-10-10'])
+
+    def test_max_qty_date(self) -> None:
+        self.store.record_items([_item('A', 1, max_qty=4, cart_added=True)], '2026-10-08')
+        self.store.record_items([_item('A', 1, max_qty=4, max_qty_cached=True)], '2026-10-09')
+        self.store.record_items([_item('A', 1)])
+
+        rows = self.store.product_history('A')
+        # 复用缓存的产品沿用原来解析到最大可加购数的日期
+        self.assertEqual([r['max_qty_date'] for r in rows], ['2026-10-08', '2026-10-08', None])
+        self.assertEqual([r['cart_added'] for r in rows], [1, 0, 0])
+
+    def test_max_qty_cache(self) -> None:
+        self.store.record_items([_item('A', 1, price=10.0, max_qty=4), _item('B', 2)], '2026-10-09')
+        self.store.record_items([_item('C', 3, max_qty=2)], '2026-10-01')
+
+        cache = self.store.max_qty_cache('test', ttl_days=3)
+        self.assertEqual(len(cache), 1)
+
+        items = [_item('A', 1, price=10.0), _item('B', 2), _item('C', 3)]
+        self.assertEqual([p.pnk for p in cache.apply(items)], ['A'])
+        self.assertEqual((items[0].max_qty, items[0].max_qty_cached), (4, True))
+
+        # 价格变化时不复用
+        self.assertEqual(cache.apply([_item('A', 1, price=11.0)]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
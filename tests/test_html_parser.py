@@ -0,0 +1,91 @@
+"""DOM 解析与离线解析（lxml）的一致性测试"""
+
+from __future__ import annotations
+
+import unittest
+
+from playwright.async_api import Error as PlaywrightError, async_playwright
+
+from benchmarks.fake_emag import FakeEmagConfig, FakeEmagServer
+from emag_crawler.handlers.category_page import locate_product_cards, parse_card_items
+from emag_crawler.html_parser import parse_category_html
+
+_category = 'test'
+_source_url = 'https://www.emag.ro/test/p2/c'
+
+
+def _fixture_html(page_num: int = 2) -> str:
+    """模拟 eMAG 的第 page_num 页：每 10 个产品插入一个 Promovat 卡片，部分卡片没有评分、评论数"""
+    return FakeEmagServer(FakeEmagConfig(product_count=150)).category_html(page_num)
+
+
+class ParseCategoryHtmlTest(unittest.TestCase):
+    """离线解析 fake_emag 渲染的类目页"""
+
+    def test_cards(self) -> None:
+        items = parse_category_html(_fixture_html(), _category, _source_url)
+
+        # Promovat 卡片被过滤
+        self.assertEqual(len(items), 60)
+        self.assertEqual([_.rank_in_page for _ in items], list(range(1, 61)))
+        self.assertEqual(items[0].product_id, '100061')
+        self.assertEqual(items[0].rank_in_category, 61)
+
+        first = items[0]
+        self.assertEqual(first.pnk, 'D00100061')
+        self.assertEqual(first.title, 'Produs de test 100061')
+        self.assertEqual(first.price, 261.99)
+        self.assertEqual(first.rating, 4.1)
+        self.assertEqual(first.review, 183)
+        self.assertFalse(first.top_favorite)
+        self.assertEqual(first.source_url, _source_url)
+
+        # 第 64 名没有评分、评论数，第 65 名带 Top Favorite 标志
+        self.assertIsNone(items[3].rating)
+        self.assertEqual(items[3].review, 0)
+        self.assertTrue(items[4].top_favorite)
+
+    def test_canonical_source_url(self) -> None:
+        html = _fixture_html().replace('<head>', f'<head><link rel="canonical" href="{_source_url}">', 1)
+        items = parse_category_html(html, _category)
+        self.assertEqual({_.source_url for _ in items}, {_source_url})
+
+    def test_missing_canonical(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_category_html(_fixture_html(), _category)
+
+
+class ParserParityTest(unittest.IsolatedAsyncioTestCase):
+    """同一个类目页 HTML 分别用 Playwright（parse_card_items）和 lxml（parse_category_html）解析，结果逐个字段一致"""
+
+    async def asyncSetUp(self) -> None:
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.launch()
+        except PlaywrightError as pe:
+            await self._playwright.stop()
+            self.skipTest(f'无法启动 Chromium：{str(pe).splitlines()[0]}')
+
+    async def asyncTearDown(self) -> None:
+        await self._browser.close()
+        await self._playwright.stop()
+
+    async def test_parity(self) -> None:
+        for page_num in (1, 2, 3):
+            html = _fixture_html(page_num)
+            page = await self._browser.new_page()
+            await page.set_content(html)
+
+            dom_items = await parse_card_items(locate_product_cards(page), _category, _source_url)
+            html_items = parse_category_html(html, _category, _source_url)
+            await page.close()
+
+            self.assertGreater(len(dom_items), 0)
+            self.assertEqual(len(dom_items), len(html_items))
+            for dom_item, html_item in zip(dom_items, html_items):
+                with self.subTest(page_num=page_num, rank=dom_item.rank_in_page):
+                    self.assertEqual(dom_item.model_dump(), html_item.model_dump())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""加购节奏控制"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import TYPE_CHECKING
+import unittest
+
+from loguru import logger
+
+from emag_crawler.pacing import AddToCartPacer, PacingConfig
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Optional
+
+
+class _Request:
+    def __init__(self, url: str, failure: Optional[str] = None) -> None:
+        self.url = url
+        self.failure = failure
+
+
+class _Response:
+    def __init__(self, request: _Request, status: int) -> None:
+        self.request = request
+        self.status = status
+
+
+class _Page:
+    """只实现 AddToCartPacer 用到的事件接口"""
+
+    def __init__(self) -> None:
+        self.handlers: dict[str, list[Callable[[Any], None]]] = dict()
+
+    def on(self, event: str, handler: Callable[[Any], None]) -> None:
+        self.handlers.setdefault(event, list()).append(handler)
+
+    def remove_listener(self, event: str, handler: Callable[[Any], None]) -> None:
+        self.handlers[event].remove(handler)
+
+    def emit(self, event: str, arg: Any) -> None:
+        for handler in list(self.handlers.get(event, ())):
+            handler(arg)
+
+
+_url = 'https://www.emag.ro/newaddtocart'
+
+
+class AddToCartPacerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.page = _Page()
+        config = PacingConfig(initial_interval=0.5, min_interval=0.1, initial_inflight=2, max_inflight=3)
+        self.pacer = AddToCartPacer(self.page, re.compile(r'/newaddtocart'), logger, config)  # type: ignore
+
+    def _send(self, url: str = _url) -> _Request:
+        request = _Request(url)
+        self.page.emit('request', request)
+        return request
+
+    def test_speedup(self) -> None:
+        self.page.emit('response', _Response(self._send(), 200))
+        self.assertEqual(self.pacer.inflight, 0)
+        self.assertAlmostEqual(self.pacer.interval, 0.4)
+        self.assertEqual(self.pacer.inflight_limit, 3)
+
+        # 不超过 min_interval、max_inflight
+        for _ in range(20):
+            self.page.emit('response', _Response(self._send(), 200))
+        self.assertAlmostEqual(self.pacer.interval, 0.1)
+        self.assertEqual(self.pacer.inflight_limit, 3)
+
+    def test_backoff(self) -> None:
+        self.page.emit('response', _Response(self._send(), 511))
+        self.assertAlmostEqual(self.pacer.interval, 1.0)
+        self.assertEqual(self.pacer.inflight_limit, 1)
+        self.assertEqual(self.pacer.error_rate, 1.0)
+
+        request = self._send()
+        request.failure = 'net::ERR_CONNECTION_RESET'
+        self.page.emit('requestfailed', request)
+        self.assertAlmostEqual(self.pacer.interval, 2.0)
+        self.assertEqual(self.pacer.inflight_limit, 1)
+
+    def test_ignored_requests(self) -> None:
+        # url 不匹配的请求不计入
+        self._send('https://www.emag.ro/other')
+        self.assertEqual(self.pacer.inflight, 0)
+
+        # 被拦截的重复加购请求不算失败
+        request = self._send()
+        request.failure = 'net::ERR_ABORTED'
+        self.page.emit('requestfailed', request)
+        self.assertEqual(self.pacer.inflight, 0)
+        self.assertEqual(self.pacer.interval, 0.5)
+        self.assertEqual(self.pacer.error_rate, 0.0)
+
+    async def test_acquire_waits_for_capacity(self) -> None:
+        self.pacer.interval = 0.0
+        first, _ = self._send(), self._send()
+
+        task = asyncio.create_task(self.pacer.acquire())
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+
+        self.page.emit('response', _Response(first, 200))
+        await asyncio.wait_for(task, 1.0)
+
+    def test_close(self) -> None:
+        self.pacer.close()
+        self._send()
+        self.assertEqual(self.pacer.inflight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
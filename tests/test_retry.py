@@ -0,0 +1,102 @@
+"""重试策略与熔断器"""
+
+from __future__ import annotations
+
+import unittest
+
+from emag_crawler.retry import CircuitBreaker, RetryError, RetryPolicy, retry
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay(self) -> None:
+        policy = RetryPolicy(base_delay=0.5, max_delay=3.0, multiplier=2.0, jitter=0.0)
+        self.assertEqual([policy.delay(_) for _ in range(1, 6)], [0.5, 1.0, 2.0, 3.0, 3.0])
+
+    def test_jitter(self) -> None:
+        policy = RetryPolicy(base_delay=1.0, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(0.5 <= policy.delay(1) <= 1.0)
+
+
+class RetryTest(unittest.IsolatedAsyncioTestCase):
+    async def test_succeeds_after_failures(self) -> None:
+        attempts = 0
+
+        async def operation() -> str:
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise ValueError(attempts)
+            return 'ok'
+
+        policy = RetryPolicy(max_attempts=5, base_delay=0.0)
+        self.assertEqual(await retry(operation, 'test', policy, retry_on=(ValueError,)), 'ok')
+        self.assertEqual(attempts, 3)
+
+    async def test_gives_up(self) -> None:
+        async def operation() -> None:
+            raise ValueError('boom')
+
+        policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+        with self.assertRaises(RetryError) as cm:
+            await retry(operation, 'test', policy, retry_on=(ValueError,))
+        self.assertEqual(cm.exception.attempts, 3)
+        self.assertIsInstance(cm.exception.last_error, ValueError)
+
+    async def test_other_errors_not_retried(self) -> None:
+        attempts = 0
+
+        async def operation() -> None:
+            nonlocal attempts
+            attempts += 1
+            raise KeyError('boom')
+
+        with self.assertRaises(KeyError):
+            await retry(operation, 'test', RetryPolicy(base_delay=0.0), retry_on=(ValueError,))
+        self.assertEqual(attempts, 1)
+
+    async def test_records_to_breaker(self) -> None:
+        async def operation() -> None:
+            raise ValueError('boom')
+
+        breaker = CircuitBreaker('test', min_calls=2, cooldown=60.0)
+        with self.assertRaises(RetryError):
+            await retry(
+                operation, 'test', RetryPolicy(max_attempts=2, base_delay=0.0), breaker, (ValueError,)
+            )
+        self.assertTrue(breaker.open)
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_opens_on_error_rate(self) -> None:
+        breaker = CircuitBreaker('test', window=4, min_calls=4, max_error_rate=0.5, cooldown=60.0)
+        for ok in (True, False, True, False):
+            breaker.record(ok)
+        # 错误率 50% 没有超过 max_error_rate
+        self.assertFalse(breaker.open)
+
+        breaker.record(False)
+        self.assertTrue(breaker.open)
+
+    async def test_min_calls(self) -> None:
+        breaker = CircuitBreaker('test', min_calls=3, cooldown=60.0)
+        breaker.record(False)
+        breaker.record(False)
+        self.assertFalse(breaker.open)
+        breaker.record(False)
+        self.assertTrue(breaker.open)
+
+    async def test_wait_until_closed(self) -> None:
+        breaker = CircuitBreaker('test', min_calls=1, cooldown=0.05)
+        breaker.record(False)
+        self.assertTrue(breaker.open)
+        await breaker.wait()
+        self.assertFalse(breaker.open)
+
+        # 关闭后重新统计
+        breaker.record(True)
+        self.assertFalse(breaker.open)
+
+
+if __name__ == '__main__':
+    unittest.main()
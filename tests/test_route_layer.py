@@ -0,0 +1,55 @@
+"""按 HTTP 缓存响应头计算静态资源缓存的有效期"""
+
+from __future__ import annotations
+
+from email.utils import formatdate
+from time import time
+import unittest
+
+from emag_crawler.route_layer import _freshness_lifetime
+
+_max_age = 7 * 24 * 3600.0
+
+
+class FreshnessLifetimeTest(unittest.TestCase):
+    def test_max_age(self) -> None:
+        self.assertEqual(_freshness_lifetime({'cache-control': 'public, max-age=600'}, _max_age), 600.0)
+        # 减去 Age，不超过 max_age
+        self.assertEqual(_freshness_lifetime({'cache-control': 'max-age=600', 'age': '100'}, _max_age), 500.0)
+        self.assertEqual(_freshness_lifetime({'cache-control': 'max-age=31536000'}, _max_age), _max_age)
+
+    def test_max_age_over_expires(self) -> None:
+        headers = {'cache-control': 'max-age=600', 'expires': formatdate(time() + 60, usegmt=True)}
+        self.assertEqual(_freshness_lifetime(headers, _max_age), 600.0)
+
+    def test_expires(self) -> None:
+        now = time()
+        headers = {'date': formatdate(now, usegmt=True), 'expires': formatdate(now + 3600, usegmt=True)}
+        self.assertAlmostEqual(_freshness_lifetime(headers, _max_age), 3600.0, delta=1.0)  # type: ignore
+
+        # 无效的 Expires 视为已过期，有 ETag 时仍可以重新验证
+        self.assertEqual(_freshness_lifetime({'expires': '0', 'etag': '"abc"'}, _max_age), 0.0)
+        self.assertIsNone(_freshness_lifetime({'expires': '0'}, _max_age))
+
+    def test_last_modified_heuristic(self) -> None:
+        now = time()
+        headers = {
+            'date': formatdate(now, usegmt=True),
+            'last-modified': formatdate(now - 10000, usegmt=True),
+        }
+        self.assertAlmostEqual(_freshness_lifetime(headers, _max_age), 1000.0, delta=1.0)  # type: ignore
+
+    def test_no_store(self) -> None:
+        self.assertIsNone(_freshness_lifetime({'cache-control': 'no-store, max-age=600'}, _max_age))
+
+    def test_no_cache(self) -> None:
+        # 每次使用前都要重新验证，没有 validators 时不缓存
+        self.assertEqual(_freshness_lifetime({'cache-control': 'no-cache', 'etag': '"abc"'}, _max_age), 0.0)
+        self.assertIsNone(_freshness_lifetime({'cache-control': 'no-cache'}, _max_age))
+
+    def test_no_headers(self) -> None:
+        self.assertIsNone(_freshness_lifetime({}, _max_age))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""逐行写入爬取结果的 jsonl"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from emag_crawler.models import ProductCardItem
+from emag_crawler.sink import JsonlSink, read_jsonl_items
+
+
+def _item(rank: int) -> ProductCardItem:
+    return ProductCardItem(
+        title=f'Produs de test {rank}',
+        pnk=f'D{rank:08d}',
+        product_id=str(100000 + rank),
+        category='test',
+        source_url='https://www.emag.ro/test/c',
+        rank_in_page=rank,
+        review=0,
+    )
+
+
+class JsonlSinkTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self._dir = TemporaryDirectory()
+        self.dir = Path(self._dir.name)
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    async def test_commit(self) -> None:
+        path = self.dir / '1.jsonl'
+        sink = JsonlSink(path)
+        items = [_item(1), _item(2)]
+        sink.write_items(items)
+        self.assertEqual(await sink.close(), path)
+
+        self.assertTrue(path.exists())
+        self.assertFalse(path.with_name('1.jsonl.part').exists())
+        self.assertEqual(read_jsonl_items(path), [_.model_dump(mode='json') for _ in items])
+
+    async def test_uncommitted(self) -> None:
+        path = self.dir / '1.jsonl'
+        sink = JsonlSink(path)
+        sink.write_items([_item(1)])
+        part_path = await sink.close(commit=False)
+
+        self.assertEqual(part_path, path.with_name('1.jsonl.part'))
+        self.assertFalse(path.exists())
+
+    async def test_patch(self) -> None:
+        path = self.dir / '1.jsonl'
+        sink = JsonlSink(path)
+        items = [_item(1), _item(2), _item(3)]
+        sink.write_items(items)
+
+        items[0].cart_added, items[0].max_qty = True, 5
+        items[2].deduped, items[2].max_qty = True, 2
+        sink.write_patches(items)
+        # 与已写入的相同时跳过
+        sink.write_patches(items)
+        await sink.close()
+
+        lines = path.read_text().splitlines()
+        self.assertEqual(sum(1 for _ in lines if _.startswith('{"patch"')), 2)
+
+        records = read_jsonl_items(path)
+        self.assertEqual([_['rank_in_page'] for _ in records], [1, 2, 3])
+        self.assertEqual((records[0]['cart_added'], records[0]['max_qty']), (True, 5))
+        self.assertEqual((records[1]['cart_added'], records[1]['max_qty']), (False, None))
+        self.assertEqual((records[2]['deduped'], records[2]['max_qty']), (True, 2))
+
+    async def test_closed(self) -> None:
+        sink = JsonlSink(self.dir / '1.jsonl')
+        await sink.close()
+        with self.assertRaises(RuntimeError):
+            sink.write_items([_item(1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""按页面事件统计进行中的请求"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+import unittest
+
+from emag_crawler.utils import RequestTracker
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+
+class _Request:
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+
+class _Page:
+    """只实现 RequestTracker 用到的事件接口"""
+
+    def __init__(self) -> None:
+        self.handlers: dict[str, list[Callable[[Any], None]]] = dict()
+
+    def on(self, event: str, handler: Callable[[Any], None]) -> None:
+        self.handlers.setdefault(event, list()).append(handler)
+
+    def remove_listener(self, event: str, handler: Callable[[Any], None]) -> None:
+        self.handlers[event].remove(handler)
+
+    def emit(self, event: str, arg: Any) -> None:
+        for handler in list(self.handlers.get(event, ())):
+            handler(arg)
+
+
+_url = 'https://www.emag.ro/cart/remove'
+
+
+class WaitForCapacityTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.page = _Page()
+        self.tracker = RequestTracker(self.page, r'/cart/remove')  # type: ignore
+
+    def tearDown(self) -> None:
+        self.tracker.close()
+
+    async def test_below_limit(self) -> None:
+        self.page.emit('request', _Request(_url))
+        self.assertTrue(await self.tracker.wait_for_capacity(2, 10))
+
+    async def test_waits_until_request_done(self) -> None:
+        first, second = _Request(_url), _Request(_url)
+        self.page.emit('request', first)
+        self.page.emit('request', second)
+        self.assertEqual(self.tracker.inflight, 2)
+
+        task = asyncio.create_task(self.tracker.wait_for_capacity(2, 1000))
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+
+        self.page.emit('requestfailed', first)
+        self.assertTrue(await asyncio.wait_for(task, 1.0))
+        self.assertEqual(self.tracker.inflight, 1)
+
+    async def test_timeout(self) -> None:
+        self.page.emit('request', _Request(_url))
+        self.assertFalse(await self.tracker.wait_for_capacity(1, 50))
+
+    async def test_url_filter(self) -> None:
+        other = _Request('https://www.emag.ro/other')
+        self.page.emit('request', other)
+        self.assertEqual(self.tracker.inflight, 0)
+        # 没有统计的请求完成时不影响计数
+        self.page.emit('requestfinished', other)
+        self.assertTrue(await self.tracker.wait_for_capacity(1, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
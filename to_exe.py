@@ -4,10 +4,15 @@ from __future__ import annotations
 
 import asyncio
 from contextlib import asynccontextmanager
+import csv
+import json
 from math import ceil
 from pathlib import Path
 import subprocess
+import sys
+from time import perf_counter
 from typing import TYPE_CHECKING, overload
+from weakref import WeakKeyDictionary
 
 from openpyxl import Workbook
 from openpyxl.worksheet.hyperlink import Hyperlink
@@ -20,7 +25,7 @@ from scraper_utils.constants.workbook_style import (
 )
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 from scraper_utils.utils.browser_util import abort_resources, ResourceType, MS1000
-from scraper_utils.utils.json_util import write_json_sync, read_json_sync
+from scraper_utils.utils.json_util import write_json_sync
 from scraper_utils.utils.time_util import now_str
 from scraper_utils.utils.workbook_util import write_workbook_sync, column_int2str as i2s
 
@@ -29,11 +34,22 @@ from emag_crawler.handlers.category_page import (
     get_product_count_of_category,
     category_handler,
 )
+from emag_crawler.archive import iter_products
+from emag_crawler.cart_probe import get_cart_probe
+from emag_crawler.checkpoint import CheckpointStore
+from emag_crawler.dedupe import DedupeIndex
+from emag_crawler.history import HistoryStore
 from emag_crawler.logger import logger as _logger
+from emag_crawler.metrics import metric_tags, metrics
+from emag_crawler.models import CrawlReport
+from emag_crawler.retry import RetryError
+from emag_crawler.route_layer import RouteConfig, RouteLayer, get_asset_cache
+from emag_crawler.sink import JsonlSink
 from emag_crawler.utils import build_category_page_url
+from emag_crawler.xlsx_export import write_products_xlsx
 
 if TYPE_CHECKING:
-    from typing import AsyncGenerator, Literal
+    from typing import AsyncGenerator, Iterable, Iterator, Literal, Optional
 
     from openpyxl.worksheet.worksheet import Worksheet
     from playwright.async_api import Browser, BrowserContext
@@ -41,10 +57,43 @@ if TYPE_CHECKING:
 
 cwd = Path.cwd()
 
+_USE_HTTP_CART_PROBE = False
+"""是否先用 HTTP 请求探测最大可加购数，探测失败的产品再点击加购"""
+
+_EXPORT_PROMETHEUS_METRICS = False
+"""是否额外将耗时统计导出为 Prometheus 的文本格式"""
+
+_MAX_QTY_TTL_DAYS = 3
+"""增量爬取时，距离上次解析到最大可加购数不超过该天数、且 pnk、data-offer-id、价格都没有变化的产品直接复用"""
+
+_FULL_REFRESH = False
+"""是否不复用之前爬取的最大可加购数，所有产品都重新加购"""
+
+_CART_BATCH_SIZE = 40
+"""每加购多少个产品解析一次购物车并清空，不能超过购物车能容纳的产品数"""
+
+_PIPELINED_CARTS = False
+"""是否用两个 context 的购物车轮流加购，一个购物车在解析、清空时，另一个继续加购"""
+
+_ROUTE_CONFIG = RouteConfig()
+"""请求拦截的配置：缓存到磁盘的静态资源类型、缓存大小、放行和拦截的第三方 host"""
+
+_USE_ASSET_CACHE = True
+"""是否把 js 等静态资源缓存到 output/asset_cache，重复的请求直接从磁盘返回"""
+
+_paired_contexts: WeakKeyDictionary[BrowserContext, BrowserContext] = WeakKeyDictionary()
+"""流水线模式下每个 context 配对的另一个 context"""
+
 
 def main():
     _logger.info('程序启动')
 
+    # 传入任务文件时批量爬取
+    if len(sys.argv) > 1:
+        main_batch(Path(sys.argv[1]))
+        _logger.info('程序结束')
+        return
+
     # 输入要爬取的类目与其链接
     category, url = input_crawl_targe()
 
@@ -55,17 +104,130 @@ def main():
     json_save_dir = cwd / f'output/{category}/{today}'
     xlsx_save_path = cwd / f'output/{category}-{today}.xlsx'
 
-    # 爬取数据
-    asyncio.run(start_crawler(category, url, json_save_dir))
+    # 爬取数据，中断后重新运行会从断点继续
+    checkpoint = CheckpointStore(cwd / 'output/checkpoint.sqlite3', today)
+    history = HistoryStore(cwd / 'output/history.sqlite3')
+    dedupe = DedupeIndex(cwd / 'output/dedupe.sqlite3', today)
+    try:
+        asyncio.run(
+            start_crawler(category, url, json_save_dir, checkpoint=checkpoint, history=history, dedupe=dedupe)
+        )
+    finally:
+        checkpoint.close()
+        history.close()
+        dedupe.close()
+        save_metrics(cwd / 'output')
 
     # 将爬取的 json 数据保存成 xlsx
-    wb, ws = create_workbook_template()
-    products = read_product_json(json_save_dir)
-    save_to_xlsx(wb, ws, products, xlsx_save_path)
+    export_xlsx(read_product_json(json_save_dir), xlsx_save_path)
 
     _logger.info('程序结束')
 
 
+def main_batch(jobs_path: Path) -> None:
+    """从任务文件读取多个类目，在同一个浏览器会话里批量爬取"""
+    jobs = read_crawl_jobs(jobs_path)
+    _logger.info(f'从 "{jobs_path}" 读取到 {len(jobs)} 个类目')
+
+    # 启动 CDP
+    launch_cdp()
+
+    today = now_str('%m%d')
+
+    # 爬取数据，中断后重新运行会从断点继续
+    checkpoint = CheckpointStore(cwd / 'output/checkpoint.sqlite3', today)
+    history = HistoryStore(cwd / 'output/history.sqlite3')
+    dedupe = DedupeIndex(cwd / 'output/dedupe.sqlite3', today)
+    try:
+        reports = asyncio.run(
+            start_batch_crawler(
+                jobs, cwd / 'output', today, checkpoint=checkpoint, history=history, dedupe=dedupe
+            )
+        )
+    finally:
+        checkpoint.close()
+        history.close()
+        dedupe.close()
+        save_metrics(cwd / 'output')
+
+    # 将爬取的 json 数据保存成 xlsx
+    for r in reports:
+        json_save_dir = cwd / f'output/{r.category}/{today}'
+        if len(r.crawled_pages) == 0:
+            continue
+        export_xlsx(read_product_json(json_save_dir), cwd / f'output/{r.category}-{today}.xlsx')
+
+    # 汇总报告
+    (cwd / 'output').mkdir(parents=True, exist_ok=True)
+    summary_path = write_json_sync(
+        cwd / f'output/summary-{now_str('%m%d-%H%M%S')}.json',
+        [_.model_dump() for _ in reports],
+        indent=4,
+    )
+    log_crawl_summary(reports)
+    _logger.success(f'汇总报告已保存至 "{summary_path}"')
+
+
+def save_metrics(save_dir: Path) -> None:
+    """保存本次运行的耗时统计与计数"""
+    save_dir.mkdir(parents=True, exist_ok=True)
+    name = f'metrics-{now_str('%m%d-%H%M%S')}'
+
+    save_path = write_json_sync(save_dir / f'{name}.json', metrics.summary(), indent=4)
+    _logger.info(f'耗时统计已保存至 "{save_path}"')
+
+    if _EXPORT_PROMETHEUS_METRICS:
+        prom_path = save_dir / f'{name}.prom'
+        prom_path.write_text(metrics.to_prometheus(), encoding='utf-8')
+        _logger.info(f'Prometheus 格式的耗时统计已保存至 "{prom_path}"')
+
+
+def read_crawl_jobs(path: Path) -> list[tuple[str, str]]:
+    """
+    读取爬取任务文件，返回 [(类目, 类目页第一页的链接)]
+
+    支持 jsonl（每行一个 {"category": ..., "url": ...}）和带表头的 csv（category,url 两列）；
+    重复的任务只保留第一条，它们会写入同一个目录、同一份爬取报告
+    """
+    if path.suffix == '.csv':
+        with path.open(encoding='utf-8-sig', newline='') as f:
+            rows: list[dict[str, str]] = list(csv.DictReader(f))
+    else:
+        with path.open(encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip() != '']
+
+    jobs: list[tuple[str, str]] = list()
+    seen: set[tuple[str, str]] = set()
+    for line_num, row in enumerate(rows, 1):
+        category = (row.get('category') or '').strip()
+        url = (row.get('url') or row.get('first_page_url') or '').strip()
+        if len(category) < 2 or len(url) < 2:
+            _logger.warning(f'"{path}" 的第 {line_num} 条任务的类目或链接不对，已跳过')
+            continue
+        if (category, url) in seen:
+            _logger.warning(f'"{path}" 的第 {line_num} 条任务与之前的任务重复，已跳过')
+            continue
+        seen.add((category, url))
+        jobs.append((category, url))
+
+    return jobs
+
+
+def log_crawl_summary(reports: list[CrawlReport]) -> None:
+    """输出爬取汇总"""
+    lines = [
+        f'{r.category}: 成功 {len(r.crawled_pages)} 页、失败 {len(r.failed_pages)} 页，'
+        f'产品 {r.crawled_products} 个、加购成功 {r.cart_added_products} 个，'
+        f'复用 {r.cached_products} 个、去重 {r.deduped_products} 个、探测 {r.probed_products} 个，'
+        f'耗时 {r.elapsed:.1f}s' + ('' if r.error is None else f'，出错 {r.error}')
+        for r in reports
+    ]
+    _logger.info(
+        f'共爬取 {len(reports)} 个类目、{sum(r.crawled_products for r in reports)} 个产品\n'
+        + '\n'.join(lines)
+    )
+
+
 def launch_cdp(port: str = '9222') -> None:
     """启动 CDP"""
 
@@ -92,24 +254,237 @@ def launch_cdp(port: str = '9222') -> None:
     )
 
 
-async def start_crawler(category: str, first_page_url: str, json_save_dir: Path) -> None:
+async def start_crawler(
+    category: str,
+    first_page_url: str,
+    json_save_dir: Path,
+    concurrency: int = 3,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
+) -> None:
+    """爬取一个类目，第 1 页之后的页面最多同时爬取 concurrency 页"""
     async with connect_browser() as browser:
         context = browser.contexts[0]
-        context.set_default_navigation_timeout(0)
-        context.set_default_timeout(5 * MS1000)
-        await abort_resources(
+        await setup_context(context)
+
+        await crawl_category(
+            browser,
             context,
-            (ResourceType.IMAGE, ResourceType.MEDIA, ResourceType.FONT, ResourceType.STYLESHEET),
+            category,
+            first_page_url,
+            json_save_dir,
+            concurrency,
+            checkpoint,
+            history,
+            dedupe,
         )
+        await close_paired_context(context)
+
+
+async def start_batch_crawler(
+    jobs: list[tuple[str, str]],
+    output_dir: Path,
+    today: str,
+    concurrency: int = 3,
+    page_concurrency: int = 1,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
+) -> list[CrawlReport]:
+    """
+    在同一个浏览器会话里批量爬取多个类目
 
+    最多同时爬取 concurrency 个类目，每个类目最多同时爬取 page_concurrency 页
+    """
+    queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    reports: dict[tuple[str, str], CrawlReport] = dict()
+
+    async with connect_browser() as browser:
+
+        async def worker(worker_id: int) -> None:
+            # 每个 worker 使用各自的 context，避免购物车冲突；新建的 context 未登录，见 new_isolated_context
+            if worker_id == 0:
+                context = browser.contexts[0]
+                await setup_context(context)
+            else:
+                context = await new_isolated_context(browser)
+
+            try:
+                while not queue.empty():
+                    category, url = queue.get_nowait()
+                    json_save_dir = output_dir / f'{category}/{today}'
+                    reports[(category, url)] = await crawl_category(
+                        browser,
+                        context,
+                        category,
+                        url,
+                        json_save_dir,
+                        page_concurrency,
+                        checkpoint,
+                        history,
+                        dedupe,
+                    )
+            finally:
+                await close_paired_context(context)
+                if worker_id != 0:
+                    await context.close()
+
+        worker_count = min(concurrency, queue.qsize())
+        await asyncio.gather(*(worker(i) for i in range(worker_count)))
+
+    # 按任务文件的顺序返回
+    return [reports[job] for job in jobs if job in reports]
+
+
+async def crawl_category(
+    browser: Browser,
+    context: BrowserContext,
+    category: str,
+    first_page_url: str,
+    json_save_dir: Path,
+    concurrency: int,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
+) -> CrawlReport:
+    """在 context 里爬取一个类目，第 1 页之后的页面最多同时爬取 concurrency 页，第 1 页打不开时类目记为失败"""
+    logger = _logger.bind(category=category)
+    report = CrawlReport(category=category, first_page_url=first_page_url)
+    start_time = perf_counter()
+
+    try:
         # 爬取第 1 页
-        product_count = await run_crawler(context, category, first_page_url, json_save_dir, 1)
+        with metric_tags(category=category, page=1):
+            product_count = await run_crawler(
+                context, category, first_page_url, json_save_dir, 1, report, checkpoint, history, dedupe
+            )
+        report.product_count = product_count
         max_page_num = min(5, ceil(product_count / 60))
-        _logger.debug(f'"{category}" 共有 {product_count} 个产品，最多爬取至第 {max_page_num} 页')
+        logger.debug(f'"{category}" 共有 {product_count} 个产品，最多爬取至第 {max_page_num} 页')
 
         # 爬取 2-[5] 页
-        for i in range(2, max_page_num + 1):
-            await run_crawler(context, category, first_page_url, json_save_dir, i)
+        await crawl_pages(
+            browser,
+            context,
+            category,
+            first_page_url,
+            json_save_dir,
+            range(2, max_page_num + 1),
+            concurrency,
+            report,
+            checkpoint,
+            history,
+            dedupe,
+        )
+    except BaseException as be:
+        logger.error(f'爬取 "{category}" 时出错\n{be}')
+        report.error = repr(be)
+
+    report.crawled_pages.sort()
+    report.failed_pages.sort()
+    report.elapsed = perf_counter() - start_time
+    logger.info(f'"{category}" 爬取完成，耗时 {report.elapsed:.1f}s')
+    return report
+
+
+async def setup_context(context: BrowserContext) -> None:
+    """设置 context 的超时时间，拦截不需要的资源和第三方 host，并缓存静态资源"""
+    context.set_default_navigation_timeout(0)
+    context.set_default_timeout(5 * MS1000)
+    await abort_resources(
+        context,
+        (ResourceType.IMAGE, ResourceType.MEDIA, ResourceType.FONT, ResourceType.STYLESHEET),
+    )
+
+    # 后注册的路由先处理请求，不处理的再交给 abort_resources
+    asset_cache = get_asset_cache(cwd / 'output/asset_cache', _ROUTE_CONFIG) if _USE_ASSET_CACHE else None
+    await RouteLayer(asset_cache, _ROUTE_CONFIG, _logger).install(context)
+
+
+async def new_isolated_context(browser: Browser) -> BrowserContext:
+    """
+    新建一个隔离的 context 并设置
+
+    NOTICE 不复制持久化 profile 的 storage_state（cookie），隔离的 context 以未登录状态爬取：
+    emag 的购物车按 cookie 区分，带上同一个会话的 cookie 就会和原 context 共用购物车，隔离也就失去了意义
+    """
+    context = await browser.new_context()
+    await setup_context(context)
+    return context
+
+
+async def get_paired_context(context: BrowserContext) -> BrowserContext:
+    """流水线模式下与 context 配对的 context，还没有时新建一个隔离的 context"""
+    paired = _paired_contexts.get(context)
+    if paired is None:
+        paired = await new_isolated_context(context.browser)  # type: ignore
+        _paired_contexts[context] = paired
+    return paired
+
+
+async def close_paired_context(context: BrowserContext) -> None:
+    """关闭与 context 配对的 context"""
+    paired = _paired_contexts.pop(context, None)
+    if paired is not None:
+        await paired.close()
+
+
+async def crawl_pages(
+    browser: Browser,
+    context: BrowserContext,
+    category: str,
+    first_page_url: str,
+    json_save_dir: Path,
+    page_nums: Iterable[int],
+    concurrency: int,
+    report: Optional[CrawlReport] = None,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
+) -> None:
+    """
+    用 concurrency 个 worker 并发爬取类目的多个页面
+
+    购物车是按 context 共享的，所以每个 worker 使用各自的 context：
+    第 1 个 worker 使用传入的 context，其余 worker 各自新建一个隔离的 context（未登录，见 new_isolated_context）
+    """
+    queue: asyncio.Queue[int] = asyncio.Queue()
+    for page_num in page_nums:
+        queue.put_nowait(page_num)
+
+    async def worker(worker_id: int) -> None:
+        if worker_id == 0:
+            worker_context = context
+        else:
+            worker_context = await new_isolated_context(browser)
+
+        try:
+            while not queue.empty():
+                page_num = queue.get_nowait()
+                _logger.debug(f'worker #{worker_id} 开始爬取 "{category}" 的第 {page_num} 页')
+                with metric_tags(category=category, page=page_num):
+                    await run_crawler(
+                        worker_context,
+                        category,
+                        first_page_url,
+                        json_save_dir,
+                        page_num,
+                        report,
+                        checkpoint,
+                        history,
+                        dedupe,
+                    )
+        finally:
+            if worker_id != 0:
+                await close_paired_context(worker_context)
+                await worker_context.close()
+
+    worker_count = min(concurrency, queue.qsize())
+    await asyncio.gather(*(worker(i) for i in range(worker_count)))
 
 
 def input_crawl_targe() -> tuple[str, str]:
@@ -154,12 +529,24 @@ async def run_crawler(
     first_page_url: str,
     json_save_dir: Path,
     page_num: Literal[1] = 1,
+    report: Optional[CrawlReport] = None,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
 ) -> int: ...
 
 
 @overload
 async def run_crawler(
-    context: BrowserContext, category: str, first_page_url: str, json_save_dir: Path, page_num: int
+    context: BrowserContext,
+    category: str,
+    first_page_url: str,
+    json_save_dir: Path,
+    page_num: int,
+    report: Optional[CrawlReport] = None,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
 ) -> None: ...
 
 
@@ -169,20 +556,43 @@ async def run_crawler(
     first_page_url: str,
     json_save_dir: Path,
     page_num: int = 1,
+    report: Optional[CrawlReport] = None,
+    checkpoint: Optional[CheckpointStore] = None,
+    history: Optional[HistoryStore] = None,
+    dedupe: Optional[DedupeIndex] = None,
 ):
     """
     爬取+保存爬取结果
 
-    如果爬取的是第 1 页，会返回该类目有多少个产品
+    如果爬取的是第 1 页，会返回该类目有多少个产品，第 1 页打不开时抛出 RetryError；传入 report 时会把该页的爬取情况记录到 report；
+    传入 checkpoint 时会跳过断点中已完成的页面和产品；传入 history 时会把该页的爬取结果记录到历史数据；
+    传入 dedupe 时，本次运行中其他页面、其他类目已解析到最大可加购数的产品不再加购
     """
 
     logger = _logger.bind(category=category)
+
+    page_checkpoint = None if checkpoint is None else checkpoint.page(category, page_num)
+    if page_checkpoint is not None and page_checkpoint.done:
+        logger.info(f'"{category}" 的第 {page_num} 页已在断点中完成，跳过')
+        if report is not None:
+            report.add_page(page_num, [item for _, item in page_checkpoint.load().values()])
+        if page_num == 1:
+            return checkpoint.get_product_count(category) or 0  # type: ignore
+        return
+
     logger.info(f'爬取 "{category}" 的第 {page_num} 页')
 
-    if page_num == 1:
-        page = await goto_category_page(context, first_page_url, logger)
-    else:
-        page = await goto_category_page(context, build_category_page_url(first_page_url, page_num), logger)
+    url = first_page_url if page_num == 1 else build_category_page_url(first_page_url, page_num)
+    try:
+        page = await goto_category_page(context, url, logger)
+    except RetryError as retry_error:
+        logger.error(f'打开 "{category}" 的第 {page_num} 页失败\n{retry_error}')
+        if report is not None:
+            report.failed_pages.append(page_num)
+        # 第 1 页打不开时不知道有多少页，整个类目记为失败
+        if page_num == 1:
+            raise
+        return
 
     product_count = 0
     if page_num == 1:
@@ -190,24 +600,62 @@ async def run_crawler(
             product_count = await get_product_count_of_category(page)
         except BaseException as be:
             logger.error(f'尝试解析 "{category}" 的产品总数时出错\n{be}')
+        else:
+            if checkpoint is not None:
+                checkpoint.set_product_count(category, product_count)
+
+    # 流水线模式下在配对的 context 里打开同一个类目页，两个购物车轮流使用
+    pipeline_page = None
+    if _PIPELINED_CARTS:
+        try:
+            pipeline_page = await goto_category_page(await get_paired_context(context), page.url, logger)
+        except RetryError as retry_error:
+            logger.warning(f'在配对的 context 里打开类目页失败，不使用流水线\n{retry_error}')
+
+    # 增量爬取，复用上一次爬取的最大可加购数
+    max_qty_cache = None
+    if history is not None and not _FULL_REFRESH:
+        max_qty_cache = await asyncio.to_thread(history.max_qty_cache, category, _MAX_QTY_TTL_DAYS)
+
+    # 边爬取边保存爬取结果为 jsonl
+    sink = JsonlSink(json_save_dir / f'{page_num}.jsonl')
 
     try:
         # 爬取数据
-        result = await category_handler(page, category, logger)
+        result = await category_handler(
+            page,
+            category,
+            logger,
+            checkpoint=page_checkpoint,
+            cart_probe=get_cart_probe(context) if _USE_HTTP_CART_PROBE else None,
+            sink=sink,
+            max_qty_cache=max_qty_cache,
+            dedupe=dedupe,
+            batch_size=_CART_BATCH_SIZE,
+            pipeline_page=pipeline_page,
+        )
     except BaseException as be:
         logger.error(f'爬取 "{category}" 的第 {page_num} 页时出错\n{be}')
+        if report is not None:
+            report.failed_pages.append(page_num)
+        try:
+            await sink.close(commit=False)
+        except BaseException as close_error:
+            logger.error(f'关闭 "{sink.path}" 时出错\n{close_error}')
     else:
-        # 保存爬取结果为 json
+        if report is not None:
+            report.add_page(page_num, result)
+
         logger.info(f'保存 "{category}" 的第 {page_num} 页的爬取结果')
-        json_save_dir.mkdir(parents=True, exist_ok=True)
-        json_save_path = json_save_dir / f'{page_num}.json'
-        save_path = write_json_sync(
-            json_save_path,
-            [_.model_dump() for _ in result],
-            indent=4,
-        )
+        save_path = await sink.close()
         logger.success(f'"{category}" 的第 {page_num} 页的爬取结果已保存至 "{save_path}"')
 
+        if history is not None:
+            await asyncio.to_thread(history.record_items, result)
+
+        if page_checkpoint is not None:
+            page_checkpoint.mark_done()
+
     if page_num == 1:
         return product_count
 
@@ -241,44 +689,15 @@ def create_workbook_template():
     return wb, ws
 
 
-def read_product_json(json_dir: Path):
-    """读取产品的 json 数据"""
-    result: list[dict[str, None | str | int | float | bool]] = list()
-
-    files = json_dir.glob('*.json')
-
-    for f in files:
-        # 读取 json 文件
-        data: list[dict[str, None | str | int | float | bool]] = read_json_sync(f)
-
-        # 筛选加购失败的记录、保留需要的字段、将清理结果添加到 result
-        for d in data:
-            # 筛选加购失败的记录
-            if d['cart_added'] is not True:
-                continue
-
-            # 保留需要的字段
-            result.append(
-                {
-                    'pnk': d['pnk'],
-                    'title': d['title'],
-                    'category': d['category'],
-                    'rank': d['rank_in_category'],
-                    'source_url': d['source_url'],
-                    'detail_url': d['detail_url'],
-                    'image_url': d['image_url'],
-                    'price': d['price'],
-                    'top_favorite': d['top_favorite'],
-                    'rating': d['rating'],
-                    'review': d['review'],
-                    'max_qty': d['max_qty'],
-                }
-            )
+def read_product_json(json_dir: Path) -> Iterator[dict[str, None | str | int | float | bool]]:
+    """按排名逐个读取已加购产品的数据，兼容旧的 json 和 JsonlSink 写入的 jsonl"""
+    return iter_products(json_dir)
 
-    # 按 rank 排序
-    result.sort(key=lambda _: _['rank'])  # type: ignore
 
-    return result.copy()
+def export_xlsx(data: Iterable[dict[str, None | str | int | float | bool]], save_path: Path) -> None:
+    """流式写入数据到表格，不在内存中保留整个表格"""
+    count = write_products_xlsx(data, save_path)
+    _logger.info(f'{count} 行数据的 xlsx 保存至 "{save_path}"')
 
 
 def save_to_xlsx(
@@ -287,7 +706,7 @@ def save_to_xlsx(
     data: list[dict[str, None | str | int | float | bool]],
     save_path: str | Path,
 ):
-    """写入数据到表格，并保存表格为文件"""
+    """写入数据到表格，并保存表格为文件（逐个单元格写入，数据量大时用 export_xlsx）"""
 
     for row, p in enumerate(data, 2):
         # pnk